@@ -0,0 +1,54 @@
+import asyncio
+
+import pytest
+
+import tierkreis.core.protos.tierkreis.v1alpha1.runtime as pr
+from tierkreis.core.tierkreis_graph import Location
+from tierkreis.worker import Namespace, prelude
+from tierkreis.worker.callback import CallbackPool
+from tierkreis.worker.worker import Worker
+
+
+@pytest.mark.asyncio
+async def test_callback_pool(monkeypatch):
+    # normally set up by the worker executable
+    monkeypatch.setattr(prelude, "profile_worker", False, raising=False)
+    # a worker also serves its signature, so can act as the callback server
+    ns = Namespace()
+
+    @ns.function()
+    async def square(x: int) -> int:
+        return x * x
+
+    worker = Worker(ns)
+    await worker.server.start("127.0.0.1", 0)
+    assert worker.server._server is not None
+    port = worker.server._server.sockets[0].getsockname()[1]
+    callback = pr.Callback(uri=f"http://127.0.0.1:{port}", loc=Location([]))
+
+    pool = CallbackPool()
+    try:
+        channels = []
+        for _ in range(3):
+            async with pool.connect(callback) as cb:
+                signature = await cb.get_signature()
+                assert "square" in signature.root.functions
+                channels.append(cb.runtime._channel)
+        # one connection, reused by every request
+        assert len(pool) == 1
+        assert channels[0] is channels[1] is channels[2]
+
+        pool.idle_timeout = 0
+        async with pool.connect(pr.Callback(uri="http://127.0.0.1:1")):
+            async with pool.connect(pr.Callback(uri="http://127.0.0.1:2")):
+                assert len(pool) == 3
+            await asyncio.sleep(0.01)
+            # idle channels are closed on a timer, while those in use are kept
+            assert len(pool) == 2
+        await asyncio.sleep(0.01)
+        assert len(pool) == 1
+    finally:
+        pool.close()
+        worker.server.close()
+        await worker.server.wait_closed()
+    assert len(pool) == 0
@@ -1,3 +1,4 @@
+import asyncio
 from dataclasses import dataclass
 from time import time
 from typing import Any, Dict, List, Optional, Tuple, Type
@@ -221,6 +222,28 @@ def test_merge_copies():
     assert sum(1 for _ in tg.edges()) == 6
 
 
+def test_merge_copies_compact():
+    tg = TierkreisGraph(compact=True)
+    x1, x2 = tg.copy_value(tg.input["x"])
+    x3, x4 = tg.copy_value(x1)
+    tg.set_outputs(x2=x2, x3=x3, x4=x4)
+
+    merged = _merge_copies(tg)
+
+    assert merged.is_compact
+    [copy_node] = [idx for idx, n in enumerate(merged.nodes()) if n.is_copy_node()]
+    # a single copy node feeding every output
+    assert sorted(e.target.port for e in merged.out_edges(copy_node)) == [
+        "x2",
+        "x3",
+        "x4",
+    ]
+    assert sorted(merged.outputs()) == ["x2", "x3", "x4"]
+    # the original graph is left untouched
+    assert tg.n_nodes == 4
+    assert sum(1 for _ in tg.edges()) == 5
+
+
 # https://github.com/CQCL-DEV/tierkreis/issues/526
 def test_merge_copies_bug():
     tg = TierkreisGraph()
@@ -256,6 +279,21 @@ async def test_subspaces(client: RuntimeClient):
     assert (await client.run_graph(tg))["out"].try_autopython() == 1
 
 
+@pytest.mark.asyncio
+@pytest.mark.parametrize("executor", ["thread", "process"])
+async def test_function_executor(client: RuntimeClient, executor: str):
+    tg = TierkreisGraph()
+    add = tg.add_func(
+        f"python_nodes::python_add_{executor}",
+        a=tg.add_const(1),
+        b=tg.input["b"],
+    )
+    tg.set_outputs(out=add)
+
+    outs = await asyncio.gather(*(client.run_graph(tg, b=i) for i in range(4)))
+    assert [o["out"].try_autopython() for o in outs] == [1, 2, 3, 4]
+
+
 @pytest.mark.asyncio
 async def test_map(client: RuntimeClient):
     thunk = TierkreisGraph()
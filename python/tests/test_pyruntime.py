@@ -1,9 +1,46 @@
+import asyncio
+import contextlib
+import gc
+import time
+import weakref
+from collections.abc import Sequence
+from typing import Any
+
+import numpy as np
 import pytest
+from numpy.typing import NDArray
 from sample_graph import sample_graph as sample_g
+from test_worker import main
 
-from tierkreis.core.tierkreis_graph import TierkreisEdge, TierkreisGraph
-from tierkreis.core.values import TierkreisValue, VariantValue
-from tierkreis.pyruntime import PyRuntime
+from tierkreis.core import Labels
+from tierkreis.core.function import FunctionName
+from tierkreis.core.passes import optimise, standard_passes
+from tierkreis.core.protos.tierkreis.v1alpha1.graph import Output, OutputStream
+from tierkreis.core.tierkreis_graph import (
+    ConstNode,
+    FunctionNode,
+    TierkreisEdge,
+    TierkreisGraph,
+)
+from tierkreis.core.types import FloatType, IntType
+from tierkreis.core.values import (
+    FloatValue,
+    IntValue,
+    StructValue,
+    TierkreisValue,
+    VariantValue,
+    VecValue,
+)
+from tierkreis.pyruntime import MapProcessPool, PyRuntime, SqliteCheckpointStore
+from tierkreis.pyruntime.python_builtin import namespace as builtins
+from tierkreis.pyruntime.python_runtime import VizRuntime, _ExecutionPlan
+from tierkreis.worker import Namespace
+from tierkreis.worker.exceptions import NodeExecutionError
+from tierkreis.worker.result_cache import (
+    DiskResultCache,
+    MemoryResultCache,
+    result_key,
+)
 
 
 @pytest.fixture()
@@ -24,3 +61,520 @@ async def test_callback(sample_graph: TierkreisGraph, pyruntime_function: PyRunt
     outs = await pyruntime_function.run_graph(sample_graph, **ins)
     assert all(e in cache for e in sample_graph.edges())
     assert sorted(outs) == sorted(sample_graph.outputs())
+
+
+@pytest.mark.asyncio
+async def test_independent_branches_run_concurrently():
+    ns = Namespace()
+    running = [0]
+    peak = [0]
+    all_started = asyncio.Event()
+
+    @ns.function()
+    async def wait_for_others(value: int) -> int:
+        running[0] += 1
+        peak[0] = max(peak[0], running[0])
+        if running[0] == 4:
+            all_started.set()
+        # returns early if the calls are serialized, so the test fails
+        # rather than hangs
+        with contextlib.suppress(asyncio.TimeoutError):
+            await asyncio.wait_for(all_started.wait(), 5)
+        running[0] -= 1
+        return value
+
+    tg = TierkreisGraph()
+    outs = {
+        f"out{i}": tg.add_func("wait_for_others", value=tg.add_const(i))
+        for i in range(4)
+    }
+    tg.set_outputs(**outs)
+
+    result = await PyRuntime([ns], num_workers=4).run_graph(tg)
+
+    assert {k: v.try_autopython() for k, v in result.items()} == {
+        f"out{i}": i for i in range(4)
+    }
+    # the four calls are independent so should not be serialized
+    assert peak[0] == 4
+
+
+@pytest.mark.asyncio
+async def test_single_worker_out_of_order_nodes():
+    # nodes are added to the graph in an order that is not a topological order
+    tg = TierkreisGraph()
+    add = tg.add_func("iadd")
+    tg.add_edge(tg.add_const(1), add["a"])
+    tg.add_edge(tg.add_const(2), add["b"])
+    tg.set_outputs(value=add)
+
+    outs = await PyRuntime([], num_workers=1).run_graph(tg)
+    assert outs["value"].try_autopython() == 3
+
+
+@pytest.mark.asyncio
+async def test_execution_plan_cached():
+    tg = TierkreisGraph()
+    tg.set_outputs(value=tg.add_func("iadd", a=tg.input["a"], b=tg.add_const(1)))
+
+    runtime = PyRuntime([])
+    assert (await runtime.run_graph(tg, a=1))["value"].try_autopython() == 2
+    plan = runtime._execution_plan(tg)
+    assert (await runtime.run_graph(tg, a=2))["value"].try_autopython() == 3
+    assert runtime._execution_plan(tg) is plan
+
+    # modifying the graph invalidates the cached plan
+    tg.discard(tg.add_const(0)["value"])
+    assert runtime._execution_plan(tg) is not plan
+    assert (await runtime.run_graph(tg, a=3))["value"].try_autopython() == 4
+
+
+def _map_graph(n: int) -> TierkreisGraph:
+    thunk = TierkreisGraph()
+    thunk.set_outputs(
+        value=thunk.add_func("imul", a=thunk.input["value"], b=thunk.add_const(2))
+    )
+    tg = TierkreisGraph()
+    tg.set_outputs(
+        value=tg.add_func(
+            "map", value=tg.add_const(list(range(n))), thunk=tg.add_const(thunk)
+        )
+    )
+    return tg
+
+
+def _map_pool_runtime() -> PyRuntime:
+    return PyRuntime([])
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("concurrency,chunk_size", [(None, 1), (2, 3), (1, 100)])
+async def test_map_chunks(concurrency, chunk_size):
+    runtime = PyRuntime([], map_concurrency=concurrency, map_chunk_size=chunk_size)
+    outs = await runtime.run_graph(_map_graph(10))
+    assert outs["value"].try_autopython() == [2 * i for i in range(10)]
+
+
+@pytest.mark.asyncio
+async def test_map_process_pool():
+    with MapProcessPool(_map_pool_runtime, max_workers=2) as pool:
+        runtime = PyRuntime([], map_chunk_size=4, map_pool=pool)
+        outs = await runtime.run_graph(_map_graph(10))
+    assert outs["value"].try_autopython() == [2 * i for i in range(10)]
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("disk", [False, True])
+async def test_result_cache(tmp_path, disk: bool):
+    ns = Namespace()
+    calls = []
+
+    @ns.function(pure=True)
+    async def square(x: int) -> int:
+        calls.append(x)
+        return x * x
+
+    @ns.function()
+    async def impure_square(x: int) -> int:
+        calls.append(x)
+        return x * x
+
+    cache = DiskResultCache(tmp_path) if disk else MemoryResultCache()
+    runtime = PyRuntime([ns], result_cache=cache)
+    tg = TierkreisGraph()
+    x1, x2 = tg.copy_value(tg.input["x"])
+    tg.set_outputs(
+        a=tg.add_func("square", x=x1),
+        b=tg.add_func("impure_square", x=x2),
+    )
+    for x in [2, 3, 2, 2]:
+        outs = await runtime.run_graph(tg, x=x)
+        assert outs["a"].try_autopython() == outs["b"].try_autopython() == x * x
+    # the pure function only runs once for each input
+    assert sorted(calls) == [2, 2, 2, 2, 3, 3]
+    assert len(cache) == 2
+    if disk:
+        # entries persist for a new cache in the same directory
+        assert len(DiskResultCache(tmp_path)) == 2
+
+
+def test_memory_result_cache_eviction():
+    cache = MemoryResultCache(max_entries=2)
+    for i in range(3):
+        cache.put(str(i), StructValue({"value": IntValue(i)}))
+    assert cache.get("0") is None
+    assert cache.get("2") == StructValue({"value": IntValue(2)})
+    assert len(cache) == 2
+
+
+def test_result_key_field_order():
+    a = StructValue({"x": IntValue(1), "y": IntValue(2)})
+    b = StructValue({"y": IntValue(2), "x": IntValue(1)})
+    fname = FunctionName("f")
+    assert result_key(fname, a) == result_key(fname, b)
+    assert result_key(fname, a) != result_key(FunctionName("g"), a)
+
+
+@pytest.mark.asyncio
+async def test_optimise_graph(sample_graph: TierkreisGraph):
+    tg = TierkreisGraph()
+    total = tg.add_func(
+        "imul",
+        a=tg.add_func("iadd", a=tg.add_const(1), b=tg.add_const(2)),
+        b=tg.add_const(10),
+    )
+    x, x_copy = tg.copy_value(tg.input["x"])
+    tg.discard(x_copy)
+    tg.discard(tg.add_func("fadd", a=tg.input["y"], b=tg.add_const(1.0))["value"])
+    tg.set_outputs(out=tg.add_func("iadd", a=total, b=x))
+
+    optimised = await optimise(tg, standard_passes(builtins))
+    assert tg.n_nodes == 13
+    # the constant, the remaining addition and a discard of the unused input
+    assert optimised.n_nodes == 5
+    assert sorted(optimised.inputs()) == sorted(tg.inputs())
+    [const] = [n for n in optimised.nodes() if isinstance(n, ConstNode)]
+    assert const.value == IntValue(30)
+
+    ins = {"x": 5, "y": 1.0}
+    assert await PyRuntime([], optimise_graphs=True).run_graph(tg, **ins) == {
+        "out": IntValue(35)
+    }
+
+    ins = {"inp": "world", "vv": VariantValue("many", TierkreisValue.from_python(2))}
+    runtime = PyRuntime([main.root], optimise_graphs=True)
+    assert await runtime.run_graph(sample_graph, **ins) == await PyRuntime(
+        [main.root]
+    ).run_graph(sample_graph, **ins)
+
+
+@pytest.mark.asyncio
+async def test_optimise_large_compact_graph():
+    tg = TierkreisGraph(compact=True)
+    prev = tg.input["x"]
+    for i in range(1000):
+        prev, unused = tg.copy_value(prev)
+        tg.discard(tg.add_func("iadd", a=unused, b=tg.add_const(i))["value"])
+        folded = tg.add_func("iadd", a=tg.add_const(i), b=tg.add_const(1))
+        prev = tg.add_func("iadd", a=prev, b=folded)
+    tg.set_outputs(out=prev)
+
+    start = time.perf_counter()
+    optimised = await optimise(tg, standard_passes(builtins))
+    # removing an edge must not rebuild the adjacency index each time
+    assert time.perf_counter() - start < 15.0
+    assert optimised.is_compact
+    # a constant and an addition per step
+    assert optimised.n_nodes == 2 + 2 * 1000
+    assert await PyRuntime([]).run_graph(optimised, x=0) == {
+        "out": IntValue(sum(range(1, 1001)))
+    }
+
+
+@pytest.mark.asyncio
+async def test_common_subexpressions():
+    ns = Namespace()
+    calls = []
+
+    @ns.function(pure=True)
+    async def square(x: int) -> int:
+        calls.append(x)
+        return x * x
+
+    tg = TierkreisGraph()
+    x0, x1 = tg.copy_value(tg.input["x"])
+    tg.set_outputs(
+        a=tg.add_func("iadd", a=tg.add_func("square", x=x0), b=tg.add_const(2)),
+        b=tg.add_func("iadd", b=tg.add_const(2), a=tg.add_func("square", x=x1)),
+    )
+
+    runtime = PyRuntime([ns], optimise_graphs=True)
+    optimised = await optimise(tg, standard_passes(runtime.root))
+    names = [
+        str(n.function_name) for n in optimised.nodes() if isinstance(n, FunctionNode)
+    ]
+    # one call of each function, copied to both outputs
+    assert sorted(names) == ["copy", "iadd", "square"]
+
+    outs = await runtime.run_graph(tg, x=3)
+    assert outs == {"a": IntValue(11), "b": IntValue(11)}
+    assert calls == [3]
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("num_workers", [1, 2])
+async def test_loop_plan_reused(monkeypatch, num_workers: int):
+    body = TierkreisGraph()
+    v0, v1 = body.copy_value(body.input["value"])
+    body.set_outputs(
+        value=body.add_func(
+            "switch",
+            pred=body.add_func("ilt", a=v0, b=body.add_const(100)),
+            if_true=body.add_tag(
+                Labels.CONTINUE,
+                value=body.add_func("iadd", a=v1, b=body.add_const(1)),
+            ),
+            if_false=body.add_tag(Labels.BREAK, value=body.add_const(-1)),
+        )
+    )
+    tg = TierkreisGraph()
+    tg.set_outputs(
+        value=tg.add_func("loop", body=tg.add_const(body), value=tg.input["value"])
+    )
+
+    plans = []
+    from_graph = _ExecutionPlan.from_graph.__func__
+    monkeypatch.setattr(
+        _ExecutionPlan,
+        "from_graph",
+        classmethod(lambda cls, g: plans.append(g) or from_graph(cls, g)),
+    )
+    outs = await PyRuntime([], num_workers=num_workers).run_graph(tg, value=0)
+    assert outs == {"value": IntValue(-1)}
+    # the plan of the body is prepared once, for all the iterations
+    assert len(plans) == 2
+
+
+@pytest.mark.asyncio
+async def test_checkpoint_resume(tmp_path):
+    ns = Namespace()
+    calls = []
+
+    @ns.function()
+    async def expensive(x: int) -> int:
+        calls.append(x)
+        return x * x
+
+    @ns.function()
+    async def flaky(x: int) -> int:
+        if len(calls) < 3:
+            raise RuntimeError("interrupted")
+        return x + 1
+
+    box = TierkreisGraph()
+    box.set_outputs(value=box.add_func("expensive", x=box.input["value"]))
+    tg = TierkreisGraph()
+    x0, x1 = tg.copy_value(tg.input["x"])
+    tg.set_outputs(
+        a=tg.add_func("flaky", x=tg.add_box(box, value=x0)),
+        b=tg.add_func("expensive", x=x1),
+    )
+
+    filename = tmp_path / "checkpoints.db"
+    runtime = PyRuntime([ns], checkpoints=SqliteCheckpointStore(filename))
+    with pytest.raises(NodeExecutionError, match="interrupted"):
+        await runtime.run_graph(tg, x=3)
+    assert calls == [3, 3]
+
+    # a new process resumes from the completed nodes, with nested paths
+    store = SqliteCheckpointStore(filename)
+    runtime = PyRuntime([ns], checkpoints=store)
+    calls.append(0)
+    outs = await runtime.run_graph(tg, x=3)
+    assert outs == {"a": IntValue(10), "b": IntValue(9)}
+    assert calls == [3, 3, 0]
+    assert len(store) == 0
+
+
+@pytest.mark.asyncio
+async def test_inputs_released():
+    ns = Namespace()
+    refs: list[weakref.ref] = []
+
+    @ns.function()
+    async def consume(x: list[int]) -> int:
+        return len(x)
+
+    @ns.function()
+    async def released(n: int) -> bool:
+        gc.collect()
+        return refs[0]() is None
+
+    def inputs() -> dict[str, TierkreisValue]:
+        value = VecValue([IntValue(i) for i in range(10)])
+        refs.append(weakref.ref(value))
+        return {"x": value}
+
+    box = TierkreisGraph()
+    box.set_outputs(
+        value=box.add_func("released", n=box.add_func("consume", x=box.input["x"]))
+    )
+    tg = TierkreisGraph()
+    tg.set_outputs(value=tg.add_box(box, x=tg.input["x"]))
+    # the input is dropped once read, while the box containing it still runs
+    outs = await PyRuntime([ns]).run_graph(tg, **inputs())
+    assert outs["value"].try_autopython() is True
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("sample_every", [1, 2])
+async def test_viz_outputs_bounded(monkeypatch, sample_every: int):
+    posted = []
+    monkeypatch.setattr(VizRuntime, "_post", lambda self, e, d: posted.append(d))
+    tg = TierkreisGraph()
+    value = tg.input["value"]
+    for _ in range(10):
+        value = tg.add_func("iadd", a=value, b=tg.add_const(1))
+    tg.set_outputs(value=value)
+
+    edges = []
+    runtime = VizRuntime("http://viz", [], max_outputs=3, sample_every=sample_every)
+    runtime.set_callback(lambda e, v: edges.append(e))
+    outs = await runtime.run_viz_graph(tg, value=0)
+    assert outs == {"value": IntValue(10)}
+    # 21 edge values, of which the latest sampled are kept
+    assert len(edges) == 21
+    expected = [e.to_proto() for e in edges[::sample_every][-3:]]
+    assert [o.edge for o in runtime.outputs.stream] == expected
+    # the run never waits, so all the values are published together at the end
+    [stream] = posted
+    assert [o.edge for o in stream.stream] == expected
+
+    # the kept values can be reset, or replaced up to the bound
+    runtime.outputs = OutputStream()
+    assert runtime.outputs.stream == []
+    runtime.outputs = OutputStream(stream=[Output(edge=e) for e in expected * 2])
+    assert [o.edge for o in runtime.outputs.stream] == expected
+
+
+@pytest.mark.asyncio
+async def test_viz_publish_error(monkeypatch):
+    def post(self, endpoint, data):
+        raise ConnectionError("viz unavailable")
+
+    monkeypatch.setattr(VizRuntime, "_post", post)
+    tg = TierkreisGraph()
+    tg.set_outputs(value=tg.add_func("iadd", a=tg.input["value"], b=tg.add_const(1)))
+    runtime = VizRuntime("http://viz", [])
+    assert runtime._outputs.maxlen is None
+    # each posting thread has its own session
+    assert runtime._session() is runtime._session()
+    assert await asyncio.to_thread(runtime._session) is not runtime._session()
+    # the error publishing fails the run, rather than being lost in the task
+    with pytest.raises(ConnectionError):
+        await runtime.run_viz_graph(tg, value=0)
+    await runtime.flush()
+
+
+@pytest.mark.asyncio
+async def test_batched_function_map():
+    ns = Namespace()
+    batches = []
+
+    @ns.function(batched=True)
+    async def scale(x: list[int], factor: list[int]) -> list[int]:
+        batches.append(len(x))
+        return [a * b for a, b in zip(x, factor)]
+
+    # the declared signature is that of a single call
+    graph_type = ns.functions["scale"].declaration.type_scheme.body.graph
+    assert graph_type.inputs.content["x"] == IntType().to_proto()
+    assert graph_type.outputs.content["value"] == IntType().to_proto()
+
+    thunk, tg = _batched_map_graph("scale", factor=3)
+    runtime = PyRuntime([ns])
+    outs = await runtime.run_graph(tg, value=list(range(10)))
+    assert outs["value"].try_autopython() == [3 * i for i in range(10)]
+    # all the elements are run in one call
+    assert batches == [10]
+
+    outs = await runtime.run_graph(thunk, value=4)
+    assert outs == {"value": IntValue(12)}
+    assert batches == [10, 1]
+
+
+def _batched_map_graph(
+    function: str, **consts: Any
+) -> tuple[TierkreisGraph, TierkreisGraph]:
+    """A graph applying `function` to its input `value`, with constant inputs
+    `consts`, and a graph mapping that graph over a list."""
+    thunk = TierkreisGraph()
+    inputs = {port: thunk.add_const(value) for port, value in consts.items()}
+    thunk.set_outputs(value=thunk.add_func(function, x=thunk.input["value"], **inputs))
+    tg = TierkreisGraph()
+    tg.set_outputs(
+        value=tg.add_func("map", value=tg.input["value"], thunk=tg.add_const(thunk))
+    )
+    return thunk, tg
+
+
+@pytest.mark.asyncio
+async def test_batched_map_batches_cache_checkpoints(tmp_path):
+    ns = Namespace()
+    batches = []
+    failures = [1]
+
+    @ns.function(batched=True, pure=True)
+    async def double(x: list[int]) -> list[int]:
+        batches.append(list(x))
+        return [2 * a for a in x]
+
+    @ns.function()
+    async def total(x: list[int]) -> int:
+        if failures:
+            failures.pop()
+            raise RuntimeError("interrupted")
+        return sum(x)
+
+    _, tg = _batched_map_graph("double")
+    cache = MemoryResultCache()
+    runtime = PyRuntime([ns], result_cache=cache, map_batch_size=4)
+    outs = await runtime.run_graph(tg, value=list(range(10)))
+    assert outs["value"].try_autopython() == [2 * i for i in range(10)]
+    # batches are bounded in size
+    assert batches == [[0, 1, 2, 3], [4, 5, 6, 7], [8, 9]]
+    # only the elements not already cached are run
+    batches.clear()
+    await runtime.run_graph(tg, value=list(range(8, 14)))
+    assert batches == [[10, 11], [12, 13]]
+
+    # the outputs of each element are checkpointed
+    summed = TierkreisGraph()
+    mapped = summed.add_box(tg, value=summed.input["value"])
+    summed.set_outputs(value=summed.add_func("total", x=mapped))
+    batches.clear()
+    filename = tmp_path / "checkpoints.db"
+    runtime = PyRuntime([ns], checkpoints=SqliteCheckpointStore(filename))
+    with pytest.raises(NodeExecutionError, match="interrupted"):
+        await runtime.run_graph(summed, value=list(range(3)))
+    assert batches == [[0, 1, 2]]
+    runtime = PyRuntime([ns], checkpoints=SqliteCheckpointStore(filename))
+    outs = await runtime.run_graph(summed, value=list(range(3)))
+    assert outs == {"value": IntValue(6)}
+    assert batches == [[0, 1, 2]]
+
+
+@pytest.mark.asyncio
+async def test_batched_function_numpy():
+    ns = Namespace()
+
+    @ns.function(batched=True)
+    async def scale(
+        x: NDArray[np.float64], factor: NDArray[np.int64]
+    ) -> NDArray[np.float64]:
+        assert isinstance(x, np.ndarray) and isinstance(factor, np.ndarray)
+        return x * factor
+
+    graph_type = ns.functions["scale"].declaration.type_scheme.body.graph
+    assert graph_type.inputs.content["x"] == FloatType().to_proto()
+    assert graph_type.inputs.content["factor"] == IntType().to_proto()
+
+    thunk, tg = _batched_map_graph("scale", factor=3)
+    runtime = PyRuntime([ns])
+    outs = await runtime.run_graph(tg, value=[0.5, 1.0, 2.0])
+    assert outs["value"].try_autopython() == [1.5, 3.0, 6.0]
+    assert await runtime.run_graph(thunk, value=2.0) == {"value": FloatValue(6.0)}
+
+    # the element type cannot be found without a dtype
+    with pytest.raises(ValueError, match="dtype"):
+
+        @ns.function(batched=True)
+        async def untyped(x: np.ndarray) -> list[float]:
+            return x.tolist()
+
+    # nor from other sequences, which are not passed as lists
+    with pytest.raises(ValueError, match="lists or arrays"):
+
+        @ns.function(batched=True)
+        async def sequence(x: Sequence[float]) -> list[float]:
+            return list(x)
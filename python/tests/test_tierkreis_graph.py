@@ -1,13 +1,17 @@
 from dataclasses import dataclass
-from typing import Any, Iterable, Optional
+from typing import Any, Iterable, Optional, cast
 
+import networkx as nx
 import pytest
 
 from tierkreis.core import TierkreisGraph
 from tierkreis.core.function import FunctionName
 from tierkreis.core.tierkreis_graph import (
     BoxNode,
+    ConstNode,
     FunctionNode,
+    GraphInterner,
+    GraphValue,
     NodePort,
     NodeRef,
     TierkreisEdge,
@@ -221,3 +225,273 @@ def test_insert_graph_id():
     # before bugfix outs was empty
 
     assert outs == {"a": con, "b": tg.input["b"]}
+
+
+def _edge_set(graph: TierkreisGraph) -> set[tuple[int, str, int, str, str]]:
+    return {
+        (
+            e.source.node_ref.idx,
+            e.source.port,
+            e.target.node_ref.idx,
+            e.target.port,
+            str(e.type_),
+        )
+        for e in graph.edges()
+    }
+
+
+def _build_and_modify(compact: bool) -> TierkreisGraph:
+    tg = TierkreisGraph(compact=compact)
+    pair = tg.make_pair(tg.input["a"], tg.add_const(3))
+    first, second = tg.unpack_pair(pair)
+    tg.discard(second)
+    x1, x2 = tg.copy_value(first)
+    unused = tg.add_const(5)
+    tg.discard(unused)
+    tg.set_outputs(x1=x1, x2=x2, b=tg.input["b"])
+    tg.annotate_input("a", int)
+    tg.annotate_output("b", float)
+
+    # rewire the copy output through an "id" node
+    edge = tg.out_edge_from_port(x2)
+    assert edge is not None
+    tg.remove_edge(edge)
+    tg.add_edge(tg.add_func("id", value=x2), edge.target)
+
+    tg.remove_nodes([unused.idx, unused.idx + 1])
+    return tg
+
+
+def test_compact_storage() -> None:
+    nx_g = _build_and_modify(False)
+    compact_g = _build_and_modify(True)
+    assert not nx_g.is_compact
+    assert compact_g.is_compact
+
+    assert list(nx_g.nodes()) == list(compact_g.nodes())
+    assert _edge_set(nx_g) == _edge_set(compact_g)
+    assert nx_g.inputs() == compact_g.inputs()
+    assert nx_g.outputs() == compact_g.outputs()
+
+    def in_ports(graph: TierkreisGraph, idx: int) -> list[tuple[int, str]]:
+        return [(e.source.node_ref.idx, e.target.port) for e in graph.in_edges(idx)]
+
+    for idx in range(compact_g.n_nodes):
+        assert in_ports(nx_g, idx) == in_ports(compact_g, idx)
+
+    # networkx graph is materialized on demand, and is read-only
+    nxg = compact_g._graph
+    assert sorted(nxg.edges(keys=True)) == sorted(nx_g._graph.edges(keys=True))
+    with pytest.raises(nx.NetworkXError):
+        nxg.remove_node(0)
+
+    deser = TierkreisGraph.from_proto(compact_g.to_proto(), compact=True)
+    assert deser.is_compact
+    assert _edge_set(deser) == _edge_set(compact_g)
+
+    inlined = nx_g.inline_boxes()
+    assert _edge_set(inlined) == _edge_set(compact_g.inline_boxes())
+
+
+def test_compact_storage_many_removals() -> None:
+    tg = TierkreisGraph(compact=True)
+    consts = [tg.add_const(i) for i in range(10)]
+    edges = [tg.add_edge(c, tg.output[f"out{i}"]) for i, c in enumerate(consts)]
+    # remove enough edges for tombstones to be compacted away
+    for edge in edges[:8]:
+        tg.remove_edge(edge)
+    assert tg.outputs() == ["out8", "out9"]
+    assert tg.out_edge_from_port(consts[0]["value"]) is None
+    assert tg.out_edge_from_port(consts[9]["value"]) == edges[9]
+    with pytest.raises(KeyError):
+        tg.remove_edge(edges[0])
+
+
+def test_compact_storage_interleaved_queries() -> None:
+    tg = TierkreisGraph(compact=True)
+    prev = tg.input["value"]
+    for i in range(20):
+        node = tg.add_func("id", value=prev)
+        # queries in between additions see every edge added so far
+        assert [e.source for e in tg.in_edges(node)] == [prev]
+        assert [e.target for e in tg.out_edges(prev.node_ref)] == [node["value"]]
+        prev = node["value"]
+    tg.set_outputs(value=prev)
+    assert tg.outputs() == ["value"]
+    assert count(tg.edges()) == 21
+    assert _edge_set(tg) == _edge_set(TierkreisGraph.from_proto(tg.to_proto()))
+
+
+@pytest.mark.parametrize("compact", [False, True])
+def test_from_proto_trusted(compact: bool) -> None:
+    inner = TierkreisGraph()
+    inner.set_outputs(value=inner.add_func("id", value=inner.input["value"]))
+
+    tg = TierkreisGraph()
+    adds = [
+        tg.add_func("iadd", a=tg.input[f"in{i}"], b=tg.add_const(i)) for i in range(3)
+    ]
+    box = tg.add_box(inner, value=adds[0])
+    tg.set_outputs(out0=box, out1=adds[1], out2=adds[2])
+    for i in range(3):
+        tg.annotate_input(f"in{i}", int)
+    proto = tg.to_proto()
+
+    loaded = TierkreisGraph.from_proto(proto, compact=compact)
+    trusted = TierkreisGraph.from_proto(proto, compact=compact, trusted=True)
+    assert _edge_set(trusted) == _edge_set(loaded) == _edge_set(tg)
+    assert trusted.inputs() == tg.inputs()
+    assert bytes(trusted.to_proto()) == bytes(loaded.to_proto())
+
+    # identical edge types are only converted once
+    for graph in (loaded, trusted):
+        in_types = [e.type_ for e in graph.out_edges(graph.input)]
+        assert in_types == [IntType()] * 3
+        assert all(t is in_types[0] for t in in_types)
+
+
+def test_graph_value_lazy_decode() -> None:
+    tg = TierkreisGraph()
+    tg.set_outputs(value=tg.add_func("id", value=tg.input["value"]))
+    proto = GraphValue(tg).to_proto()
+
+    gv = TierkreisValue.from_proto(proto)
+    assert isinstance(gv, GraphValue)
+    assert not gv.is_loaded
+    # passed through untouched, the original message is re-emitted
+    assert gv.to_proto().graph is proto.graph
+
+    assert gv.value.outputs() == ["value"]
+    assert gv.is_loaded
+    assert gv.to_proto().graph is proto.graph
+
+    gv.value.discard(gv.value.add_const(1)["value"])
+    reencoded = gv.to_proto().graph
+    assert reencoded is not proto.graph
+    assert len(reencoded.nodes) == len(proto.graph.nodes) + 2
+
+    assert gv == GraphValue(gv.value)
+    assert gv != TierkreisValue.from_proto(proto)
+
+
+def _add_mul_graph(reverse: bool = False, name: str = "") -> TierkreisGraph:
+    tg = TierkreisGraph(name)
+    if reverse:
+        add = tg.add_func("iadd", a=tg.input["x"], b=tg.input["y"])
+        const = tg.add_const(3)
+    else:
+        const = tg.add_const(3)
+        add = tg.add_func("iadd", a=tg.input["x"], b=tg.input["y"])
+    tg.set_outputs(value=tg.add_func("imul", a=add, b=const))
+    return tg
+
+
+def test_graph_fingerprint() -> None:
+    tg = _add_mul_graph()
+    # independent of node order and graph name
+    assert tg.fingerprint() == _add_mul_graph(reverse=True, name="g").fingerprint()
+    assert tg.fingerprint() == TierkreisGraph.from_proto(tg.to_proto()).fingerprint()
+
+    swapped = TierkreisGraph()
+    add = swapped.add_func("iadd", a=swapped.input["y"], b=swapped.input["x"])
+    swapped.set_outputs(value=swapped.add_func("imul", a=add, b=swapped.add_const(3)))
+    assert swapped.fingerprint() != tg.fingerprint()
+
+    # cached, but updated when the graph or a nested graph changes
+    outer = TierkreisGraph()
+    outer.set_outputs(value=outer.add_box(tg, x=outer.input["x"], y=outer.input["y"]))
+    before = outer.fingerprint()
+    tg.discard(tg.add_const(4)["value"])
+    assert outer.fingerprint() != before
+    assert GraphValue(outer).digest() != GraphValue(_add_mul_graph()).digest()
+
+
+def test_graph_lazy_nested_value_changes() -> None:
+    inner = TierkreisGraph()
+    inner.set_outputs(value=inner.input["value"])
+    # nested graph value decoded lazily from protobuf
+    outer = TierkreisGraph.from_proto(_const_graph(GraphValue(inner)).to_proto())
+    gv = cast(GraphValue, cast(ConstNode, outer[2]).value)
+    assert not gv.is_loaded
+    proto = outer.to_proto()
+    fingerprint = outer.fingerprint()
+
+    gv.value.discard(gv.value.add_const(1)["value"])
+    assert outer.fingerprint() != fingerprint
+    nested = outer.to_proto().nodes[2].const.graph
+    assert len(nested.nodes) == len(proto.nodes[2].const.graph.nodes) + 2
+
+
+def _const_graph(value: GraphValue) -> TierkreisGraph:
+    tg = TierkreisGraph()
+    tg.set_outputs(value=tg.add_const(value))
+    return tg
+
+
+def test_to_proto_returns_copy() -> None:
+    tg = _add_mul_graph()
+    proto = tg.to_proto()
+    proto.nodes.pop()
+    proto.name = "changed"
+    assert tg.to_proto() is not proto
+    assert len(tg.to_proto().nodes) == tg.n_nodes
+    assert tg.to_proto().name == ""
+
+
+def test_graph_interner() -> None:
+    outer = TierkreisGraph()
+    for i in range(3):
+        outer.add_box(_add_mul_graph(reverse=i == 1))
+    outer.add_const(GraphValue(_add_mul_graph()))
+    fingerprint = outer.fingerprint()
+
+    interner = GraphInterner()
+    assert interner.intern(outer) is outer
+    assert outer.fingerprint() == fingerprint
+    nested = [cast(BoxNode, outer[i]).graph for i in range(2, 5)]
+    nested.append(cast(GraphValue, cast(ConstNode, outer[5]).value).value)
+    assert len(nested) == 4
+    assert all(g is nested[0] for g in nested)
+    # the protobuf conversion of the shared graph is shared too
+    proto = outer._to_proto_cached()
+    assert proto.nodes[2].box.graph is proto.nodes[3].box.graph
+
+    copy = TierkreisGraph.from_proto(outer.to_proto())
+    assert interner.intern(copy) is outer
+
+
+def test_inline_boxes_max_nodes() -> None:
+    leaf = TierkreisGraph()
+    leaf.set_outputs(
+        y=leaf.add_func("iadd", a=leaf.input["x"], b=leaf.add_const(1)),
+        z=leaf.input["w"],
+    )
+    middle = TierkreisGraph()
+    box = middle.add_box(leaf, x=middle.input["x"], w=middle.input["w"])
+    box = middle.add_box(leaf, x=box["y"], w=box["z"])
+    middle.set_outputs(y=box["y"], z=box["z"])
+    big = middle.inline_boxes()
+    for _ in range(3):
+        big.discard(big.add_const(0))
+    outer = TierkreisGraph()
+    box = outer.add_box(middle, x=outer.input["x"], w=outer.input["w"])
+    box = outer.add_box(big, x=box["y"], w=box["z"])
+    outer.set_outputs(y=box["y"], z=box["z"])
+
+    def boxes(graph: TierkreisGraph) -> list[TierkreisGraph]:
+        return [node.graph for node in graph.nodes() if isinstance(node, BoxNode)]
+
+    inlined = outer.inline_boxes(True, max_nodes=middle.n_nodes)
+    # the small box is inlined, with the boxes it contains
+    [flattened] = boxes(inlined)
+    assert flattened.n_nodes == big.n_nodes and not boxes(flattened)
+    assert inlined.n_nodes == 2 + 2 * 2 + 1
+    assert _edge_set(inlined.inline_boxes()) == _edge_set(outer.inline_boxes(True))
+
+    # nodes are shared rather than copied
+    const = leaf[2]
+    assert isinstance(const, ConstNode)
+    assert any(node is const for node in inlined.nodes())
+
+    # without recursion, the boxes of inlined graphs are kept
+    assert boxes(outer.inline_boxes(max_nodes=middle.n_nodes)) == [big, leaf, leaf]
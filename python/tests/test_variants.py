@@ -1,5 +1,6 @@
 import re
 import warnings
+from array import array
 from dataclasses import dataclass, field
 from enum import Enum
 from types import UnionType
@@ -16,6 +17,7 @@ from tierkreis.core.types import IncompatibleUnionType, TierkreisType, UnionTag
 from tierkreis.core.values import (
     FloatValue,
     IntValue,
+    PackedVecValue,
     StringValue,
     StructValue,
     TierkreisValue,
@@ -317,6 +319,126 @@ def test_union_over_arguments() -> None:
             assert tk_val2.to_python(typ2) == val2
 
 
+def test_struct_value_fields() -> None:
+    a = StructValue({"x": IntValue(1), "y": StringValue("a")})
+    b = StructValue({"y": StringValue("a"), "x": IntValue(1)})
+    assert a == b
+    assert a != StructValue({"x": IntValue(1), "y": StringValue("b")})
+    assert a["y"] == StringValue("a")
+    with pytest.raises(KeyError):
+        _ = a["z"]
+    assert a.values == {"x": IntValue(1), "y": StringValue("a")}
+    # the mapping returned is a copy
+    a.values["x"] = IntValue(2)
+    assert a["x"] == IntValue(1)
+
+
+def test_packed_vec() -> None:
+    floats = [0.5, 1.0, -2.25]
+    tk_val = TierkreisValue.from_python(floats, list[float])
+    assert isinstance(tk_val, PackedVecValue)
+    assert tk_val == VecValue([FloatValue(x) for x in floats])
+    assert tk_val.to_python(list[float]) == floats
+    assert tk_val.to_python(array) == array("d", floats)
+    # stays packed through protobuf
+    decoded = TierkreisValue.from_proto(tk_val.to_proto())
+    assert isinstance(decoded, PackedVecValue)
+    assert decoded == tk_val
+
+    ints = TierkreisValue.from_python(array("i", [1, 2, 3]))
+    assert isinstance(ints, PackedVecValue)
+    assert ints.to_python(list[int]) == [1, 2, 3]
+    assert ints.to_python(list[int | float]) == [1, 2, 3]
+    # elements that do not fit are boxed
+    big = TierkreisValue.from_python([1, 2**64], list[int])
+    assert not isinstance(big, PackedVecValue)
+    assert big == VecValue([IntValue(1), IntValue(2**64)])
+    # bools are not packed as integers
+    bools = TierkreisValue.from_python([True, False], list[int])
+    assert not isinstance(bools, PackedVecValue)
+    assert bools.to_python(list[int]) == [True, False]
+    assert all(isinstance(x, bool) for x in bools.to_python(list[int]))
+
+
+def test_packed_vec_boxed_values() -> None:
+    tk_val = PackedVecValue(array("d", [0.5, 1.0]))
+    digest = tk_val.digest()
+    # boxed once, and changes to the boxed elements are kept
+    assert tk_val.values is tk_val.values
+    tk_val.values.append(FloatValue(2.0))
+    assert tk_val.to_python(list[float]) == [0.5, 1.0, 2.0]
+    assert tk_val == VecValue([FloatValue(0.5), FloatValue(1.0), FloatValue(2.0)])
+    assert tk_val.digest() != digest
+    decoded = TierkreisValue.from_proto(tk_val.to_proto())
+    assert isinstance(decoded, PackedVecValue)
+    assert decoded == tk_val
+    # elements that no longer pack are encoded unpacked
+    tk_val.values.append(StringValue("x"))
+    assert not isinstance(TierkreisValue.from_proto(tk_val.to_proto()), PackedVecValue)
+    assert tk_val.to_python(list[float | str]) == [0.5, 1.0, 2.0, "x"]
+
+
+def test_vec_digest_follows_changes() -> None:
+    vec = VecValue([IntValue(1)])
+    before = vec.digest()
+    vec.values.append(IntValue(2))
+    assert vec.digest() != before
+    assert vec.digest() == VecValue([IntValue(1), IntValue(2)]).digest()
+
+
+def test_packed_vec_numpy() -> None:
+    np = pytest.importorskip("numpy")
+    arr = np.linspace(0.0, 1.0, 5)
+    tk_val = TierkreisValue.from_python(arr)
+    assert isinstance(tk_val, PackedVecValue)
+    assert tk_val.to_python(list[float]) == arr.tolist()
+    assert (tk_val.to_python(np.ndarray) == arr).all()
+    assert TierkreisValue.from_python(arr[::2], list[float]).to_python(list[float]) == (
+        arr[::2].tolist()
+    )
+
+
+def test_value_digest() -> None:
+    def struct(**kwargs: Any) -> StructValue:
+        return StructValue(
+            {k: TierkreisValue.from_python(v) for k, v in kwargs.items()}
+        )
+
+    a = struct(x=1, y=[0.5, -0.0], z={"k": "v"})
+    b = struct(z={"k": "v"}, y=[0.5, 0.0], x=1)
+    assert a == b
+    assert a.digest() == b.digest()
+    assert hash(a) == hash(b)
+    assert len({a, b}) == 1
+
+    c = struct(x=2, y=[0.5, 0.0], z={"k": "v"})
+    assert a.digest() != c.digest()
+    assert a != c
+    # values of different types differ
+    assert IntValue(1).digest() != FloatValue(1.0).digest()
+    assert (
+        VariantValue("a", StringValue("bc")).digest()
+        != VariantValue("ab", StringValue("c")).digest()
+    )
+
+    # packed and boxed vectors are interchangeable
+    packed = TierkreisValue.from_python([1.0, 2.0], list[float])
+    boxed = VecValue([FloatValue(1.0), FloatValue(2.0)])
+    assert isinstance(packed, PackedVecValue)
+    assert packed.digest() == boxed.digest()
+    assert hash(packed) == hash(boxed)
+
+
+def test_union_order_after_caching() -> None:
+    # Conversions cache introspection of annotations; unions which compare
+    # equal but list their members in a different order must not share it.
+    for _ in range(2):
+        as_int = TierkreisValue.from_python([True], list[int | bool])
+        as_bool = TierkreisValue.from_python([True], list[bool | int])
+        assert as_int == VecValue([VariantValue(UnionTag.type_tag(int), IntValue(1))])
+        assert as_bool != as_int
+
+
 @pytest.mark.xfail(reason="See issue #454")
 def test_reversed_union_enum() -> None:
     # This should be an entry in test:pydantic_types, if it worked:
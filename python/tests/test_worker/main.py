@@ -52,6 +52,16 @@ async def python_add(a: int, b: int) -> int:
     return a + b
 
 
+@namespace.function(executor="thread")
+def python_add_thread(a: int, b: int) -> int:
+    return a + b
+
+
+@namespace.function(executor="process")
+async def python_add_process(a: int, b: int) -> int:
+    return a + b
+
+
 @dataclass
 class IdDelayInputs(UnpackRow, Generic[A]):
     wait: int
@@ -0,0 +1,243 @@
+import asyncio
+from contextlib import asynccontextmanager
+from typing import AsyncIterator
+
+import pytest
+from grpclib.client import Channel
+from grpclib.const import Status
+from grpclib.exceptions import GRPCError
+
+import tierkreis.core.protos.tierkreis.v1alpha1.graph as pg
+import tierkreis.core.protos.tierkreis.v1alpha1.runtime as pr
+import tierkreis.core.protos.tierkreis.v1alpha1.worker as pw
+from tierkreis.core.function import FunctionName
+from tierkreis.core.tierkreis_graph import Location, TierkreisGraph
+from tierkreis.core.values import IntValue, StructValue, TierkreisValue, VecValue
+from tierkreis.pyruntime import PyRuntime
+from tierkreis.worker import Namespace, prelude
+from tierkreis.worker.exceptions import QueueFull
+from tierkreis.worker.limits import ConcurrencyLimit, LimitStats
+from tierkreis.worker.worker import Worker
+
+
+@asynccontextmanager
+async def serve(worker: Worker, monkeypatch) -> AsyncIterator[Channel]:
+    """Serve `worker` on a local port, yielding a channel connected to it."""
+    # normally set up by the worker executable
+    monkeypatch.setattr(prelude, "profile_worker", False, raising=False)
+    await worker.server.start("127.0.0.1", 0)
+    assert worker.server._server is not None
+    port = worker.server._server.sockets[0].getsockname()[1]
+    channel = Channel("127.0.0.1", port)
+    try:
+        yield channel
+    finally:
+        channel.close()
+        worker.server.close()
+        await worker.server.wait_closed()
+        worker.callbacks.close()
+
+
+def request(name: str, x: int) -> pw.RunFunctionRequest:
+    return pw.RunFunctionRequest(
+        function=FunctionName(name).to_proto(),
+        inputs=pg.StructValue(StructValue({"x": IntValue(x)}).to_proto_dict()),
+        # not connected to unless the function makes a callback
+        callback=pr.Callback(uri="http://127.0.0.1:1"),
+    )
+
+
+def output(outputs: pg.StructValue) -> TierkreisValue:
+    return StructValue.from_proto_dict(outputs.map).values["value"]
+
+
+@pytest.mark.asyncio
+async def test_concurrency_limit():
+    limit = ConcurrencyLimit(1, max_queued=1)
+    release = asyncio.Event()
+
+    async def call() -> None:
+        async with limit:
+            await release.wait()
+
+    tasks = [asyncio.create_task(call()) for _ in range(2)]
+    await asyncio.sleep(0)
+    assert limit.stats() == LimitStats(running=1, queued=1, max_queued=1, rejected=0)
+    with pytest.raises(QueueFull):
+        await call()
+    release.set()
+    await asyncio.gather(*tasks)
+    assert limit.stats() == LimitStats(running=0, queued=0, max_queued=1, rejected=1)
+
+
+@pytest.mark.asyncio
+async def test_worker_rejects_when_queue_full(monkeypatch):
+    ns = Namespace()
+    release = asyncio.Event()
+
+    @ns.function(max_concurrent=1)
+    async def wait(x: int) -> int:
+        await release.wait()
+        return x
+
+    @ns.function()
+    async def double(x: int) -> int:
+        return 2 * x
+
+    worker = Worker(ns, max_concurrent=2, max_queued=1)
+    async with serve(worker, monkeypatch) as channel:
+
+        async def run(name: str, x: int) -> TierkreisValue:
+            response = await pw.WorkerStub(channel).run_function(request(name, x))
+            return output(response.outputs)
+
+        waiting = [asyncio.create_task(run("wait", x)) for x in range(2)]
+        await asyncio.sleep(0.1)
+        # the second call of `wait` is queued, a third is rejected
+        with pytest.raises(GRPCError) as err:
+            await run("wait", 2)
+        assert err.value.status == Status.RESOURCE_EXHAUSTED
+        # other functions still run, within the limit of the worker
+        assert await run("double", 3) == IntValue(6)
+        stats = worker.limit_stats()
+        assert stats["wait"] == LimitStats(
+            running=1, queued=1, max_queued=1, rejected=1
+        )
+        assert stats[""].running == 1
+
+        release.set()
+        assert await asyncio.gather(*waiting) == [IntValue(0), IntValue(1)]
+
+
+@pytest.mark.asyncio
+async def test_run_functions_batch(monkeypatch):
+    ns = Namespace()
+    release = asyncio.Event()
+
+    @ns.function()
+    async def wait(x: int) -> int:
+        await release.wait()
+        return x
+
+    @ns.function()
+    async def double(x: int) -> int:
+        if x < 0:
+            raise ValueError("negative")
+        return 2 * x
+
+    async with serve(Worker(ns), monkeypatch) as channel:
+        calls = [request("wait", 1), request("double", 2), request("double", -1)]
+        stream = pw.BatchWorkerStub(channel).run_functions(
+            pw.RunFunctionsRequest(calls=calls)
+        )
+        # results arrive as the calls complete, not in order
+        first = await anext(stream)
+        assert first.index == 1 and output(first.outputs) == IntValue(4)
+        second = await anext(stream)
+        assert second.index == 2
+        assert second.error.code == Status.UNKNOWN.value
+        assert "negative" in second.error.message
+        release.set()
+        responses = [r async for r in stream]
+        assert [r.index for r in responses] == [0]
+        assert output(responses[0].outputs) == IntValue(1)
+
+
+@pytest.mark.asyncio
+async def test_stream_function(monkeypatch):
+    ns = Namespace()
+    release = asyncio.Event()
+    release.set()
+
+    @ns.function()
+    async def count(x: int) -> AsyncIterator[int]:
+        for i in range(x):
+            yield i
+            await release.wait()
+        if x > 3:
+            raise ValueError("too many")
+
+    @ns.function()
+    async def double(x: int) -> int:
+        return 2 * x
+
+    # runtimes collect the elements into a list
+    tg = TierkreisGraph()
+    tg.set_outputs(value=tg.add_func("count", x=tg.input["x"]))
+    assert (await PyRuntime([ns]).run_graph(tg, x=3))["value"] == VecValue(
+        [IntValue(i) for i in range(3)]
+    )
+
+    release.clear()
+    async with serve(Worker(ns), monkeypatch) as channel:
+        stub = pw.StreamingWorkerStub(channel)
+        stream = stub.stream_function(request("count", 3))
+        # each element is sent as soon as it is produced
+        first = await anext(stream)
+        release.set()
+        chunks = [first, *[c async for c in stream]]
+        values = [TierkreisValue.from_proto(v) for c in chunks for v in c.values]
+        assert values == [IntValue(i) for i in range(3)]
+
+        with pytest.raises(GRPCError) as err:
+            [c async for c in stub.stream_function(request("count", 5))]
+        assert err.value.status == Status.UNKNOWN
+        with pytest.raises(GRPCError) as err:
+            [c async for c in stub.stream_function(request("double", 1))]
+        assert err.value.status == Status.FAILED_PRECONDITION
+
+
+@pytest.mark.asyncio
+async def test_run_functions_batched(monkeypatch):
+    ns = Namespace()
+    batches = []
+
+    @ns.function(batched=True)
+    async def double(x: list[int]) -> list[int]:
+        batches.append(x)
+        return [2 * a for a in x]
+
+    async with serve(Worker(ns), monkeypatch) as channel:
+        calls = [request("double", x) for x in range(4)]
+        stream = pw.BatchWorkerStub(channel).run_functions(
+            pw.RunFunctionsRequest(calls=calls)
+        )
+        responses = sorted([r async for r in stream], key=lambda r: r.index)
+        assert [output(r.outputs) for r in responses] == [
+            IntValue(2 * x) for x in range(4)
+        ]
+        # the calls of the batched function are run together
+        assert batches == [[0, 1, 2, 3]]
+
+
+@pytest.mark.asyncio
+async def test_run_functions_batched_by_location(monkeypatch):
+    ns = Namespace()
+
+    @ns.function(batched=True)
+    async def double(x: list[int]) -> list[int]:
+        return [2 * a for a in x]
+
+    worker = Worker(ns)
+    locations = []
+    run_batch = worker.run_batch
+
+    async def record_location(function, inputs, callback, metadata):
+        locations.append((list(callback.loc.location), len(inputs)))
+        return await run_batch(function, inputs, callback, metadata)
+
+    monkeypatch.setattr(worker, "run_batch", record_location)
+    async with serve(worker, monkeypatch) as channel:
+        calls = [request("double", x) for x in range(4)]
+        # calls differing only in the location of their callback
+        for call in calls[2:]:
+            call.callback.loc = Location(["other"])
+        stream = pw.BatchWorkerStub(channel).run_functions(
+            pw.RunFunctionsRequest(calls=calls)
+        )
+        responses = sorted([r async for r in stream], key=lambda r: r.index)
+        assert [output(r.outputs) for r in responses] == [
+            IntValue(2 * x) for x in range(4)
+        ]
+        # each location is called back in a batch of its own
+        assert sorted(locations) == [([], 2), (["other"], 2)]
@@ -805,7 +805,7 @@ def _combine_captures(thunks: list[CaptureBuilder]) -> dict[ValueSource, PortID]
             if in_name := bg.captured.get(vs):
                 in_edge = bg.graph.out_edge_from_port(bg.graph.input[in_name])
                 assert in_edge is not None
-                bg.graph._graph.remove_edge(*in_edge.to_edge_handle())
+                bg.graph.remove_edge(in_edge)
                 bg.graph.add_edge(bg.graph.input[name], in_edge.target)
             else:
                 bg.graph.discard(bg.graph.input[name])
@@ -843,7 +843,7 @@ class Copyable(PortFunc):
         existing_edge = g.out_edge_from_port(self.np)
         if existing_edge is None:
             return self.np
-        g._graph.remove_edge(*existing_edge.to_edge_handle())
+        g.remove_edge(existing_edge)
         c1, c2 = g.copy_value(self.np)
         g.add_edge(c1, existing_edge.target, existing_edge.type_)
         return c2
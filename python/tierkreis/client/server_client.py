@@ -116,7 +116,7 @@ class ServerRuntime(RuntimeClient):
 
         decoded = await self._runtime_stub.run_graph(
             pr.RunGraphRequest(
-                graph=graph.to_proto(),
+                graph=graph._to_proto_cached(),
                 inputs=pg.StructValue(map=StructValue(inputs).to_proto_dict()),
                 type_check=True,
                 loc=loc,
@@ -0,0 +1,487 @@
+"""Storage backends for the structure of a `TierkreisGraph`.
+
+`TierkreisGraph` keeps its nodes and edges in a `GraphStorage`. The default
+`NetworkxStorage` wraps a `networkx.MultiDiGraph`, while `CompactStorage` keeps
+nodes in a contiguous list and edges in flat integer arrays with interned port
+names, for large graphs where memory use and construction time matter.
+"""
+
+import itertools
+from abc import ABC, abstractmethod
+from array import array
+from typing import TYPE_CHECKING, Iterable, Iterator, Optional, Tuple
+
+import networkx as nx
+
+from tierkreis.core.types import TierkreisType
+
+if TYPE_CHECKING:
+    from tierkreis.core.tierkreis_graph import TierkreisNode
+
+# (source node, target node, source port, target port, edge type)
+EdgeRecord = Tuple[int, int, str, str, Optional[TierkreisType]]
+
+
+class GraphStorage(ABC):
+    """Nodes and edges of a graph. Nodes are indexed contiguously from 0 in
+    the order they were added, edges are identified by their endpoints and
+    ports."""
+
+    @abstractmethod
+    def n_nodes(self) -> int:
+        """The number of nodes stored."""
+
+    @abstractmethod
+    def add_node(self, node: "TierkreisNode") -> int:
+        """Store a node and return its index."""
+
+    @abstractmethod
+    def get_node(self, idx: int) -> "TierkreisNode":
+        """The node at index `idx`."""
+
+    @abstractmethod
+    def set_node(self, idx: int, node: "TierkreisNode") -> None:
+        """Replace the node at index `idx`."""
+
+    @abstractmethod
+    def nodes(self) -> Iterator["TierkreisNode"]:
+        """Iterator over all nodes in index order."""
+
+    @abstractmethod
+    def add_edge(
+        self,
+        src: int,
+        tgt: int,
+        src_port: str,
+        tgt_port: str,
+        type_: Optional[TierkreisType],
+    ) -> None:
+        """Store an edge."""
+
+    @abstractmethod
+    def remove_edge(self, src: int, tgt: int, src_port: str, tgt_port: str) -> None:
+        """Remove an edge. Raises `KeyError` if it does not exist."""
+
+    @abstractmethod
+    def remove_incident_edges(self, idx: int) -> None:
+        """Remove all edges into and out of the node at index `idx`."""
+
+    @abstractmethod
+    def remove_nodes(self, nodes: Iterable[int]) -> None:
+        """Remove nodes and their incident edges, then shift the indices of the
+        remaining nodes so they are contiguous again."""
+
+    @abstractmethod
+    def edges(self) -> Iterator[EdgeRecord]:
+        """Iterator over all edges, grouped by source node."""
+
+    @abstractmethod
+    def in_edges(self, idx: int) -> Iterator[EdgeRecord]:
+        """Iterator over edges into the node at index `idx`."""
+
+    @abstractmethod
+    def out_edges(self, idx: int) -> Iterator[EdgeRecord]:
+        """Iterator over edges out of the node at index `idx`."""
+
+    @abstractmethod
+    def out_edge_from_port(self, idx: int, port: str) -> Optional[EdgeRecord]:
+        """The edge leaving output `port` of node `idx`, if there is one."""
+
+    @abstractmethod
+    def edge_type(
+        self, src: int, tgt: int, src_port: str, tgt_port: str
+    ) -> Optional[TierkreisType]:
+        """Type annotation of an edge. Raises `KeyError` if it does not exist."""
+
+    @abstractmethod
+    def set_edge_type(
+        self,
+        src: int,
+        tgt: int,
+        src_port: str,
+        tgt_port: str,
+        type_: Optional[TierkreisType],
+    ) -> None:
+        """Set the type annotation of an edge. Raises `KeyError` if it does not
+        exist."""
+
+    @abstractmethod
+    def to_networkx(self) -> nx.MultiDiGraph:
+        """The graph as a `networkx.MultiDiGraph`, with nodes labelled by index
+        carrying a "node_info" attribute, and edges keyed by
+        (source port, target port) carrying a "type" attribute."""
+
+    @classmethod
+    @abstractmethod
+    def from_networkx(cls, graph: nx.MultiDiGraph) -> "GraphStorage":
+        """Load from a `networkx.MultiDiGraph` laid out as in `to_networkx`."""
+
+
+class NetworkxStorage(GraphStorage):
+    """Storage backed by a `networkx.MultiDiGraph`."""
+
+    def __init__(self, graph: Optional[nx.MultiDiGraph] = None) -> None:
+        self.graph = nx.MultiDiGraph() if graph is None else graph
+
+    def n_nodes(self) -> int:
+        return self.graph.number_of_nodes()
+
+    def add_node(self, node: "TierkreisNode") -> int:
+        idx = self.graph.number_of_nodes()
+        self.graph.add_node(idx, node_info=node)
+        return idx
+
+    def get_node(self, idx: int) -> "TierkreisNode":
+        return self.graph.nodes[idx]["node_info"]
+
+    def set_node(self, idx: int, node: "TierkreisNode") -> None:
+        self.graph.nodes[idx]["node_info"] = node
+
+    def nodes(self) -> Iterator["TierkreisNode"]:
+        return (
+            self.graph.nodes[idx]["node_info"]
+            for idx in range(self.graph.number_of_nodes())
+        )
+
+    def add_edge(
+        self,
+        src: int,
+        tgt: int,
+        src_port: str,
+        tgt_port: str,
+        type_: Optional[TierkreisType],
+    ) -> None:
+        self.graph.add_edge(src, tgt, (src_port, tgt_port), type=type_)
+
+    def remove_edge(self, src: int, tgt: int, src_port: str, tgt_port: str) -> None:
+        try:
+            self.graph.remove_edge(src, tgt, (src_port, tgt_port))
+        except nx.NetworkXError as e:
+            raise KeyError((src, tgt, (src_port, tgt_port))) from e
+
+    def remove_incident_edges(self, idx: int) -> None:
+        self.graph.remove_edges_from(
+            list(self.graph.out_edges(idx, keys=True))
+            + list(self.graph.in_edges(idx, keys=True))
+        )
+
+    def remove_nodes(self, nodes: Iterable[int]) -> None:
+        self.graph.remove_nodes_from(nodes)
+        nx.relabel_nodes(
+            self.graph,
+            {n: i for i, n in enumerate(sorted(self.graph.nodes()))},
+            copy=False,
+        )
+
+    @staticmethod
+    def _records(edgeit: Iterable) -> Iterator[EdgeRecord]:
+        return (
+            (src, tgt, src_port, tgt_port, type_)
+            for (src, tgt, (src_port, tgt_port), type_) in edgeit
+        )
+
+    def edges(self) -> Iterator[EdgeRecord]:
+        return self._records(self.graph.edges(keys=True, data="type"))
+
+    def in_edges(self, idx: int) -> Iterator[EdgeRecord]:
+        return self._records(self.graph.in_edges(idx, keys=True, data="type"))
+
+    def out_edges(self, idx: int) -> Iterator[EdgeRecord]:
+        return self._records(self.graph.out_edges(idx, keys=True, data="type"))
+
+    def out_edge_from_port(self, idx: int, port: str) -> Optional[EdgeRecord]:
+        return next((e for e in self.out_edges(idx) if e[2] == port), None)
+
+    def edge_type(
+        self, src: int, tgt: int, src_port: str, tgt_port: str
+    ) -> Optional[TierkreisType]:
+        return self.graph.edges[src, tgt, (src_port, tgt_port)]["type"]
+
+    def set_edge_type(
+        self,
+        src: int,
+        tgt: int,
+        src_port: str,
+        tgt_port: str,
+        type_: Optional[TierkreisType],
+    ) -> None:
+        self.graph.edges[src, tgt, (src_port, tgt_port)]["type"] = type_
+
+    def to_networkx(self) -> nx.MultiDiGraph:
+        # the live graph, so changes made to it are reflected in the storage
+        return self.graph
+
+    @classmethod
+    def from_networkx(cls, graph: nx.MultiDiGraph) -> "NetworkxStorage":
+        return cls(graph)
+
+
+class CompactStorage(GraphStorage):
+    """Array-backed storage. Nodes are kept in a list, and edges in parallel
+    integer arrays of endpoints and interned port name ids. Adjacency for
+    `in_edges`/`out_edges` is held in compressed sparse row form, built
+    lazily. Edges added after it is built are kept in per node pending lists
+    and only merged in once they make up a large enough share of the edges, so
+    interleaving additions with adjacency queries stays linear overall. Removed
+    edges are left as tombstones until enough accumulate to be worth
+    compacting.
+
+    Assumes, as `TierkreisGraph` ensures, that each output port has at most
+    one outgoing edge.
+    """
+
+    _REMOVED = -1
+
+    def __init__(self) -> None:
+        self._nodes: list["TierkreisNode"] = []
+        self._port_names: list[str] = []
+        self._port_ids: dict[str, int] = {}
+        self._src = array("q")
+        self._tgt = array("q")
+        self._src_port = array("q")
+        self._tgt_port = array("q")
+        self._types: list[Optional[TierkreisType]] = []
+        self._n_removed = 0
+        # edge index by (source node, source port id)
+        self._by_source_port: dict[tuple[int, int], int] = {}
+        # (offsets, edge indices) by source and by target node
+        self._csr: Optional[tuple[array, array, array, array]] = None
+        # edges added since `_csr` was built, by source and by target node
+        self._pending_out: dict[int, list[int]] = {}
+        self._pending_in: dict[int, list[int]] = {}
+        self._n_pending = 0
+
+    def _port_id(self, port: str) -> int:
+        if (pid := self._port_ids.get(port)) is None:
+            pid = len(self._port_names)
+            self._port_ids[port] = pid
+            self._port_names.append(port)
+        return pid
+
+    def _record(self, edge: int) -> EdgeRecord:
+        names = self._port_names
+        return (
+            self._src[edge],
+            self._tgt[edge],
+            names[self._src_port[edge]],
+            names[self._tgt_port[edge]],
+            self._types[edge],
+        )
+
+    def _find(self, src: int, tgt: int, src_port: str, tgt_port: str) -> int:
+        key = (src, self._port_ids.get(src_port, -1))
+        edge = self._by_source_port.get(key)
+        if (
+            edge is None
+            or self._tgt[edge] != tgt
+            or self._port_names[self._tgt_port[edge]] != tgt_port
+        ):
+            raise KeyError((src, tgt, (src_port, tgt_port)))
+        return edge
+
+    def _adjacency(self, merge: bool = False) -> tuple[array, array, array, array]:
+        # rebuild once the pending edges outnumber those already indexed, or
+        # when asked to `merge` them in
+        if (
+            self._csr is None
+            or self._n_pending * 2 > len(self._src)
+            or (merge and self._n_pending)
+        ):
+            self._csr = (
+                *_csr_index(self._src, len(self._nodes)),
+                *_csr_index(self._tgt, len(self._nodes)),
+            )
+            self._pending_out.clear()
+            self._pending_in.clear()
+            self._n_pending = 0
+        return self._csr
+
+    def _invalidate(self) -> None:
+        self._csr = None
+        self._pending_out.clear()
+        self._pending_in.clear()
+        self._n_pending = 0
+
+    def _incident(
+        self, idx: int, offsets: array, indices: array, pending: dict[int, list[int]]
+    ) -> list[int]:
+        # nodes added after the index was built have no entry in `offsets`, and
+        # edges removed since are tombstoned rather than dropped from it
+        edges = (
+            indices[offsets[idx] : offsets[idx + 1]] if idx + 1 < len(offsets) else ()
+        )
+        src = self._src
+        return [
+            e
+            for e in itertools.chain(edges, pending.get(idx, ()))
+            if src[e] != self._REMOVED
+        ]
+
+    def _out_edge_ids(self, idx: int) -> list[int]:
+        out_off, out_idx, _, _ = self._adjacency()
+        return self._incident(idx, out_off, out_idx, self._pending_out)
+
+    def _in_edge_ids(self, idx: int) -> list[int]:
+        _, _, in_off, in_idx = self._adjacency()
+        return self._incident(idx, in_off, in_idx, self._pending_in)
+
+    def _compact_edges(self, node_map: Optional[dict[int, int]] = None) -> None:
+        # drop tombstones, and edges to or from nodes missing from `node_map`
+        live = [
+            e
+            for e in range(len(self._src))
+            if self._src[e] != self._REMOVED
+            and (
+                node_map is None
+                or (self._src[e] in node_map and self._tgt[e] in node_map)
+            )
+        ]
+        remap = (lambda n: n) if node_map is None else node_map.__getitem__
+        self._src = array("q", (remap(self._src[e]) for e in live))
+        self._tgt = array("q", (remap(self._tgt[e]) for e in live))
+        self._src_port = array("q", (self._src_port[e] for e in live))
+        self._tgt_port = array("q", (self._tgt_port[e] for e in live))
+        self._types = [self._types[e] for e in live]
+        self._n_removed = 0
+        self._by_source_port = {
+            (self._src[e], self._src_port[e]): e for e in range(len(live))
+        }
+        self._invalidate()
+
+    def n_nodes(self) -> int:
+        return len(self._nodes)
+
+    def add_node(self, node: "TierkreisNode") -> int:
+        self._nodes.append(node)
+        return len(self._nodes) - 1
+
+    def get_node(self, idx: int) -> "TierkreisNode":
+        return self._nodes[idx]
+
+    def set_node(self, idx: int, node: "TierkreisNode") -> None:
+        self._nodes[idx] = node
+
+    def nodes(self) -> Iterator["TierkreisNode"]:
+        return iter(self._nodes)
+
+    def add_edge(
+        self,
+        src: int,
+        tgt: int,
+        src_port: str,
+        tgt_port: str,
+        type_: Optional[TierkreisType],
+    ) -> None:
+        src_pid = self._port_id(src_port)
+        edge = len(self._src)
+        self._by_source_port[(src, src_pid)] = edge
+        self._src.append(src)
+        self._tgt.append(tgt)
+        self._src_port.append(src_pid)
+        self._tgt_port.append(self._port_id(tgt_port))
+        self._types.append(type_)
+        if self._csr is not None:
+            self._pending_out.setdefault(src, []).append(edge)
+            self._pending_in.setdefault(tgt, []).append(edge)
+            self._n_pending += 1
+
+    def _remove(self, edge: int) -> None:
+        del self._by_source_port[(self._src[edge], self._src_port[edge])]
+        self._src[edge] = self._REMOVED
+        self._tgt[edge] = self._REMOVED
+        self._types[edge] = None
+        self._n_removed += 1
+
+    def _removed(self) -> None:
+        # the adjacency index is only rebuilt once tombstones are compacted
+        if self._n_removed * 2 > len(self._src):
+            self._compact_edges()
+
+    def remove_edge(self, src: int, tgt: int, src_port: str, tgt_port: str) -> None:
+        self._remove(self._find(src, tgt, src_port, tgt_port))
+        self._removed()
+
+    def remove_incident_edges(self, idx: int) -> None:
+        incident = set(self._out_edge_ids(idx))
+        incident.update(self._in_edge_ids(idx))
+        for edge in incident:
+            self._remove(edge)
+        self._removed()
+
+    def remove_nodes(self, nodes: Iterable[int]) -> None:
+        removed = set(nodes)
+        kept = [n for n in range(len(self._nodes)) if n not in removed]
+        self._nodes = [self._nodes[n] for n in kept]
+        self._compact_edges({old: new for new, old in enumerate(kept)})
+
+    def edges(self) -> Iterator[EdgeRecord]:
+        _, out_idx, _, _ = self._adjacency(merge=True)
+        src = self._src
+        return map(self._record, (e for e in out_idx if src[e] != self._REMOVED))
+
+    def in_edges(self, idx: int) -> Iterator[EdgeRecord]:
+        return map(self._record, self._in_edge_ids(idx))
+
+    def out_edges(self, idx: int) -> Iterator[EdgeRecord]:
+        return map(self._record, self._out_edge_ids(idx))
+
+    def out_edge_from_port(self, idx: int, port: str) -> Optional[EdgeRecord]:
+        if (pid := self._port_ids.get(port)) is None:
+            return None
+        edge = self._by_source_port.get((idx, pid))
+        return None if edge is None else self._record(edge)
+
+    def edge_type(
+        self, src: int, tgt: int, src_port: str, tgt_port: str
+    ) -> Optional[TierkreisType]:
+        return self._types[self._find(src, tgt, src_port, tgt_port)]
+
+    def set_edge_type(
+        self,
+        src: int,
+        tgt: int,
+        src_port: str,
+        tgt_port: str,
+        type_: Optional[TierkreisType],
+    ) -> None:
+        self._types[self._find(src, tgt, src_port, tgt_port)] = type_
+
+    def to_networkx(self) -> nx.MultiDiGraph:
+        # a snapshot, changes made to it are not reflected in the storage
+        graph = nx.MultiDiGraph()
+        graph.add_nodes_from(
+            (idx, {"node_info": node}) for idx, node in enumerate(self._nodes)
+        )
+        for src, tgt, src_port, tgt_port, type_ in self.edges():
+            graph.add_edge(src, tgt, (src_port, tgt_port), type=type_)
+        return graph
+
+    @classmethod
+    def from_networkx(cls, graph: nx.MultiDiGraph) -> "CompactStorage":
+        storage = cls()
+        for idx in range(graph.number_of_nodes()):
+            storage.add_node(graph.nodes[idx]["node_info"])
+        for src, tgt, (src_port, tgt_port), type_ in graph.edges(
+            keys=True, data="type"
+        ):
+            storage.add_edge(src, tgt, src_port, tgt_port, type_)
+        return storage
+
+
+def _csr_index(endpoints: array, n_nodes: int) -> tuple[array, array]:
+    """Group edge indices by endpoint node with a stable counting sort,
+    returning per node offsets (of length `n_nodes + 1`) into the edge indices.
+    Tombstoned edges are skipped."""
+    offsets = array("q", bytes(8 * (n_nodes + 1)))
+    for node in endpoints:
+        if node != CompactStorage._REMOVED:
+            offsets[node + 1] += 1
+    for node in range(n_nodes):
+        offsets[node + 1] += offsets[node]
+    fill = array("q", offsets[:-1])
+    indices = array("q", bytes(8 * offsets[n_nodes]))
+    for edge, node in enumerate(endpoints):
+        if node != CompactStorage._REMOVED:
+            indices[fill[node]] = edge
+            fill[node] += 1
+    return offsets, indices
@@ -2,10 +2,13 @@
 
 import inspect
 from dataclasses import dataclass, fields, is_dataclass
+from functools import wraps
 from typing import (
     Any,
+    Callable,
     ParamSpec,
     Type,
+    TypeVar,
     cast,
     get_origin,
     get_type_hints,
@@ -17,6 +20,40 @@ from tierkreis.core.opaque_model import OpaqueModel
 
 Out = tuple[Type, str | None]
 
+R = TypeVar("R")
+
+# Parametrised generics (e.g. `list[Foo]`, `Model[int]`) mean the set of
+# annotations seen by a long-running worker is unbounded, so caches keyed on
+# annotations are bounded.
+TYPE_CACHE_SIZE = 1024
+
+
+def type_cache(func: Callable[..., R]) -> Callable[..., R]:
+    """Memoize a function of python type annotations, which must depend only
+    on its (positional) arguments.
+
+    Entries are keyed on the identity of the arguments rather than equality,
+    as equality of annotations is too coarse (e.g. `A | B == B | A`, but the
+    order of a union matters for conversion) and not all annotations are
+    hashable. Each entry keeps its arguments alive so identities are not
+    reused while cached. Once full, the oldest entry is evicted.
+    """
+    cache: dict[tuple[int, ...], tuple[tuple, R]] = {}
+
+    @wraps(func)
+    def wrapper(*args: Any) -> R:
+        key = tuple(map(id, args))
+        if (entry := cache.get(key)) is not None:
+            return entry[1]
+        result = func(*args)
+        if len(cache) >= TYPE_CACHE_SIZE:
+            cache.pop(next(iter(cache)), None)
+        cache[key] = (args, result)
+        return result
+
+    setattr(wrapper, "cache_clear", cache.clear)
+    return wrapper
+
 
 @dataclass(frozen=True)
 class FieldExtractionError(Exception):
@@ -48,21 +85,22 @@ class ClassField:
     default: Any = None
 
 
+@type_cache
 def python_struct_fields(
     type_: Type | ParamSpec,
-) -> list[ClassField]:
+) -> tuple[ClassField, ...]:
     """For a python dataclass or pydantic BaseModel, extract the fields and their types."""
     if inspect.isclass(type_) and issubclass(type_, pyd.BaseModel):
         if issubclass(type_, OpaqueModel):
             model_type = cast(Type[OpaqueModel], type_)
 
-            return [
+            return (
                 ClassField(
                     model_type.tierkreis_field(),
                     str,
                     None,
-                )
-            ]
+                ),
+            )
         model_type = cast(Type[pyd.BaseModel], type_)
         model_fields = model_type.model_fields
 
@@ -72,7 +110,7 @@ def python_struct_fields(
                 raise ValueError("Discriminators must be static strings.")
             return disc
 
-        return [
+        return tuple(
             ClassField(
                 k,
                 _assert_annotation(f.annotation, type_),
@@ -80,7 +118,7 @@ def python_struct_fields(
                 default=f.default,
             )
             for k, f in model_fields.items()
-        ]
+        )
     # pydantic binds concrete types to generic fields when available in the
     # annotation.
     # For generic dataclasses, just deal with the generic base type (used in workers).
@@ -88,7 +126,7 @@ def python_struct_fields(
     if is_dataclass(type_):
         dat_fields = fields(type_)
         types = get_type_hints(type_)
-        return [
+        return tuple(
             ClassField(
                 f.name,
                 types[f.name],
@@ -96,12 +134,13 @@ def python_struct_fields(
                 default=f.default,
             )
             for f in dat_fields
-        ]
+        )
     raise FieldExtractionError(
         type_, "Can only convert dataclasses or pydantic BaseModel."
     )
 
 
+@type_cache
 def generic_origin(type_: Type) -> Type | None:
     """Like typing.get_origin but also supports Generic pydantic 'BaseModel's"""
     if (o := get_origin(type_)) is not None:
@@ -1,11 +1,11 @@
 """Visualise TierkreisGraph using graphviz."""
 
 import copy
+import itertools
 import textwrap
 from typing import Iterable, NewType, Optional, Tuple, cast
 
 import graphviz as gv
-import networkx as nx
 
 from tierkreis.core.tierkreis_graph import (
     BoxNode,
@@ -15,6 +15,7 @@ from tierkreis.core.tierkreis_graph import (
     InputNode,
     Location,
     MatchNode,
+    NodeRef,
     OutputNode,
     TagNode,
     TierkreisGraph,
@@ -446,34 +447,37 @@ def _merge_copies(g: TierkreisGraph) -> _CopyMergedGraph:
         return _CopyMergedGraph(g)
 
     g = copy.deepcopy(g)
+    merged: set[int] = set()
+    # copy nodes are drawn without ports, so merged edges only need distinct
+    # source port names
+    merged_ports = (f"merged_{i}" for i in itertools.count())
     while candidates:
         node_name = candidates.pop()
         copy_children = (
-            n.idx
-            for e in g.out_edges(node_name)
-            if g[(n := e.target.node_ref)].is_copy_node()
+            e for e in g.out_edges(node_name) if g[e.target.node_ref].is_copy_node()
         )
 
-        if (copy_child := next(copy_children, None)) is None:
+        if (child_edge := next(copy_children, None)) is None:
             continue
+        copy_child = child_edge.target.node_ref.idx
 
         # this node is going to merge with child - check it again
         candidates.add(node_name)
 
         eds = list(g.out_edges(copy_child))
 
-        # remove child and all connected edges
-        g._graph.remove_node(copy_child)
+        # disconnect child, it is removed once all merges are done
+        g.remove_edge(child_edge)
+        for e in eds:
+            g.remove_edge(e)
+        merged.add(copy_child)
         # remove from candidates if still a candidate
-        if copy_child in candidates:
-            candidates.remove(copy_child)
+        candidates.discard(copy_child)
 
         for e in eds:
             # source port is not valid - this graph will not type check
-            g._graph.add_edge(
-                node_name, e.target.node_ref.idx, ("", e.target.port), type=e.type_
-            )
+            g.add_edge(NodeRef(node_name, g)[next(merged_ports)], e.target, e.type_)
 
-    # make node indices contiguous again
-    g._graph = nx.convert_node_labels_to_integers(g._graph)
+    # indices of the remaining nodes are made contiguous again
+    g.remove_nodes(merged)
     return _CopyMergedGraph(g)
@@ -0,0 +1,342 @@
+"""Optimisation passes over `TierkreisGraph`s, which remove nodes from a graph
+without changing its outputs.
+
+Each pass modifies a graph in place. `optimise` runs a pipeline of passes on a
+copy of a graph, until none of them make any further changes.
+"""
+
+from abc import ABC, abstractmethod
+from typing import TYPE_CHECKING, Hashable, Optional, Sequence, cast
+
+from tierkreis.core.tierkreis_graph import (
+    ConstNode,
+    FunctionNode,
+    InputNode,
+    MatchNode,
+    NodeRef,
+    TagNode,
+    TierkreisGraph,
+    TierkreisNode,
+)
+from tierkreis.core.values import StructValue
+
+if TYPE_CHECKING:
+    from tierkreis.client.runtime_client import RuntimeClient
+    from tierkreis.worker.namespace import Namespace
+
+
+class GraphPass(ABC):
+    """A transformation of a graph, made in place."""
+
+    @abstractmethod
+    async def run(self, graph: TierkreisGraph) -> bool:
+        """Transform `graph`, returning whether anything was changed."""
+
+
+def _topological_order(graph: TierkreisGraph) -> list[int]:
+    """Indices of the nodes of `graph`, each after all of its predecessors.
+    Nodes on (or downstream of) cycles are left out."""
+    indegree = [0] * graph.n_nodes
+    for edge in graph.edges():
+        indegree[edge.target.node_ref.idx] += 1
+    order = [idx for idx, n in enumerate(indegree) if n == 0]
+    for idx in order:
+        for edge in graph.out_edges(idx):
+            target = edge.target.node_ref.idx
+            indegree[target] -= 1
+            if indegree[target] == 0:
+                order.append(target)
+    return order
+
+
+# builtin functions whose outputs depend only on their inputs
+PURE_BUILTINS = frozenset(
+    "and or xor eq neq id copy switch make_pair unpack_pair int_to_float"
+    " float_to_int iadd isub imul idiv imod ipow fadd fsub fmul fdiv fmod fpow"
+    " ilt ileq igt igeq flt fleq fgt fgeq".split()
+)
+
+
+def _is_pure_function(node: FunctionNode, namespace: Optional["Namespace"]) -> bool:
+    name = node.function_name
+    if name.namespaces == [] and name.name in PURE_BUILTINS:
+        return True
+    if namespace is None:
+        return False
+    function = namespace.get_function(node.function_name)
+    return function is not None and function.pure
+
+
+def _is_pure(node: TierkreisNode, namespace: Optional["Namespace"]) -> bool:
+    """Whether running `node` has no effect other than producing its outputs."""
+    if isinstance(node, (ConstNode, TagNode, MatchNode)):
+        return True
+    return isinstance(node, FunctionNode) and _is_pure_function(node, namespace)
+
+
+def _is_discard(node: TierkreisNode) -> bool:
+    return isinstance(node, FunctionNode) and node.is_discard_node()
+
+
+class FoldConstants(GraphPass):
+    """Replace calls of pure functions, all of whose inputs are constants, with
+    constants holding their outputs.
+
+    Functions are looked up in `namespace`, and only `PURE_BUILTINS` and those
+    declared pure are evaluated, with `runtime` passed to them. Calls which
+    raise are left in the graph, to raise when it is run.
+    """
+
+    def __init__(
+        self, namespace: "Namespace", runtime: Optional["RuntimeClient"] = None
+    ):
+        self.namespace = namespace
+        self.runtime = runtime
+
+    async def run(self, graph: TierkreisGraph) -> bool:
+        removed: list[int] = []
+        # in topological order, so that chains of calls are folded in one pass
+        for idx in _topological_order(graph):
+            node = graph[idx]
+            if not isinstance(node, FunctionNode) or not _is_pure_function(
+                node, self.namespace
+            ):
+                continue
+            function = self.namespace.get_function(node.function_name)
+            if function is None:
+                continue
+            in_edges = list(graph.in_edges(idx))
+            sources = [graph[e.source.node_ref.idx] for e in in_edges]
+            if not all(isinstance(source, ConstNode) for source in sources):
+                continue
+            inputs = StructValue(
+                {
+                    edge.target.port: cast(ConstNode, source).value
+                    for edge, source in zip(in_edges, sources)
+                }
+            )
+            try:
+                outputs = (
+                    await function.run(cast("RuntimeClient", self.runtime), {}, inputs)
+                ).values
+            except Exception:
+                continue
+            out_edges = list(graph.out_edges(idx))
+            if any(edge.source.port not in outputs for edge in out_edges):
+                continue
+            for edge in out_edges:
+                graph.remove_edge(edge)
+                const = graph.add_const(outputs[edge.source.port])
+                graph.add_edge(const["value"], edge.target, edge.type_)
+            removed.append(idx)
+            removed.extend(e.source.node_ref.idx for e in in_edges)
+        if removed:
+            graph.remove_nodes(removed)
+        return bool(removed)
+
+
+class CollapseCopies(GraphPass):
+    """Remove `copy` nodes one of whose outputs is discarded (or unused), and
+    `id` nodes, connecting their input directly to the remaining output."""
+
+    async def run(self, graph: TierkreisGraph) -> bool:
+        removed: list[int] = []
+        for idx, node in enumerate(graph.nodes()):
+            if not isinstance(node, FunctionNode) or node.function_name.namespaces:
+                continue
+            if not (node.is_copy_node() or node.function_name.name == "id"):
+                continue
+            in_edges = list(graph.in_edges(idx))
+            out_edges = list(graph.out_edges(idx))
+            discarded = [
+                e for e in out_edges if _is_discard(graph[e.target.node_ref.idx])
+            ]
+            kept = [e for e in out_edges if e not in discarded]
+            if len(in_edges) != 1 or len(kept) > 1 or not out_edges:
+                continue
+            if not kept:
+                # keep a single discard of the input
+                kept, discarded = discarded[:1], discarded[1:]
+            (in_edge,), (out_edge,) = in_edges, kept
+            graph.remove_edge(in_edge)
+            graph.remove_edge(out_edge)
+            graph.add_edge(
+                in_edge.source,
+                out_edge.target,
+                out_edge.type_ if out_edge.type_ is not None else in_edge.type_,
+            )
+            removed.append(idx)
+            removed.extend(e.target.node_ref.idx for e in discarded)
+        if removed:
+            graph.remove_nodes(removed)
+        return bool(removed)
+
+
+class EliminateDeadNodes(GraphPass):
+    """Remove pure nodes whose outputs are all discarded (or unused), along with
+    those discards. Inputs of removed nodes which come from nodes that are kept
+    are discarded instead.
+
+    Constants, tags, matches and `PURE_BUILTINS` are always pure, and other
+    functions are if declared so in `namespace`.
+    """
+
+    def __init__(self, namespace: Optional["Namespace"] = None):
+        self.namespace = namespace
+
+    async def run(self, graph: TierkreisGraph) -> bool:
+        dead: set[int] = set()
+        discards: list[int] = []
+        for idx in reversed(_topological_order(graph)):
+            node = graph[idx]
+            if _is_discard(node) or not _is_pure(node, self.namespace):
+                continue
+            targets = [e.target.node_ref.idx for e in graph.out_edges(idx)]
+            if all(t in dead or _is_discard(graph[t]) for t in targets):
+                dead.add(idx)
+                discards.extend(t for t in targets if t not in dead)
+        if not dead:
+            return False
+        for idx in dead:
+            for edge in list(graph.in_edges(idx)):
+                if edge.source.node_ref.idx not in dead:
+                    graph.remove_edge(edge)
+                    graph.discard(edge.source)
+        graph.remove_nodes([*dead, *discards])
+        return True
+
+
+class EliminateCommonSubexpressions(GraphPass):
+    """Merge calls of the same pure function on the same input values, sending
+    the outputs of the call that is kept through `copy` nodes to the consumers
+    of the others.
+
+    Inputs are the same if they come from the same port of the graph input, or
+    from constants with equal values, or from the same output of calls already
+    merged, possibly via `copy` or `id` nodes. Functions are pure if they are
+    `PURE_BUILTINS` or declared so in `namespace`. The inputs of merged calls
+    are discarded, for `CollapseCopies` and `EliminateDeadNodes` to remove.
+    """
+
+    def __init__(self, namespace: Optional["Namespace"] = None):
+        self.namespace = namespace
+
+    async def run(self, graph: TierkreisGraph) -> bool:
+        # values are numbered, so that equal values have equal numbers
+        numbers: dict[Hashable, int] = {}
+        # the number of the value at each output port
+        values: dict[tuple[int, str], int] = {}
+        # the function and numbered inputs of each pure call
+        keys: dict[int, Hashable] = {}
+        # the call kept for each function and numbered inputs
+        kept: dict[Hashable, int] = {}
+        removed: list[int] = []
+
+        def number(key: Hashable) -> int:
+            return numbers.setdefault(key, len(numbers))
+
+        def value(idx: int, port: str) -> int:
+            if (num := values.get((idx, port))) is None:
+                # outputs of calls which are not pure are all different
+                num = values[idx, port] = number((keys.get(idx, idx), port))
+            return num
+
+        for idx in _topological_order(graph):
+            node = graph[idx]
+            if isinstance(node, InputNode):
+                for edge in graph.out_edges(idx):
+                    values[idx, edge.source.port] = number(("in", edge.source.port))
+                continue
+            if isinstance(node, ConstNode):
+                values[idx, "value"] = number(("const", node.value.digest()))
+                continue
+            if not isinstance(node, FunctionNode) or not _is_pure_function(
+                node, self.namespace
+            ):
+                continue
+            in_edges = list(graph.in_edges(idx))
+            inputs = tuple(
+                sorted(
+                    (e.target.port, value(e.source.node_ref.idx, e.source.port))
+                    for e in in_edges
+                )
+            )
+            name = node.function_name
+            if name.namespaces == [] and name.name in ("copy", "id"):
+                if len(in_edges) == 1:
+                    for edge in graph.out_edges(idx):
+                        values[idx, edge.source.port] = inputs[0][1]
+                continue
+            key = keys[idx] = (str(name), node.retry_secs, inputs)
+            if (original := kept.setdefault(key, idx)) == idx:
+                continue
+
+            for edge in list(graph.out_edges(idx)):
+                graph.remove_edge(edge)
+                source = NodeRef(original, graph)[edge.source.port]
+                existing = graph.out_edge_from_port(source)
+                if existing is None:
+                    graph.add_edge(source, edge.target, edge.type_)
+                    continue
+                graph.remove_edge(existing)
+                copy = graph.add_func("copy", value=source)
+                graph.add_edge(copy["value_0"], existing.target, existing.type_)
+                graph.add_edge(copy["value_1"], edge.target, edge.type_)
+                num = value(original, edge.source.port)
+                values[copy.idx, "value_0"] = values[copy.idx, "value_1"] = num
+            for edge in in_edges:
+                graph.remove_edge(edge)
+                graph.discard(edge.source)
+            removed.append(idx)
+        if removed:
+            graph.remove_nodes(removed)
+        return bool(removed)
+
+
+def standard_passes(
+    namespace: Optional["Namespace"] = None,
+    runtime: Optional["RuntimeClient"] = None,
+) -> list[GraphPass]:
+    """Constant folding (if a `namespace` of functions is given), then common
+    subexpression elimination, then collapsing of copies, then dead node
+    elimination."""
+    passes: list[GraphPass] = []
+    if namespace is not None:
+        passes.append(FoldConstants(namespace, runtime))
+    passes.extend(
+        [
+            EliminateCommonSubexpressions(namespace),
+            CollapseCopies(),
+            EliminateDeadNodes(namespace),
+        ]
+    )
+    return passes
+
+
+def _copy(graph: TierkreisGraph) -> TierkreisGraph:
+    """Copy of the structure of `graph`, sharing its (immutable) nodes."""
+    result = TierkreisGraph(graph.name, compact=graph.is_compact)
+    result.input_order = list(graph.input_order)
+    result.output_order = list(graph.output_order)
+    storage = result._storage
+    for node in list(graph.nodes())[2:]:
+        storage.add_node(node)
+    for record in graph._storage.edges():
+        storage.add_edge(*record)
+    result._version += 1
+    return result
+
+
+async def optimise(
+    graph: TierkreisGraph, passes: Sequence[GraphPass], max_rounds: int = 8
+) -> TierkreisGraph:
+    """Run `passes` in order on a copy of `graph`, repeating until none of them
+    change it (or for at most `max_rounds`), and return the copy."""
+    result = _copy(graph)
+    for _ in range(max_rounds):
+        changed = False
+        for graph_pass in passes:
+            changed |= await graph_pass.run(result)
+        if not changed:
+            break
+    return result
@@ -22,4 +22,4 @@ class RuntimeGraph(Generic[In, Out]):
     graph: TierkreisGraph
 
     def to_proto(self) -> pg.Value:
-        return pg.Value(graph=self.graph.to_proto())
+        return pg.Value(graph=self.graph._to_proto_cached())
@@ -1,17 +1,17 @@
 """Utilities for building tierkreis graphs."""
 
-import copy
 import typing
+import weakref
 from abc import ABC, abstractmethod
 from dataclasses import dataclass, field
 from typing import (
     TYPE_CHECKING,
     Any,
+    ClassVar,
     Dict,
     Iterable,
     Iterator,
     List,
-    Mapping,
     Optional,
     Tuple,
     Type,
@@ -23,9 +23,15 @@ import betterproto
 import networkx as nx
 
 import tierkreis.core.protos.tierkreis.v1alpha1.graph as pg
+from tierkreis.core._graph_storage import (
+    CompactStorage,
+    EdgeRecord,
+    GraphStorage,
+    NetworkxStorage,
+)
 from tierkreis.core.function import FunctionName
 from tierkreis.core.types import TierkreisType
-from tierkreis.core.values import T, TierkreisValue
+from tierkreis.core.values import T, TierkreisValue, _digest_of, _length_prefixed
 
 if TYPE_CHECKING:
     from tierkreis.builder import Unpack, ValueSource
@@ -42,9 +48,14 @@ class TierkreisNode(ABC):
         """Convert to node protobuf message."""
         pass
 
+    def _fingerprint_label(self) -> bytes:
+        """Digest of the node itself, ignoring its edges."""
+        return _digest_of(b"n", bytes(self.to_proto()))
+
     @classmethod
-    def from_proto(cls, node: pg.Node) -> "TierkreisNode":
-        """Load from protobuf node."""
+    def from_proto(cls, node: pg.Node, trusted: bool = False) -> "TierkreisNode":
+        """Load from protobuf node. The graphs of box nodes are loaded with the
+        given `trusted` flag, see `TierkreisGraph.from_proto`."""
         name, out_node = betterproto.which_one_of(node, "node")
 
         result: TierkreisNode
@@ -53,7 +64,8 @@ class TierkreisNode(ABC):
         elif name == "box":
             box_node = cast(pg.BoxNode, out_node)
             result = BoxNode(
-                graph=TierkreisGraph.from_proto(box_node.graph), location=box_node.loc
+                graph=TierkreisGraph.from_proto(box_node.graph, trusted=trusted),
+                location=box_node.loc,
             )
         elif name == "function":
             fn_node = cast(pg.FunctionNode, out_node)
@@ -114,6 +126,9 @@ class ConstNode(TierkreisNode):
     def to_proto(self) -> pg.Node:
         return pg.Node(const=self.value.to_proto())
 
+    def _fingerprint_label(self) -> bytes:
+        return _digest_of(b"c", self.value.digest())
+
 
 @dataclass(frozen=True)
 class BoxNode(TierkreisNode):
@@ -123,7 +138,12 @@ class BoxNode(TierkreisNode):
     location: Location
 
     def to_proto(self) -> pg.Node:
-        return pg.Node(box=pg.BoxNode(loc=self.location, graph=self.graph.to_proto()))
+        return pg.Node(
+            box=pg.BoxNode(loc=self.location, graph=self.graph._to_proto_cached())
+        )
+
+    def _fingerprint_label(self) -> bytes:
+        return _digest_of(b"b", bytes(self.location), self.graph.fingerprint())
 
 
 @dataclass(frozen=True)
@@ -272,13 +292,6 @@ def to_nodeport(n: IncomingWireType) -> NodePort:
 _EdgeData = Tuple[int, int, Tuple[str, str]]
 
 
-def _to_edgedata(edgeit: Iterable[Any]) -> Iterator[_EdgeData]:
-    return (
-        (src, dest, (cast(str, srcport), cast(str, destport)))
-        for (src, dest, (srcport, destport)) in edgeit
-    )
-
-
 class MismatchedGraphs(Exception):
     def __init__(self, graph: "TierkreisGraph", endpoint: NodeRef):
         self.graph = graph
@@ -289,6 +302,14 @@ class MismatchedGraphs(Exception):
 class TierkreisGraph:
     """Python in-memory representation of a Tierkreis graph. Can be loaded from
     and written to protobuf format. Supports building graphs programmatically.
+
+    By default the graph structure is stored in a `networkx.MultiDiGraph`. A
+    compact array-backed storage, using less memory and faster to build for
+    large graphs, can be requested with `compact=True`; in that case a
+    read-only networkx view is only constructed if `_graph` is accessed.
+
+    Graphs have a structural `fingerprint`, and a `GraphInterner` can be used
+    to share one instance between structurally identical graphs.
     """
 
     input_node_idx: int = 0
@@ -299,10 +320,21 @@ class TierkreisGraph:
         source: NodePort
         target: NodePort
 
-    def __init__(self, name: str = "") -> None:
-        """Create an empty graph with an optional name."""
+    def __init__(self, name: str = "", compact: bool = False) -> None:
+        """Create an empty graph with an optional name, optionally using compact
+        storage."""
         self.name = name
-        self._graph = nx.MultiDiGraph()
+        self._storage: GraphStorage = CompactStorage() if compact else NetworkxStorage()
+        # incremented on every structural change, so derived data (such as
+        # execution plans) can be cached against a particular version
+        self._version = 0
+        # (version, graphs) of the graphs nested directly in this one
+        self._nested: Optional[tuple[int, list[Union[TierkreisGraph, GraphValue]]]] = (
+            None
+        )
+        # (`_deep_version`, result) of `fingerprint` and `to_proto`
+        self._fingerprint: Optional[tuple[tuple, bytes]] = None
+        self._proto: Optional[tuple[tuple, pg.Graph]] = None
         inp = self.add_node(InputNode())
         assert inp.idx == self.input_node_idx
         output = self.add_node(OutputNode())
@@ -311,6 +343,26 @@ class TierkreisGraph:
         self.input_order: list[str] = []
         self.output_order: list[str] = []
 
+    @property
+    def _graph(self) -> nx.MultiDiGraph:
+        """The graph structure as a networkx graph. For compact storage this is
+        a frozen snapshot: it does not reflect later changes to the graph, and
+        modifying it raises `networkx.NetworkXError`. Assign to `_graph` or use
+        the graph methods to make changes instead."""
+        if self.is_compact:
+            return nx.freeze(self._storage.to_networkx())
+        return self._storage.to_networkx()
+
+    @_graph.setter
+    def _graph(self, graph: nx.MultiDiGraph) -> None:
+        self._storage = type(self._storage).from_networkx(graph)
+        self._version += 1
+
+    @property
+    def is_compact(self) -> bool:
+        """Whether the graph uses compact storage."""
+        return isinstance(self._storage, CompactStorage)
+
     @property
     def input(self) -> NodeRef:
         """Get a reference to the input node of the graph."""
@@ -332,7 +384,7 @@ class TierkreisGraph:
     @property
     def n_nodes(self) -> int:
         """The number of nodes in the graph."""
-        return len(self._graph)
+        return self._storage.n_nodes()
 
     def add_node(
         self,
@@ -350,8 +402,8 @@ class TierkreisGraph:
         Returns:
             NodeRef: A reference to the added node.
         """
-        node_ref = NodeRef(self._graph.number_of_nodes(), self)
-        self._graph.add_node(node_ref.idx, node_info=_tk_node)
+        node_ref = NodeRef(self._storage.add_node(_tk_node), self)
+        self._version += 1
         for target_port_name, source in incoming_wires.items():
             self.add_edge(source, node_ref[target_port_name])
 
@@ -459,69 +511,37 @@ class TierkreisGraph:
 
         return return_outputs
 
-    def inline_boxes(self, recursive=False) -> "TierkreisGraph":
+    def inline_boxes(
+        self, recursive: bool = False, max_nodes: Optional[int] = None
+    ) -> "TierkreisGraph":
         """Inline boxes by inserting the graphs they contain in to the parent
-        graph. Optionally do this recursively.
+        graph. Optionally do this recursively, and optionally only for boxes
+        whose graphs have at most `max_nodes` nodes.
+
+        The inlined graph is built in a single pass, sharing the (immutable)
+        nodes of this graph and of the boxed graphs rather than copying them.
 
         Returns:
             TierkreisGraph: Inlined graph
         """
-
-        graph = copy.deepcopy(self)
-        deleted_nodes: list[int] = []
-        # Iterate through self.nodes rather than graph.nodes so we can mutate latter
-        for node_idx, node in enumerate(self.nodes()):
-            if not isinstance(node, BoxNode):
-                continue
-
-            boxed_g = node.graph
-            if recursive:
-                boxed_g = boxed_g.inline_boxes(recursive)
-
-            curr_inputs = graph.in_edges(node_idx)
-
-            incoming_ports = {edge.target.port: edge.source for edge in curr_inputs}
-            curr_outputs = [
-                graph._to_tkedge(e)
-                for e in _to_edgedata(graph._graph.out_edges(node_idx, keys=True))
-            ]
-            # Removal all incident edges
-            graph._graph.remove_edges_from(
-                list(graph._graph.out_edges(node_idx))
-                + list(graph._graph.in_edges(node_idx))
-            )
-
-            deleted_nodes.append(node_idx)
-
-            inserted_outputs = graph.insert_graph(boxed_g, **incoming_ports)
-
-            for edge in curr_outputs:
-                graph.add_edge(
-                    inserted_outputs[edge.source.port], edge.target, edge.type_
-                )
-        if deleted_nodes:
-            graph.remove_nodes(deleted_nodes)
-
-        return graph
+        return _Inliner(recursive, max_nodes).flatten(self)
 
     def nodes(self) -> Iterator[TierkreisNode]:
         """Iterator over all nodes in the graph."""
-        return (
-            self._graph.nodes[idx]["node_info"]
-            for idx in range(self._graph.number_of_nodes())
-        )
+        return self._storage.nodes()
 
     def edges(self) -> Iterator[TierkreisEdge]:
         """Iterator over all edges in the graph."""
-        return map(self._to_tkedge, _to_edgedata(self._graph.edges(keys=True)))
+        return map(self._to_tkedge, self._storage.edges())
 
     def __getitem__(self, key: Union[int, NodeRef]) -> TierkreisNode:
         name = key.idx if isinstance(key, NodeRef) else key
-        return self._graph.nodes[name]["node_info"]
+        return self._storage.get_node(name)
 
     def __setitem__(self, key: Union[int, NodeRef], node: TierkreisNode):
         name = key.idx if isinstance(key, NodeRef) else key
-        self._graph.nodes[name]["node_info"] = node
+        self._storage.set_node(name, node)
+        self._version += 1
 
     def add_edge(
         self,
@@ -561,38 +581,34 @@ class TierkreisGraph:
             raise ValueError(
                 f"Already an edge from {node_port_from} to {existing_edge.target}"
             )
-        edge_data = (
+        self._storage.add_edge(
             node_port_from.node_ref.idx,
             node_port_to.node_ref.idx,
-            (node_port_from.port, node_port_to.port),
-        )
-        self._graph.add_edge(
-            *edge_data,
-            type=tk_type,
+            node_port_from.port,
+            node_port_to.port,
+            tk_type,
         )
+        self._version += 1
 
-        return self._to_tkedge(edge_data)
+        return TierkreisEdge(node_port_from, node_port_to, tk_type)
 
     def remove_edge(self, edge: TierkreisEdge):
         """Remove an edge from the graph."""
         assert edge.source.node_ref.graph is self
         assert edge.target.node_ref.graph is self
-        self._graph.remove_edge(
+        self._storage.remove_edge(
             edge.source.node_ref.idx,
             edge.target.node_ref.idx,
-            (edge.source.port, edge.target.port),
+            edge.source.port,
+            edge.target.port,
         )
+        self._version += 1
 
     def remove_nodes(self, nodes: Iterable[int]):
         """Remove nodes from the graph by index."""
-        self._graph.remove_nodes_from(nodes)
-        # shift node indices to account for missing nodes
-        # without this step indices will not be contiguous
-        nx.relabel_nodes(
-            self._graph,
-            {n: i for i, n in enumerate(sorted(self._graph.nodes()))},
-            copy=False,
-        )
+        # indices of the remaining nodes are shifted to be contiguous
+        self._storage.remove_nodes(nodes)
+        self._version += 1
 
     def annotate_input(
         self, input_port: str, edge_type: Optional[Union[Type, TierkreisType]]
@@ -600,11 +616,12 @@ class TierkreisGraph:
         """Annotate an input port of the graph with a type."""
         (in_edge,) = [
             e
-            for e in _to_edgedata(self._graph.out_edges(self.input_node_idx, keys=True))
-            if e[2][0] == input_port
+            for e in self._storage.out_edges(self.input_node_idx)
+            if e[2] == input_port
         ]
         tk_type = _to_tierkreis_type(edge_type)
-        self._graph.edges[in_edge]["type"] = tk_type
+        self._storage.set_edge_type(*in_edge[:4], tk_type)
+        self._version += 1
 
     def annotate_output(
         self, output_port: str, edge_type: Optional[Union[Type, TierkreisType]]
@@ -612,12 +629,13 @@ class TierkreisGraph:
         """Annotate an output port of the graph with a type."""
         (out_edge,) = [
             e
-            for e in _to_edgedata(self._graph.in_edges(self.output_node_idx, keys=True))
-            if e[2][1] == output_port
+            for e in self._storage.in_edges(self.output_node_idx)
+            if e[3] == output_port
         ]
 
         tk_type = _to_tierkreis_type(edge_type)
-        self._graph.edges[out_edge]["type"] = tk_type
+        self._storage.set_edge_type(*out_edge[:4], tk_type)
+        self._version += 1
 
     def get_edge(self, source: NodePort, target: NodePort) -> TierkreisEdge:
         """Retrieve an edge from the graph by source and target ports.
@@ -637,31 +655,23 @@ class TierkreisGraph:
         for out_name, port in kwargs.items():
             self.add_edge(port, self.output[out_name])
 
-    def _to_tkedge(self, handle: _EdgeData) -> TierkreisEdge:
-        src, tgt, (src_port, tgt_port) = handle
-        edge_data = cast(
-            Mapping, self._graph.get_edge_data(src, tgt, (src_port, tgt_port))
-        )
+    def _to_tkedge(self, record: EdgeRecord) -> TierkreisEdge:
+        src, tgt, src_port, tgt_port, type_ = record
         return TierkreisEdge(
             NodeRef(src, self)[src_port],
             NodeRef(tgt, self)[tgt_port],
-            edge_data["type"],
+            type_,
         )
 
     def in_edges(self, node: Union[NodeRef, int]) -> Iterator[TierkreisEdge]:
         """Iterator over incoming edges to a node."""
         node_name = node if isinstance(node, int) else node.idx
-        return map(
-            self._to_tkedge, _to_edgedata(self._graph.in_edges(node_name, keys=True))
-        )
+        return map(self._to_tkedge, self._storage.in_edges(node_name))
 
     def out_edges(self, node: Union[NodeRef, int]) -> Iterator[TierkreisEdge]:
         """Iterator over outgoing edges from a node."""
         node_idx = node if isinstance(node, int) else node.idx
-        return map(
-            self._to_tkedge,
-            _to_edgedata(self._graph.out_edges(node_idx, keys=True)),
-        )
+        return map(self._to_tkedge, self._storage.out_edges(node_idx))
 
     def discard(self, out_port: NodePort) -> None:
         """Add a discard node, discarding the value at the specified output port."""
@@ -708,15 +718,121 @@ class TierkreisGraph:
 
     def out_edge_from_port(self, source: NodePort) -> Optional[TierkreisEdge]:
         """If there is an edge at port, return it, else None."""
-        out_edges = [
-            out_edge
-            for out_edge in self.out_edges(source.node_ref)
-            if out_edge.source.port == source.port
-        ]
-        if len(out_edges) == 0:
-            return None
-        (out_edge,) = out_edges
-        return out_edge
+        record = self._storage.out_edge_from_port(source.node_ref.idx, source.port)
+        return None if record is None else self._to_tkedge(record)
+
+    def _nested_graphs(self) -> list[Union["TierkreisGraph", "GraphValue"]]:
+        """The graphs of the box nodes, and the constant graph values, directly
+        in this graph. Graph values are included whether or not they have been
+        loaded, so that loading and then modifying one is noticed."""
+        if self._nested is None or self._nested[0] != self._version:
+            graphs: list[Union[TierkreisGraph, GraphValue]] = []
+            for node in self.nodes():
+                if isinstance(node, BoxNode):
+                    graphs.append(node.graph)
+                elif isinstance(node, ConstNode) and isinstance(node.value, GraphValue):
+                    graphs.append(node.value)
+            self._nested = (self._version, graphs)
+        return self._nested[1]
+
+    def _deep_version(self) -> tuple:
+        """Changes whenever this graph, or a graph nested in it, is modified."""
+        return (
+            self._version,
+            self.name,
+            tuple(self.input_order),
+            tuple(self.output_order),
+            *(g._deep_version() for g in self._nested_graphs()),
+        )
+
+    def fingerprint(self) -> bytes:
+        """Digest of the structure of the graph: its nodes (including nested
+        graphs and constant values), the ports and type annotations of its
+        edges, and its input and output orders.
+
+        The fingerprint does not depend on the order in which nodes and edges
+        were added, so on node indices, nor on the name of the graph. It is
+        cached until the graph, or a graph nested in it, is modified.
+        """
+        if self._fingerprint is None or self._fingerprint[0] != self._deep_version():
+            fingerprint = self._compute_fingerprint()
+            # taken afterwards, as computing loads any lazy graph values
+            self._fingerprint = (self._deep_version(), fingerprint)
+        return self._fingerprint[1]
+
+    def _compute_fingerprint(self) -> bytes:
+        n_nodes = self._storage.n_nodes()
+        labels = [node._fingerprint_label() for node in self._storage.nodes()]
+        type_digests: dict[int, bytes] = {}
+        # (source, target, source port, target port, type) with encoded ports
+        edges: list[tuple[int, int, bytes, bytes, bytes]] = []
+        for src, tgt, src_port, tgt_port, type_ in self._storage.edges():
+            if type_ is None:
+                type_digest = bytes(16)
+            elif (type_digest := type_digests.get(id(type_))) is None:
+                type_digest = _digest_of(b"t", bytes(type_.to_proto()))
+                type_digests[id(type_)] = type_digest
+            edges.append(
+                (
+                    src,
+                    tgt,
+                    _length_prefixed(src_port),
+                    _length_prefixed(tgt_port),
+                    type_digest,
+                )
+            )
+        ins: list[list[int]] = [[] for _ in range(n_nodes)]
+        outs: list[list[int]] = [[] for _ in range(n_nodes)]
+        for i, (src, tgt, *_) in enumerate(edges):
+            outs[src].append(i)
+            ins[tgt].append(i)
+
+        # topological order, leaving out nodes on (or downstream of) cycles
+        indegree = [len(edge_ids) for edge_ids in ins]
+        order = [idx for idx in range(n_nodes) if indegree[idx] == 0]
+        for idx in order:
+            for i in outs[idx]:
+                tgt = edges[i][1]
+                indegree[tgt] -= 1
+                if indegree[tgt] == 0:
+                    order.append(tgt)
+        on_cycle = [idx for idx in range(n_nodes) if indegree[idx] > 0]
+
+        # each node is summarised by everything upstream and downstream of it
+        up: list[bytes] = list(labels)
+        down: list[bytes] = list(labels)
+        for idx in on_cycle:
+            down[idx] = _digest_of(b"x", labels[idx])
+        for idx in order:
+            up[idx] = _digest_of(
+                b"u",
+                labels[idx],
+                _sorted_parts(
+                    edges[i][3] + up[edges[i][0]] + edges[i][2] + edges[i][4]
+                    for i in ins[idx]
+                ),
+            )
+        for idx in reversed(order):
+            down[idx] = _digest_of(
+                b"d",
+                labels[idx],
+                _sorted_parts(
+                    edges[i][2] + down[edges[i][1]] + edges[i][3] + edges[i][4]
+                    for i in outs[idx]
+                ),
+            )
+        hashes = [_digest_of(b"h", u, d) for u, d in zip(up, down)]
+
+        return _digest_of(
+            b"G",
+            _sorted_parts(hashes),
+            _sorted_parts(
+                hashes[src] + src_port + hashes[tgt] + tgt_port + type_digest
+                for src, tgt, src_port, tgt_port, type_digest in edges
+            ),
+            _ordered_parts(map(_length_prefixed, self.input_order)),
+            _ordered_parts(map(_length_prefixed, self.output_order)),
+        )
 
     def to_proto(self) -> pg.Graph:
         """Build protobuf message from graph."""
@@ -724,18 +840,55 @@ class TierkreisGraph:
         pg_graph.nodes = [n.to_proto() for n in self.nodes()]
         pg_graph.edges = [e.to_proto() for e in self.edges()]
         pg_graph.name = self.name
-        pg_graph.input_order = self.input_order
-        pg_graph.output_order = self.output_order
+        pg_graph.input_order = list(self.input_order)
+        pg_graph.output_order = list(self.output_order)
         return pg_graph
 
+    def _to_proto_cached(self) -> pg.Graph:
+        """Protobuf message of the graph, cached until the graph, or a graph
+        nested in it, is modified, so a graph shared by many box nodes is only
+        converted once. The message is shared, so must not be modified; it is
+        intended for embedding in other messages that are then serialised."""
+        key = self._deep_version()
+        if self._proto is None or self._proto[0] != key:
+            self._proto = (key, self.to_proto())
+        return self._proto[1]
+
     @classmethod
-    def from_proto(cls, pg_graph: pg.Graph) -> "TierkreisGraph":
-        """Load from protobuf message."""
-        tk_graph = cls()
+    def from_proto(
+        cls, pg_graph: pg.Graph, compact: bool = False, trusted: bool = False
+    ) -> "TierkreisGraph":
+        """Load from protobuf message, optionally into compact storage.
+
+        Edge type annotations that occur more than once are only converted once,
+        and the resulting `TierkreisType` shared between those edges.
+
+        If `trusted`, the message is assumed to describe a well-formed graph
+        (e.g. one returned by type inference) and is loaded directly into
+        storage, skipping the checks made by `add_edge`.
+        """
+        tk_graph = cls(compact=compact)
         tk_graph.name = pg_graph.name
         tk_graph.input_order = pg_graph.input_order
         tk_graph.output_order = pg_graph.output_order
 
+        edge_types: dict[bytes, Optional[TierkreisType]] = {}
+
+        if trusted:
+            storage = tk_graph._storage
+            for pgn in pg_graph.nodes[2:]:
+                storage.add_node(TierkreisNode.from_proto(pgn, trusted=True))
+            for pg_edge in pg_graph.edges:
+                storage.add_edge(
+                    pg_edge.node_from,
+                    pg_edge.node_to,
+                    pg_edge.port_from,
+                    pg_edge.port_to,
+                    _edge_type_from_proto(pg_edge.edge_type, edge_types),
+                )
+            tk_graph._version += 1
+            return tk_graph
+
         for pgn in pg_graph.nodes[2:]:
             tk_graph.add_node(TierkreisNode.from_proto(pgn))
 
@@ -744,14 +897,7 @@ class TierkreisGraph:
             target_node = NodeRef(pg_edge.node_to, tk_graph)
             source = NodePort(source_node, PortID(pg_edge.port_from))
             target = NodePort(target_node, PortID(pg_edge.port_to))
-            # TODO make all edge type conversions possible
-            edge_type = pg_edge.edge_type
-            tk_edge_type: Optional[TierkreisType] = None
-            if edge_type is not None:
-                try:
-                    tk_edge_type = TierkreisType.from_proto(edge_type)
-                except ValueError:
-                    tk_edge_type = None
+            tk_edge_type = _edge_type_from_proto(pg_edge.edge_type, edge_types)
 
             tk_graph.add_edge(source, target, tk_edge_type)
         return tk_graph
@@ -782,22 +928,229 @@ def _to_tierkreis_type(
         )
 
 
+def _edge_type_from_proto(
+    edge_type: Optional[pg.Type], interned: dict[bytes, Optional[TierkreisType]]
+) -> Optional[TierkreisType]:
+    """Convert an edge type annotation, reusing the conversion of an identical
+    annotation from `interned` if there is one."""
+    if edge_type is None:
+        return None
+    key = bytes(edge_type)
+    try:
+        return interned[key]
+    except KeyError:
+        pass
+    # TODO make all edge type conversions possible
+    tk_edge_type: Optional[TierkreisType]
+    try:
+        tk_edge_type = TierkreisType.from_proto(edge_type)
+    except ValueError:
+        tk_edge_type = None
+    interned[key] = tk_edge_type
+    return tk_edge_type
+
+
+# an output port in a graph being built, as (node index, port)
+_Source = Tuple[int, PortID]
+
+
+class _Inliner:
+    """Builds the graphs returned by `TierkreisGraph.inline_boxes`."""
+
+    def __init__(self, recursive: bool, max_nodes: Optional[int]) -> None:
+        self.recursive = recursive
+        self.max_nodes = max_nodes
+        # flattened versions of the graphs of boxes that are not inlined
+        self._flattened: dict[int, TierkreisGraph] = {}
+
+    def _inlines(self, node: BoxNode) -> bool:
+        return self.max_nodes is None or node.graph.n_nodes <= self.max_nodes
+
+    def flatten(self, graph: TierkreisGraph) -> TierkreisGraph:
+        result = TierkreisGraph(graph.name, compact=graph.is_compact)
+        result.input_order = list(graph.input_order)
+        result.output_order = list(graph.output_order)
+        self._insert(
+            result,
+            graph,
+            {port: (result.input_node_idx, port) for port in graph.inputs()},
+            None,
+            inline=True,
+        )
+        result._version += 1
+        return result
+
+    def _insert(
+        self,
+        result: TierkreisGraph,
+        graph: TierkreisGraph,
+        inputs: dict[PortID, _Source],
+        outputs: Optional[dict[PortID, _Source]],
+        inline: bool,
+    ) -> None:
+        """Add the nodes and edges of `graph` to `result`, connecting its inputs
+        to `inputs` and recording the sources of its outputs in `outputs`, or
+        connecting them to the output of `result` if `outputs` is None. Boxes
+        are inlined (or flattened) only if `inline`."""
+        target = result._storage
+        storage = graph._storage
+        # index of each node in `result`, -1 for inlined boxes and the input
+        index = [-1] * storage.n_nodes()
+        if outputs is None:
+            index[graph.output_node_idx] = result.output_node_idx
+        # inlined boxes, with the sources of their inputs so far
+        box_inputs: dict[int, dict[PortID, _Source]] = {}
+        for idx, node in enumerate(storage.nodes()):
+            if idx in (graph.input_node_idx, graph.output_node_idx):
+                continue
+            if isinstance(node, BoxNode) and inline:
+                if self._inlines(node):
+                    box_inputs[idx] = {}
+                    continue
+                if self.recursive:
+                    node = BoxNode(self._flatten_box(node.graph), node.location)
+            index[idx] = target.add_node(node)
+
+        # boxes are inlined once all their inputs are known, so in topological
+        # order, and then the edges from their outputs added
+        box_outputs: dict[int, dict[PortID, _Source]] = {}
+        pending: dict[int, list[EdgeRecord]] = {idx: [] for idx in box_inputs}
+        n_missing = {idx: 0 for idx in box_inputs}
+        for record in storage.edges():
+            if record[1] in n_missing:
+                n_missing[record[1]] += 1
+        ready = [idx for idx, n in n_missing.items() if n == 0]
+
+        def add(record: EdgeRecord) -> None:
+            src, tgt, src_port, tgt_port, type_ = record
+            if src == graph.input_node_idx:
+                source = inputs[src_port]
+            elif index[src] >= 0:
+                source = (index[src], src_port)
+            else:
+                source = box_outputs[src][src_port]
+            if index[tgt] >= 0:
+                target.add_edge(source[0], index[tgt], source[1], tgt_port, type_)
+            elif tgt == graph.output_node_idx:
+                cast(dict, outputs)[tgt_port] = source
+            else:
+                box_inputs[tgt][tgt_port] = source
+                n_missing[tgt] -= 1
+                if n_missing[tgt] == 0:
+                    ready.append(tgt)
+
+        for record in storage.edges():
+            if record[0] in pending:
+                pending[record[0]].append(record)
+            else:
+                add(record)
+        for idx in ready:
+            box_outputs[idx] = {}
+            self._insert(
+                result,
+                cast(BoxNode, storage.get_node(idx)).graph,
+                box_inputs[idx],
+                box_outputs[idx],
+                inline=self.recursive,
+            )
+            for record in pending[idx]:
+                add(record)
+        if len(box_outputs) < len(box_inputs):
+            raise ValueError("Cannot inline boxes on a cycle.")
+
+    def _flatten_box(self, graph: TierkreisGraph) -> TierkreisGraph:
+        # graphs shared between boxes stay shared
+        if (flattened := self._flattened.get(id(graph))) is None:
+            flattened = self.flatten(graph)
+            self._flattened[id(graph)] = flattened
+        return flattened
+
+
+def _sorted_parts(parts: Iterable[bytes]) -> bytes:
+    """Encoding of a multiset of self-delimiting parts."""
+    return _ordered_parts(sorted(parts))
+
+
+def _ordered_parts(parts: Iterable[bytes]) -> bytes:
+    """Encoding of a sequence of self-delimiting parts."""
+    parts = list(parts)
+    return len(parts).to_bytes(8, "little") + b"".join(parts)
+
+
 # GraphValue defined after TierkreisGraph to avoid circular/delayed import
 
 
-@dataclass(frozen=True)
 class GraphValue(TierkreisValue):
-    """A value defined by a Tierkreis graph. (Higher order value)."""
+    """A value defined by a Tierkreis graph. (Higher order value).
 
-    value: TierkreisGraph
-    _proto_name: str = "graph"
+    When loaded from protobuf the graph message is kept as it is, and only
+    converted to a `TierkreisGraph` the first time `value` is accessed. Until
+    then, or for as long as the converted graph is left unmodified, `to_proto`
+    re-emits the original message. Values that are only passed through
+    therefore never pay for converting the graph in either direction.
+    """
+
+    _proto_name: ClassVar[str] = "graph"
+
+    def __init__(self, value: TierkreisGraph) -> None:
+        self._value: Optional[TierkreisGraph] = value
+        self._proto: Optional[pg.Graph] = None
+        # version of `_value` when it was loaded from `_proto`
+        self._proto_version = 0
+
+    @classmethod
+    def _lazy(cls, proto: pg.Graph) -> "GraphValue":
+        graph_value = cls.__new__(cls)
+        graph_value._value = None
+        graph_value._proto = proto
+        graph_value._proto_version = 0
+        return graph_value
+
+    @property
+    def value(self) -> TierkreisGraph:
+        """The graph, converted from protobuf on first access if necessary."""
+        if self._value is None:
+            self._value = TierkreisGraph.from_proto(cast(pg.Graph, self._proto))
+            self._proto_version = self._value._version
+        return self._value
+
+    @property
+    def is_loaded(self) -> bool:
+        """Whether the graph has been converted to a `TierkreisGraph`."""
+        return self._value is not None
+
+    def _deep_version(self) -> tuple:
+        """Changes when the graph is loaded, and whenever it is modified after
+        that (see `TierkreisGraph._deep_version`)."""
+        return () if self._value is None else self._value._deep_version()
+
+    def __eq__(self, other: object) -> bool:
+        if not isinstance(other, GraphValue):
+            return False
+        return self.value is other.value
+
+    def __hash__(self) -> int:
+        return hash(self.value)
+
+    def digest(self) -> bytes:
+        # not cached, as the graph may be modified
+        return _digest_of(b"g", self.value.fingerprint())
+
+    def __repr__(self) -> str:
+        if self._value is None:
+            return "GraphValue(<protobuf graph>)"
+        return f"GraphValue({self._value!r})"
 
     @property
     def _instance_pytype(self) -> typing.Type:
         return TierkreisGraph
 
     def to_proto(self) -> pg.Value:
-        return pg.Value(graph=self.value.to_proto())
+        if self._proto is not None and (
+            self._value is None or self._value._version == self._proto_version
+        ):
+            return pg.Value(graph=self._proto)
+        return pg.Value(graph=self.value._to_proto_cached())
 
     def _to_python_impl(self, type_: typing.Type[T]) -> T | None:
         from tierkreis.core.python import RuntimeGraph
@@ -811,7 +1164,7 @@ class GraphValue(TierkreisValue):
 
     @classmethod
     def from_proto(cls, value: Any) -> "TierkreisValue":
-        return cls(TierkreisGraph.from_proto(cast(pg.Graph, value)))
+        return cls._lazy(cast(pg.Graph, value))
 
     def __str__(self) -> str:
         return "GraphValue"
@@ -820,6 +1173,56 @@ class GraphValue(TierkreisValue):
         return "Graph"
 
 
+class GraphInterner:
+    """Table of graphs by `fingerprint`, so that structurally identical graphs
+    (and graphs nested in them) share a single instance, and with it a single
+    protobuf conversion.
+
+    Interned graphs are shared, so must not be modified afterwards. The table
+    only holds weak references, so does not keep graphs alive.
+    """
+
+    def __init__(self) -> None:
+        self._graphs: weakref.WeakValueDictionary[bytes, TierkreisGraph] = (
+            weakref.WeakValueDictionary()
+        )
+
+    def intern(self, graph: TierkreisGraph) -> TierkreisGraph:
+        """The interned graph with the same structure as `graph`, which is
+        `graph` itself if there is none yet. The graphs nested in `graph` are
+        replaced with their interned versions first."""
+        return self._intern(graph, {})
+
+    def _intern(
+        self, graph: TierkreisGraph, seen: dict[int, TierkreisGraph]
+    ) -> TierkreisGraph:
+        if (interned := seen.get(id(graph))) is not None:
+            return interned
+        for idx, node in enumerate(list(graph.nodes())):
+            if isinstance(node, BoxNode):
+                nested = self._intern(node.graph, seen)
+                if nested is not node.graph:
+                    graph[idx] = BoxNode(nested, node.location)
+            elif (
+                isinstance(node, ConstNode)
+                and isinstance(node.value, GraphValue)
+                and node.value.is_loaded
+            ):
+                nested = self._intern(node.value.value, seen)
+                if nested is not node.value.value:
+                    graph[idx] = ConstNode(GraphValue(nested))
+        fingerprint = graph.fingerprint()
+        interned = self._graphs.get(fingerprint)
+        # an interned graph which has since been modified is replaced
+        if interned is None or interned.fingerprint() != fingerprint:
+            self._graphs[fingerprint] = interned = graph
+        seen[id(graph)] = interned
+        return interned
+
+    def __len__(self) -> int:
+        return len(self._graphs)
+
+
 # allow graph displays in jupyter notebooks
 from tierkreis.core.graphviz import tierkreis_to_graphviz  # noqa: E402
 
@@ -66,7 +66,7 @@ def infer_graph_types(
 
     req = ps.InferGraphTypesRequest(
         gwi=ps.GraphWithInputs(
-            graph=g.to_proto(),
+            graph=g._to_proto_cached(),
             inputs=None
             if inputs is None
             else pg.StructValue(map=inputs.to_proto_dict()),
@@ -78,7 +78,8 @@ def infer_graph_types(
     )
     name, _ = betterproto.which_one_of(resp, "response")
     if name == "success":
-        g = TierkreisGraph.from_proto(resp.success.graph)
+        # the type checker only returns well-formed graphs
+        g = TierkreisGraph.from_proto(resp.success.graph, trusted=True)
         if inputs is None:
             assert resp.success.inputs is None
             return g
@@ -16,7 +16,11 @@ import betterproto
 from typing_extensions import Self
 
 import tierkreis.core.protos.tierkreis.v1alpha1.graph as pg
-from tierkreis.core._internal import FieldExtractionError, python_struct_fields
+from tierkreis.core._internal import (
+    FieldExtractionError,
+    python_struct_fields,
+    type_cache,
+)
 from tierkreis.core.opaque_model import _to_snake_case
 
 
@@ -795,6 +799,7 @@ class TypeScheme:
 UNIT_TYPE = StructType(Row())
 
 
+@type_cache
 def _get_discriminators(
     field_type: typing.Type,
     disc: Optional[str],
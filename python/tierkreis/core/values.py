@@ -4,11 +4,15 @@ from __future__ import annotations
 
 import inspect
 import json
+import struct
+import sys
 import typing
 import warnings
 from abc import ABC, abstractmethod
-from dataclasses import Field, dataclass, fields, make_dataclass
+from array import array
+from dataclasses import Field, dataclass
 from enum import Enum
+from hashlib import blake2b
 from types import UnionType
 from typing import (
     Any,
@@ -33,6 +37,7 @@ from tierkreis.core._internal import (
     FieldExtractionError,
     generic_origin,
     python_struct_fields,
+    type_cache,
 )
 from tierkreis.core.opaque_model import (
     OpaqueModel,
@@ -92,14 +97,58 @@ class ToPythonFailure(Exception):
         return f"Value {self.value} conversion to python type failed."
 
 
+def _digest_of(kind: bytes, *parts: bytes) -> bytes:
+    h = blake2b(kind, digest_size=16)
+    for part in parts:
+        h.update(part)
+    return h.digest()
+
+
+def _length_prefixed(name: str) -> bytes:
+    encoded = name.encode("utf-8", "surrogatepass")
+    return len(encoded).to_bytes(8, "little") + encoded
+
+
+def _packed_digest(data: array) -> bytes:
+    # little-endian 64-bit elements, with -0.0 normalised to 0.0
+    if data.typecode == "d" and 0.0 in data:
+        data = array("d", (x + 0.0 for x in data))
+    elif sys.byteorder == "big":
+        data = array(data.typecode, data)
+    if sys.byteorder == "big":
+        data.byteswap()
+    return _digest_of(b"v" + data.typecode.encode(), data.tobytes())
+
+
+def _digests_differ(a: "TierkreisValue", b: "TierkreisValue") -> bool:
+    """Whether both values have computed their digests, and they differ, so the
+    values cannot be equal."""
+    da = getattr(a, "_digest", None)
+    db = getattr(b, "_digest", None)
+    return da is not None and db is not None and da != db
+
+
 class TierkreisValue(ABC):
     """Abstract base class for all Tierkreis compatible values."""
 
+    # allow subclasses to be fully slotted
+    __slots__ = ()
+
     _proto_map: Dict[str, typing.Type["TierkreisValue"]] = dict()
 
+    # name of the `pg.Value` field holding values of this type, set by each
+    # concrete subclass
+    _proto_name: ClassVar[str]
+
+    # cached result of `digest`, set on first use
+    _digest: bytes
+
     def __init_subclass__(cls, **kwargs) -> None:
         super().__init_subclass__()
-        TierkreisValue._proto_map[getattr(cls, "_proto_name")] = cls
+        # alternative representations (e.g. `PackedVecValue`) inherit the
+        # protobuf name of their base, which handles decoding
+        if "_proto_name" in cls.__dict__:
+            TierkreisValue._proto_map[cls._proto_name] = cls
 
     @property
     def _instance_pytype(self) -> typing.Type:
@@ -109,6 +158,23 @@ class TierkreisValue(ABC):
     def to_proto(self) -> pg.Value:
         pass
 
+    def digest(self) -> bytes:
+        """A canonical 16-byte digest of the value, stable across processes.
+
+        Equal values have equal digests, independent of the order of the
+        fields of structs and the entries of maps. Values are treated as
+        immutable, so the digest is computed once and cached.
+        """
+        try:
+            return self._digest
+        except AttributeError:
+            digest = self._digest_impl()
+            object.__setattr__(self, "_digest", digest)
+            return digest
+
+    def _digest_impl(self) -> bytes:
+        return _digest_of(b"proto", bytes(self.to_proto()))
+
     @abstractmethod
     def viz_str(self) -> str:
         """String representation used in graph visualisation."""
@@ -149,11 +215,12 @@ class TierkreisValue(ABC):
         if (py_val := self._to_python_impl(type_)) is not None:
             # check if known type to subclass
             return py_val
-        if inner_type := _extract_literal_type(type_):
+        info = _py_type_info(type_)
+        if inner_type := info.literal_type:
             return self.to_python(inner_type)
-        if inner_type := _is_annotated(type_):
+        if inner_type := info.annotated_type:
             return self.to_python(inner_type)
-        if args := _get_union_args(type_):
+        if args := info.union_args:
             # expected type is a union so try converting to each and return the
             # first success.
             for possible in args:
@@ -235,6 +302,9 @@ class BoolValue(TierkreisValue):
     def to_proto(self) -> pg.Value:
         return pg.Value(boolean=self.value)
 
+    def _digest_impl(self) -> bytes:
+        return _digest_of(b"b", b"\x01" if self.value else b"\x00")
+
     def _to_python_impl(self, type_: typing.Type[T]) -> T | None:
         if type_ is bool:
             return cast(T, self.value)
@@ -264,6 +334,9 @@ class StringValue(TierkreisValue):
     def to_proto(self) -> pg.Value:
         return pg.Value(str=self.value)
 
+    def _digest_impl(self) -> bytes:
+        return _digest_of(b"s", self.value.encode("utf-8", "surrogatepass"))
+
     def _to_python_impl(self, type_: typing.Type[T]) -> T | None:
         if type_ is str:
             return cast(T, self.value)
@@ -295,6 +368,12 @@ class IntValue(TierkreisValue):
     def to_proto(self) -> pg.Value:
         return pg.Value(integer=self.value)
 
+    def _digest_impl(self) -> bytes:
+        n = self.value
+        return _digest_of(
+            b"i", n.to_bytes(n.bit_length() // 8 + 1, "little", signed=True)
+        )
+
     def _to_python_impl(self, type_: typing.Type[T]) -> T | None:
         if type_ is int:
             return cast(T, self.value)
@@ -324,6 +403,10 @@ class FloatValue(TierkreisValue):
     def to_proto(self) -> pg.Value:
         return pg.Value(flt=self.value)
 
+    def _digest_impl(self) -> bytes:
+        # adding 0.0 maps -0.0 to 0.0, which compare equal
+        return _digest_of(b"f", struct.pack("<d", self.value + 0.0))
+
     def _to_python_impl(self, type_: typing.Type[T]) -> T | None:
         if type_ is float:
             return cast(T, self.value)
@@ -359,6 +442,9 @@ class PairValue(Generic[TKVal1, TKVal2], TierkreisValue):
             )
         )
 
+    def _digest_impl(self) -> bytes:
+        return _digest_of(b"p", self.first.digest(), self.second.digest())
+
     def _to_python_impl(self, type_: typing.Type[T]) -> T | None:
         if typing.get_origin(type_) is TierkreisPair:
             type_args = typing.get_args(type_)
@@ -403,11 +489,39 @@ class VecValue(Generic[TKVal1], TierkreisValue):
         # Would be better to check all elements are the same.
         return list[elem_t]
 
+    def __eq__(self, __o: object) -> bool:
+        if not isinstance(__o, VecValue):
+            return NotImplemented
+        if _digests_differ(self, __o):
+            return False
+        return self.values == __o.values
+
+    def __hash__(self) -> int:
+        return hash(self.digest())
+
+    def digest(self) -> bytes:
+        # not cached, as the list of values may be modified
+        return self._digest_impl()
+
     def to_proto(self) -> pg.Value:
         return pg.Value(
             vec=pg.VecValue(vec=[value.to_proto() for value in self.values])
         )
 
+    def _digest_impl(self) -> bytes:
+        values = self.values
+        # vectors of floats or integers have the digest of their packed form
+        if values and all(type(v) is FloatValue for v in values):
+            data = array("d", (cast(FloatValue, v).value for v in values))
+            return _packed_digest(data)
+        if values and all(type(v) is IntValue for v in values):
+            try:
+                data = array("q", (cast(IntValue, v).value for v in values))
+                return _packed_digest(data)
+            except OverflowError:
+                pass
+        return _digest_of(b"v", *(v.digest() for v in values))
+
     def _to_python_impl(self, type_: typing.Type[T]) -> T | None:
         if typing.get_origin(type_) in (list, tuple):
             type_args = typing.get_args(type_)
@@ -421,6 +535,10 @@ class VecValue(Generic[TKVal1], TierkreisValue):
     @classmethod
     def from_proto(cls, value: Any) -> "TierkreisValue":
         vec_value = cast(pg.VecValue, value)
+        if vec_value.packed_flt:
+            return PackedVecValue.from_bytes("d", vec_value.packed_flt)
+        if vec_value.packed_int:
+            return PackedVecValue.from_bytes("q", vec_value.packed_int)
         return VecValue(
             [TierkreisValue.from_proto(element) for element in vec_value.vec]
         )
@@ -432,6 +550,181 @@ class VecValue(Generic[TKVal1], TierkreisValue):
         return f"[{', '.join(val.viz_str() for val in self.values)}]"
 
 
+# array typecodes for packed vectors, with the python element types and the
+# buffer formats (e.g. of NumPy arrays) that can be copied without conversion
+_PACKED_ELEMS: dict[str, tuple[typing.Type, frozenset[str]]] = {
+    "d": (float, frozenset({"d"})),
+    "q": (int, frozenset({"q", "l"})),
+}
+_FLOAT_FORMATS = frozenset("efd")
+_INT_FORMATS = frozenset("bBhHiIlLqQnN")
+
+
+class PackedVecValue(VecValue[TKVal1]):
+    """A vector of floats or integers stored in an `array.array`, without a
+    `FloatValue` or `IntValue` per element. Behaves as the equivalent
+    `VecValue`, boxing the elements only if `values` is accessed. The boxed
+    list is then kept, and used in place of `data` from then on.
+
+    Converts to and from `list[float]`/`list[int]`, `array.array` and NumPy
+    arrays, and is encoded as a packed protobuf vector.
+    """
+
+    data: array
+    _boxed: Optional[list[TierkreisValue]]
+
+    def __init__(self, data: array) -> None:
+        if data.typecode not in _PACKED_ELEMS:
+            raise ValueError(f"Unsupported array typecode: {data.typecode}")
+        # skip the `VecValue` initialiser, which would assign the `values`
+        # property, and initialise the `TierkreisValue` base directly
+        super(VecValue, self).__init__()
+        object.__setattr__(self, "data", data)
+        object.__setattr__(self, "_boxed", None)
+
+    @property
+    def _box(self) -> typing.Type[FloatValue | IntValue]:
+        return FloatValue if self.data.typecode == "d" else IntValue
+
+    @property
+    def values(self) -> list[TKVal1]:  # type: ignore[override]
+        if self._boxed is None:
+            box = self._box
+            object.__setattr__(self, "_boxed", [box(x) for x in self.data])
+        return cast(list[TKVal1], self._boxed)
+
+    def _packed(self) -> Optional[array]:
+        """The elements as an array, or None if the boxed `values` have been
+        changed so that they no longer fit one."""
+        if self._boxed is None:
+            return self.data
+        box = self._box
+        if not all(type(v) is box for v in self._boxed):
+            return None
+        try:
+            return array(
+                self.data.typecode,
+                (cast(FloatValue | IntValue, v).value for v in self._boxed),
+            )
+        except OverflowError:
+            return None
+
+    @property
+    def _elem_type(self) -> typing.Type:
+        return _PACKED_ELEMS[self.data.typecode][0]
+
+    @property
+    def _instance_pytype(self) -> typing.Type:
+        if self._boxed is not None:
+            return super()._instance_pytype
+        return list[self._elem_type]
+
+    def __eq__(self, __o: object) -> bool:
+        if not isinstance(__o, VecValue):
+            return NotImplemented
+        if (data := self._packed()) is None:
+            return super().__eq__(__o)
+        if isinstance(__o, PackedVecValue) and (other := __o._packed()) is not None:
+            return data.typecode == other.typecode and data == other
+        # compare without keeping the boxed elements
+        box = self._box
+        return len(data) == len(__o.values) and all(
+            box(x) == v for x, v in zip(data, __o.values)
+        )
+
+    def __hash__(self) -> int:
+        return hash(self.digest())
+
+    def _digest_impl(self) -> bytes:
+        if (data := self._packed()) is None:
+            return super()._digest_impl()
+        if not data:
+            return _digest_of(b"v")
+        return _packed_digest(data)
+
+    def to_proto(self) -> pg.Value:
+        if (data := self._packed()) is None:
+            return super().to_proto()
+        if sys.byteorder == "big":
+            data = array(data.typecode, data)
+            data.byteswap()
+        if data.typecode == "d":
+            return pg.Value(vec=pg.VecValue(packed_flt=data.tobytes()))
+        return pg.Value(vec=pg.VecValue(packed_int=data.tobytes()))
+
+    def _to_python_impl(self, type_: typing.Type[T]) -> T | None:
+        if (data := self._packed()) is None:
+            return super()._to_python_impl(type_)
+        if type_ is array:
+            return cast(T, array(data.typecode, data))
+        info = _py_type_info(type_)
+        if _is_ndarray(info.origin):
+            np = sys.modules["numpy"]
+            return cast(T, np.array(data))
+        if info.origin is list and info.args and info.args[0] is self._elem_type:
+            return cast(T, data.tolist())
+        return super()._to_python_impl(type_)
+
+    @classmethod
+    def from_bytes(cls, typecode: str, packed: bytes) -> "PackedVecValue":
+        """Decode little-endian packed elements, as found in protobuf."""
+        data = array(typecode)
+        data.frombytes(packed)
+        if sys.byteorder == "big":
+            data.byteswap()
+        return cls(data)
+
+    @classmethod
+    def pack(cls, value: Any, elem_type: Any) -> Optional["PackedVecValue"]:
+        """Pack `value`, a list, tuple, `array.array` or other one-dimensional
+        buffer (e.g. a NumPy array), as a vector of `elem_type` (`float` or
+        `int`). Returns None if that is not possible."""
+        typecode = next(
+            (c for c, (t, _) in _PACKED_ELEMS.items() if t is elem_type), None
+        )
+        if typecode is None:
+            return None
+        try:
+            if isinstance(value, (list, tuple)):
+                # `array` accepts bools as integers, which would lose them
+                if any(isinstance(x, bool) for x in value):
+                    return None
+                return cls(array(typecode, value))
+            with memoryview(value) as view:
+                if view.ndim != 1 or view.format == "?":
+                    return None
+                if (
+                    view.format in _PACKED_ELEMS[typecode][1]
+                    and view.itemsize == 8
+                    and view.c_contiguous
+                ):
+                    data = array(typecode)
+                    data.frombytes(view.cast("B"))
+                    return cls(data)
+                return cls(array(typecode, view.tolist()))
+        except (TypeError, OverflowError):
+            # leave other values to the general conversion
+            return None
+
+    @classmethod
+    def from_buffer(cls, value: Any) -> Optional["PackedVecValue"]:
+        """Pack a one-dimensional buffer (e.g. an `array.array` or NumPy
+        array) of floats or integers, inferring the element type."""
+        try:
+            with memoryview(value) as view:
+                fmt = view.format[-1:]
+        except TypeError:
+            return None
+        if fmt in _FLOAT_FORMATS:
+            return cls.pack(value, float)
+        if fmt in _INT_FORMATS:
+            return cls.pack(value, int)
+        return None
+
+    def __repr__(self) -> str:
+        return f"PackedVecValue({self.data!r})"
+
+
 @dataclass(frozen=True)
 class MapValue(Generic[TKVal1, TKVal2], TierkreisValue):
     """A map from keys of one type to values of another. The key type must be hashable."""
@@ -448,6 +741,25 @@ class MapValue(Generic[TKVal1, TKVal2], TierkreisValue):
         # Would be better to check all keys and all values are the same.
         return dict[key_t, val_t]
 
+    def __eq__(self, __o: object) -> bool:
+        if not isinstance(__o, MapValue):
+            return NotImplemented
+        if _digests_differ(self, __o):
+            return False
+        return self.values == __o.values
+
+    def __hash__(self) -> int:
+        return hash(self.digest())
+
+    def digest(self) -> bytes:
+        # not cached, as the dictionary of values may be modified
+        return self._digest_impl()
+
+    def _digest_impl(self) -> bytes:
+        return _digest_of(
+            b"m", *sorted(k.digest() + v.digest() for k, v in self.values.items())
+        )
+
     def to_proto(self) -> pg.Value:
         return pg.Value(
             map=pg.MapValue(
@@ -513,26 +825,73 @@ class DataclassInstance(Protocol):
 RowStruct = TypeVar("RowStruct", bound=DataclassInstance)
 
 
+class _StructLayout:
+    """The field names of a struct, in order, with an index from name to
+    position. Layouts are interned so structs with the same fields share one."""
+
+    __slots__ = ("names", "index")
+
+    # beyond this many distinct layouts, new ones are not interned
+    _MAX_INTERNED: ClassVar[int] = 4096
+    _interned: ClassVar[dict[tuple[str, ...], "_StructLayout"]] = {}
+
+    def __init__(self, names: tuple[str, ...]) -> None:
+        self.names = names
+        self.index = {name: i for i, name in enumerate(names)}
+
+    @classmethod
+    def of(cls, names: tuple[str, ...]) -> "_StructLayout":
+        if (layout := cls._interned.get(names)) is not None:
+            return layout
+        layout = cls(names)
+        if len(cls._interned) < cls._MAX_INTERNED:
+            cls._interned[names] = layout
+        return layout
+
+
 class StructValue(Generic[RowStruct], TierkreisValue):
     """A composite structure of named fields."""
 
+    __slots__ = ("_layout", "_items", "_digest")
+
     _proto_name: ClassVar[str] = "struct"
-    _struct: RowStruct
+    _layout: _StructLayout
+    _items: tuple[TierkreisValue, ...]
 
     def __init__(self, values: dict[str, TierkreisValue]) -> None:
-        __AnonStruct = make_dataclass("__AnonStruct", values.keys())
-        self._struct = __AnonStruct(**values)
+        self._layout = _StructLayout.of(tuple(values))
+        self._items = tuple(values.values())
 
     def __eq__(self, __o: object) -> bool:
         if not isinstance(__o, StructValue):
             return False
+        if _digests_differ(self, __o):
+            return False
+        if self._layout is __o._layout:
+            return self._items == __o._items
         return self.values == __o.values
 
+    def __hash__(self) -> int:
+        return hash(self.digest())
+
+    def _digest_impl(self) -> bytes:
+        fields = sorted(zip(self._layout.names, self._items), key=lambda f: f[0])
+        return _digest_of(
+            b"s",
+            *(
+                part
+                for name, value in fields
+                for part in (_length_prefixed(name), value.digest())
+            ),
+        )
+
+    def __getitem__(self, name: str) -> TierkreisValue:
+        """The value of field `name`, raising `KeyError` if there is none."""
+        return self._items[self._layout.index[name]]
+
     @property
     def values(self) -> dict[str, TierkreisValue]:
-        return {
-            k: getattr(self._struct, k) for k in (f.name for f in fields(self._struct))
-        }
+        return dict(zip(self._layout.names, self._items))
 
     @property
     def _instance_pytype(self) -> typing.Type:
@@ -550,15 +909,15 @@ class StructValue(Generic[RowStruct], TierkreisValue):
         return pg.Value(struct=pg.StructValue(map=self.to_proto_dict()))
 
     def _to_python_impl(self, type_: typing.Type[T]) -> T | None:
-        type_origin = typing.get_origin(type_) or type_
+        info = _py_type_info(type_)
 
-        if type_origin is tuple:
-            args = typing.get_args(type_)
+        if info.origin is tuple:
+            args = info.args
             arg_vals = _labeled_dict_to_tuple(self.values)
             converted = [v.to_python(args[i]) for i, v in arg_vals]
             return cast(T, tuple(converted))
-        vals = self.values
         if inspect.isclass(type_) and issubclass(type_, OpaqueModel):
+            vals = self.values
             ((fieldname, payload),) = vals.items()  # Exactly one entry
             assert fieldname == type_.tierkreis_field()
             assert isinstance(payload, StringValue)
@@ -572,7 +931,7 @@ class StructValue(Generic[RowStruct], TierkreisValue):
         field_values = {}
         non_init_values = {}
         for field in class_fields:
-            val = vals[field.name]
+            val = self[field.name]
             if field.discriminant is not None:
                 assert isinstance(val, VariantValue)
                 var_types = _get_discriminators(field.type_, field.discriminant)
@@ -615,7 +974,7 @@ class StructValue(Generic[RowStruct], TierkreisValue):
             if field_value is None:
                 return option_none
 
-            union_args = _get_union_args(field.type_)
+            union_args = _py_type_info(field.type_).union_args
             if field.discriminant:
                 # try to figure out which variant the field_value is
                 tag = getattr(field_value, field.discriminant)
@@ -623,7 +982,9 @@ class StructValue(Generic[RowStruct], TierkreisValue):
                 variant_type = None
                 if union_args:
 
-                    def _discriminant_matches(fields: list[ClassField]) -> bool:
+                    def _discriminant_matches(
+                        fields: tuple[ClassField, ...],
+                    ) -> bool:
                         # check if any field has the discriminant field, the
                         # default of which matches the tag
                         return any(
@@ -726,6 +1087,9 @@ class VariantValue(Generic[RowStruct], TierkreisValue):
             variant=pg.VariantValue(tag=self.tag, value=self.value.to_proto())
         )
 
+    def _digest_impl(self) -> bytes:
+        return _digest_of(b"t", _length_prefixed(self.tag), self.value.digest())
+
     def _to_python_impl(self, type_: typing.Type[T]) -> T | None:
         if type_ is NoneType and self.tag == UnionTag.none_type_tag():
             return cast(T, None)
@@ -736,7 +1100,7 @@ class VariantValue(Generic[RowStruct], TierkreisValue):
             if not hasattr(enum_type, self.tag):
                 raise ToPythonFailure(self)
             return getattr(enum_type, self.tag)
-        if args := _get_union_args(type_):
+        if args := _py_type_info(type_).union_args:
             try:
                 tag_type_ = UnionTag.parse_type(self.tag, args)
                 return self.value.to_python(tag_type_)
@@ -762,6 +1126,38 @@ class VariantValue(Generic[RowStruct], TierkreisValue):
 option_none: VariantValue = VariantValue(UnionTag.none_type_tag(), StructValue({}))
 
 
+def _is_ndarray(type_: Any) -> bool:
+    # NumPy is optional; if an annotation or value is an ndarray it is imported
+    np = sys.modules.get("numpy")
+    return np is not None and type_ is np.ndarray
+
+
+@dataclass(frozen=True)
+class _PyTypeInfo:
+    """The result of introspecting a python type annotation, as needed to
+    convert values to and from that annotation."""
+
+    origin: Any
+    args: tuple
+    literal_type: Optional[typing.Type]
+    annotated_type: Optional[typing.Type]
+    union_args: Optional[tuple[typing.Type, ...]]
+
+
+@type_cache
+def _py_type_info(type_: typing.Type) -> _PyTypeInfo:
+    """Introspect a python type annotation once, so converting many values
+    against the same annotation (e.g. the elements of a `list[SomeClass]`)
+    does not repeat the work."""
+    return _PyTypeInfo(
+        origin=typing.get_origin(type_) or type_,
+        args=typing.get_args(type_),
+        literal_type=_extract_literal_type(type_),
+        annotated_type=_is_annotated(type_),
+        union_args=_get_union_args(type_),
+    )
+
+
 def _val_known_type(type_: typing.Type, value: Any) -> TierkreisValue:
     """Convert a python `value` to a TierkreisValue, given a python type annotation."""
     if type_ is int:
@@ -784,8 +1180,9 @@ def _val_known_type(type_: typing.Type, value: Any) -> TierkreisValue:
 
     # types that may contain other types
 
-    type_origin = typing.get_origin(type_) or type_
-    type_args = typing.get_args(type_)
+    info = _py_type_info(type_)
+    type_origin = info.origin
+    type_args = info.args
 
     if type_origin is TierkreisVariant:
         try:
@@ -796,6 +1193,8 @@ def _val_known_type(type_: typing.Type, value: Any) -> TierkreisValue:
 
     if type_origin is tuple:
         if elem_type := _is_var_length_tuple(type_args):
+            if (packed := PackedVecValue.pack(value, elem_type)) is not None:
+                return packed
             return VecValue.from_iterable(
                 TierkreisValue.from_python(v, elem_type) for v in value
             )
@@ -810,6 +1209,8 @@ def _val_known_type(type_: typing.Type, value: Any) -> TierkreisValue:
 
     if type_origin is list:
         if type_args:
+            if (packed := PackedVecValue.pack(value, type_args[0])) is not None:
+                return packed
             return VecValue.from_iterable(
                 TierkreisValue.from_python(v, type_args[0]) for v in value
             )
@@ -832,11 +1233,15 @@ def _val_known_type(type_: typing.Type, value: Any) -> TierkreisValue:
                 TierkreisValue.from_python(value.second, type_args[1]),
             )
         return PairValue.from_tierkreis_pair(value)
-    if inner_type := _extract_literal_type(type_):
+    if type_origin is array or _is_ndarray(type_origin):
+        if (packed := PackedVecValue.from_buffer(value)) is not None:
+            return packed
+        raise IncompatiblePyValue(value)
+    if inner_type := info.literal_type:
         return TierkreisValue.from_python(value, inner_type)
-    if inner_type := _is_annotated(type_):
+    if inner_type := info.annotated_type:
         return TierkreisValue.from_python(value, inner_type)
-    if union_args := _get_union_args(type_):
+    if union_args := info.union_args:
         for possible in union_args:
             # note if some possible type inherits from another possible type, an
             # instance of the child type may be converted as if it were an
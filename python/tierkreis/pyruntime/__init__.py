@@ -2,4 +2,6 @@
 graphs with Python workers. Does not support type checking or connecting to
 workers over the network."""
 
+from .checkpoint import CheckpointStore, SqliteCheckpointStore
+from .map_pool import MapProcessPool
 from .python_runtime import PyRuntime
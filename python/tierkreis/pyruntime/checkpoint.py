@@ -0,0 +1,94 @@
+"""Stores of the outputs of the nodes completed by a `PyRuntime`, from which a
+run interrupted part way through can be resumed."""
+
+import os
+import sqlite3
+from abc import ABC, abstractmethod
+from typing import Iterable, Optional
+
+import tierkreis.core.protos.tierkreis.v1alpha1.graph as pg
+from tierkreis.core.values import TierkreisValue
+
+
+class CheckpointStore(ABC):
+    """Records the values output by completed nodes, on each of their outgoing
+    edges. Nodes are identified by a path, of the run and of the graphs they
+    are nested in, and their index in the innermost graph."""
+
+    @abstractmethod
+    def load(self, path: str, node: int) -> Optional[dict[str, TierkreisValue]]:
+        """The values recorded for the output ports of the node, or None if
+        the node has not been recorded as complete."""
+
+    @abstractmethod
+    def save(self, path: str, node: int, outputs: dict[str, TierkreisValue]) -> None:
+        """Record the values on the output ports of the node, which has
+        completed."""
+
+    @abstractmethod
+    def remove(self, run: str) -> None:
+        """Remove everything recorded for the nodes of `run`, including those
+        of nested graphs."""
+
+
+class SqliteCheckpointStore(CheckpointStore):
+    """Store in an SQLite database, which persists across processes. Each node
+    is recorded in a single transaction, so is either complete or absent."""
+
+    def __init__(self, filename: str | os.PathLike):
+        # autocommit, transactions are managed explicitly
+        self._db = sqlite3.connect(filename, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        # completed nodes, which may have no outgoing edges
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS nodes (path TEXT, node INTEGER,"
+            " PRIMARY KEY (path, node))"
+        )
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS edges ("
+            " path TEXT, node INTEGER, port TEXT, value BLOB,"
+            " PRIMARY KEY (path, node, port))"
+        )
+
+    def load(self, path: str, node: int) -> Optional[dict[str, TierkreisValue]]:
+        key = (path, node)
+        if not self._db.execute(
+            "SELECT 1 FROM nodes WHERE path = ? AND node = ?", key
+        ).fetchone():
+            return None
+        rows: Iterable[tuple[str, bytes]] = self._db.execute(
+            "SELECT port, value FROM edges WHERE path = ? AND node = ?", key
+        )
+        return {
+            port: TierkreisValue.from_proto(pg.Value().parse(value))
+            for port, value in rows
+        }
+
+    def save(self, path: str, node: int, outputs: dict[str, TierkreisValue]) -> None:
+        with self._db:
+            self._db.execute("BEGIN")
+            self._db.execute("INSERT OR REPLACE INTO nodes VALUES (?, ?)", (path, node))
+            self._db.executemany(
+                "INSERT OR REPLACE INTO edges VALUES (?, ?, ?, ?)",
+                [
+                    (path, node, port, bytes(value.to_proto()))
+                    for port, value in outputs.items()
+                ],
+            )
+
+    def remove(self, run: str) -> None:
+        nested = run.replace("%", "\\%").replace("_", "\\_") + "/%"
+        with self._db:
+            self._db.execute("BEGIN")
+            for table in ("nodes", "edges"):
+                self._db.execute(
+                    f"DELETE FROM {table} WHERE path = ? OR path LIKE ? ESCAPE '\\'",
+                    (run, nested),
+                )
+
+    def __len__(self) -> int:
+        """The number of recorded nodes."""
+        return self._db.execute("SELECT COUNT(*) FROM nodes").fetchone()[0]
+
+    def close(self) -> None:
+        self._db.close()
@@ -0,0 +1,94 @@
+"""Run the body graphs of `map` in a pool of processes, for CPU-bound python
+functions which gain no parallelism on a single event loop."""
+
+import asyncio
+from concurrent.futures import ProcessPoolExecutor
+from typing import TYPE_CHECKING, Callable, Optional, cast
+
+import tierkreis.core.protos.tierkreis.v1alpha1.graph as pg
+from tierkreis.core import Labels
+from tierkreis.core.tierkreis_graph import TierkreisGraph
+from tierkreis.core.values import TierkreisValue, VecValue
+
+if TYPE_CHECKING:
+    from multiprocessing.context import BaseContext
+
+    from tierkreis.pyruntime.python_runtime import PyRuntime
+
+
+class MapProcessPool:
+    """A pool of processes, each with its own `PyRuntime`, that a `PyRuntime`
+    can use to run chunks of the elements of a `map`.
+
+    Values are passed to and from the processes as protobuf. The body graph is
+    serialised once per `map` and decoded once per process. Callbacks of the
+    runtime using the pool are not called for edges inside the body graph.
+    """
+
+    def __init__(
+        self,
+        runtime_factory: Callable[[], "PyRuntime"],
+        max_workers: Optional[int] = None,
+        mp_context: Optional["BaseContext"] = None,
+    ):
+        """`runtime_factory` is called in each process to create the runtime
+        used there, so must be picklable (e.g. a module-level function) and
+        provide all functions used by mapped graphs. `max_workers` and
+        `mp_context` are passed to the `ProcessPoolExecutor`."""
+        self._executor = ProcessPoolExecutor(
+            max_workers,
+            mp_context=mp_context,
+            initializer=_init_process,
+            initargs=(runtime_factory,),
+        )
+
+    async def run_chunk(
+        self, body: bytes, chunk: list[TierkreisValue]
+    ) -> list[TierkreisValue]:
+        """Run the serialised graph `body` on each of the values in `chunk` in
+        one of the processes, returning the outputs in the same order."""
+        loop = asyncio.get_running_loop()
+        outs = await loop.run_in_executor(
+            self._executor, _run_chunk, body, bytes(VecValue(chunk).to_proto())
+        )
+        return cast(VecValue, TierkreisValue.from_proto(pg.Value().parse(outs))).values
+
+    def shutdown(self, wait: bool = True) -> None:
+        """Shut down the processes of the pool."""
+        self._executor.shutdown(wait=wait)
+
+    def __enter__(self) -> "MapProcessPool":
+        return self
+
+    def __exit__(self, *_) -> None:
+        self.shutdown()
+
+
+# State of each process in the pool.
+_runtime: Optional["PyRuntime"] = None
+_loop: Optional[asyncio.AbstractEventLoop] = None
+# Decoded body graphs, keyed by their serialisation.
+_graphs: dict[bytes, TierkreisGraph] = {}
+_MAX_GRAPHS = 8
+
+
+def _init_process(runtime_factory: Callable[[], "PyRuntime"]) -> None:
+    global _runtime, _loop
+    _runtime = runtime_factory()
+    _loop = asyncio.new_event_loop()
+
+
+def _run_chunk(body: bytes, chunk: bytes) -> bytes:
+    assert _runtime is not None and _loop is not None
+    runtime = _runtime
+    if (graph := _graphs.get(body)) is None:
+        if len(_graphs) >= _MAX_GRAPHS:
+            _graphs.pop(next(iter(_graphs)))
+        graph = TierkreisGraph.from_proto(pg.Graph().parse(body))
+        _graphs[body] = graph
+    inputs = cast(VecValue, TierkreisValue.from_proto(pg.Value().parse(chunk))).values
+
+    async def run_all() -> list[TierkreisValue]:
+        return [(await runtime.run_graph(graph, value=x))[Labels.VALUE] for x in inputs]
+
+    return bytes(VecValue(_loop.run_until_complete(run_all())).to_proto())
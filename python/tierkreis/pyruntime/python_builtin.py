@@ -379,7 +379,7 @@ async def _or(a: bool, b: bool) -> bool:
 
 async def _partial(_client, _stack, inputs: StructValue) -> StructValue:
     invals = inputs.values
-    thunk = deepcopy(cast(GraphValue, invals.pop("thunk")).value)
+    thunk = cast(GraphValue, invals.pop("thunk")).value
     newg = TierkreisGraph()
     rest_inputs = [port for port in thunk.inputs() if port not in invals]
     inports = map_vals(invals, lambda x: newg.add_const(x)["value"])
@@ -484,8 +484,8 @@ async def remove_key(map: dict[a, b], key: a) -> _RemoveOut[a, b]:
 
 async def _sequence(_client, _stack, inputs: StructValue) -> StructValue:
     invals = cast(dict[str, IncomingWireType], inputs.values)
-    first = deepcopy(cast(GraphValue, invals.pop("first")).value)
-    second = deepcopy(cast(GraphValue, invals.pop("second")).value)
+    first = cast(GraphValue, invals.pop("first")).value
+    second = cast(GraphValue, invals.pop("second")).value
     newg = TierkreisGraph()
     outs1 = newg.insert_graph(
         first, **{port: newg.input[port] for port in first.inputs()}
@@ -545,8 +545,8 @@ namespace.functions["sequence"] = Function(
 
 async def _parallel(_client, _stack, inputs: StructValue) -> StructValue:
     invals = inputs.values
-    left = deepcopy(cast(GraphValue, invals.pop("left")).value)
-    right = deepcopy(cast(GraphValue, invals.pop("right")).value)
+    left = cast(GraphValue, invals.pop("left")).value
+    right = cast(GraphValue, invals.pop("right")).value
     newg = TierkreisGraph()
     outs1 = newg.insert_graph(
         left, **{port: newg.input[port] for port in left.inputs()}
@@ -1,15 +1,21 @@
 """Implementation of simple python-only runtime."""
 
 import asyncio
+import hashlib
+import threading
+import time
+from collections import deque
 from copy import deepcopy
+from dataclasses import dataclass
 from typing import TYPE_CHECKING, Any, Callable, Iterable, Optional, Tuple, cast
+from weakref import WeakKeyDictionary
 
-import networkx as nx
 import requests
 
 from tierkreis.client.runtime_client import RuntimeClient
 from tierkreis.core import Labels
 from tierkreis.core.function import FunctionName
+from tierkreis.core.passes import GraphPass, optimise, standard_passes
 from tierkreis.core.protos.tierkreis.v1alpha1.graph import Output, OutputStream
 from tierkreis.core.signature import Signature
 from tierkreis.core.tierkreis_graph import (
@@ -21,19 +27,24 @@ from tierkreis.core.tierkreis_graph import (
     InputNode,
     MatchNode,
     OutputNode,
+    PortID,
     TagNode,
     TierkreisEdge,
     TierkreisGraph,
+    TierkreisNode,
 )
 from tierkreis.core.type_errors import TierkreisTypeErrors
 from tierkreis.core.type_inference import _TYPE_CHECK, infer_graph_types
 from tierkreis.core.utils import map_vals
 from tierkreis.core.values import StructValue, TierkreisValue, VariantValue, VecValue
 from tierkreis.pyruntime import python_builtin
+from tierkreis.worker.result_cache import run_batch_function, run_function
 
 if TYPE_CHECKING:
-    from tierkreis.core.tierkreis_graph import _EdgeData
-    from tierkreis.worker.namespace import Namespace
+    from tierkreis.pyruntime.checkpoint import CheckpointStore
+    from tierkreis.pyruntime.map_pool import MapProcessPool
+    from tierkreis.worker.namespace import Function, Namespace
+    from tierkreis.worker.result_cache import ResultCache
 
 
 class _ValueNotFound(Exception):
@@ -58,19 +69,140 @@ class FunctionNotFound(Exception):
         super().__init__(f"Function {fname} not found in namespace.")
 
 
+@dataclass(frozen=True)
+class _ExecutionPlan:
+    """A `TierkreisGraph` flattened for execution. Every edge is assigned an
+    integer slot and each node records the slots it reads from and writes to,
+    so running the graph does not need to walk the graph structure again."""
+
+    version: int
+    nodes: list[TierkreisNode]
+    # indexed by slot
+    edges: list[TierkreisEdge]
+    slot_targets: list[int]
+    # indexed by node, (port, slot) for each incoming/outgoing edge
+    in_slots: list[list[tuple[PortID, int]]]
+    out_slots: list[list[tuple[PortID, int]]]
+    # number of incoming edges of each node
+    n_inputs: list[int]
+    # nodes with no incoming edges, which are ready to run at the start
+    initial: list[int]
+    output_node: int
+
+    @classmethod
+    def from_graph(cls, graph: TierkreisGraph) -> "_ExecutionPlan":
+        nodes = list(graph.nodes())
+        edges = list(graph.edges())
+        in_slots: list[list[tuple[PortID, int]]] = [[] for _ in nodes]
+        out_slots: list[list[tuple[PortID, int]]] = [[] for _ in nodes]
+        for slot, edge in enumerate(edges):
+            in_slots[edge.target.node_ref.idx].append((edge.target.port, slot))
+            out_slots[edge.source.node_ref.idx].append((edge.source.port, slot))
+        n_inputs = [len(slots) for slots in in_slots]
+        return cls(
+            version=graph._version,
+            nodes=nodes,
+            edges=edges,
+            slot_targets=[e.target.node_ref.idx for e in edges],
+            in_slots=in_slots,
+            out_slots=out_slots,
+            n_inputs=n_inputs,
+            initial=[node for node, n in enumerate(n_inputs) if n == 0],
+            output_node=graph.output_node_idx,
+        )
+
+
+@dataclass
+class _RunState:
+    """Buffers used while running an `_ExecutionPlan`, which can be reused for
+    repeated runs of the same plan."""
+
+    # values currently on each edge, indexed by slot
+    values: list[Optional[TierkreisValue]]
+    # number of inputs each node is still waiting on, a node is only
+    # scheduled once all of its inputs are available in `values`
+    remaining: list[int]
+
+    @classmethod
+    def for_plan(cls, plan: _ExecutionPlan) -> "_RunState":
+        return cls([None] * len(plan.edges), list(plan.n_inputs))
+
+
+def _chunks(values: list[TierkreisValue], size: int) -> list[list[TierkreisValue]]:
+    return [values[i : i + size] for i in range(0, len(values), size)]
+
+
 class PyRuntime(RuntimeClient):
     """A simplified python-only Tierkreis runtime. Can be used with builtin
     operations and python only namespaces that are locally available."""
 
-    def __init__(self, roots: Iterable["Namespace"], num_workers: int = 1):
+    def __init__(
+        self,
+        roots: Iterable["Namespace"],
+        num_workers: int = 1,
+        map_concurrency: Optional[int] = None,
+        map_chunk_size: int = 1,
+        map_pool: Optional["MapProcessPool"] = None,
+        result_cache: Optional["ResultCache"] = None,
+        optimise_graphs: bool = False,
+        checkpoints: Optional["CheckpointStore"] = None,
+        map_batch_size: int = 1024,
+    ):
         """Initialise with locally available namespaces, and the number of
-        workers (asyncio tasks) to use in execution."""
+        workers (asyncio tasks) to use in execution.
+
+        The elements of a `map` are split into chunks of `map_chunk_size`, of
+        which at most `map_concurrency` (default unbounded) run at once. Chunks
+        run on this runtime, or in the processes of `map_pool` if provided.
+        A `map` of a single function with a batched implementation (see
+        `Namespace.function`) instead runs the elements in batches of up to
+        `map_batch_size`, each in one call of it, of which at most
+        `map_concurrency` run at once. There are no callbacks for the edges of
+        the body, but the result cache and checkpoints below apply to each
+        element. With a `map_pool`, such maps run in the pool element by
+        element instead.
+
+        If a `result_cache` is provided, the outputs of functions declared pure
+        are stored in it and reused for calls with the same inputs.
+
+        If `optimise_graphs`, graphs are run through the `standard_passes` of
+        `tierkreis.core.passes` (with constant folding over the functions of
+        this runtime) before they are run. Callbacks then receive the edges of
+        the optimised graphs.
+
+        If a `checkpoints` store is provided, the outputs of each function and
+        box node are recorded in it as the node completes, keyed by the path of
+        the node through the graphs it is nested in. A run of the same graph on
+        the same inputs, after an earlier run failed or its process died,
+        reuses the recorded outputs instead of running those nodes again. The
+        records of a run are removed once it completes.
+        """
         self.root = deepcopy(python_builtin.namespace)
         for root in roots:
             self.root.merge_namespace(root)
         self.num_workers = num_workers
+        if map_chunk_size < 1:
+            raise ValueError("map_chunk_size must be positive.")
+        if map_batch_size < 1:
+            raise ValueError("map_batch_size must be positive.")
+        self.map_concurrency = map_concurrency
+        self.map_chunk_size = map_chunk_size
+        self.map_batch_size = map_batch_size
+        self.map_pool = map_pool
+        self.result_cache = result_cache
+        self.checkpoints = checkpoints
         self._callback: Optional[Callable[[TierkreisEdge, TierkreisValue], None]] = None
         self.set_callback(None)
+        self._plans: WeakKeyDictionary[TierkreisGraph, _ExecutionPlan] = (
+            WeakKeyDictionary()
+        )
+        self._passes: Optional[list[GraphPass]] = (
+            standard_passes(self.root, self) if optimise_graphs else None
+        )
+        # (version, optimised graph) of each graph run
+        self._optimised: WeakKeyDictionary[
+            TierkreisGraph, tuple[int, TierkreisGraph]
+        ] = WeakKeyDictionary()
 
     def set_callback(
         self, callback: Optional[Callable[[TierkreisEdge, TierkreisValue], None]]
@@ -90,6 +222,67 @@ class PyRuntime(RuntimeClient):
         if self._callback:
             self._callback(edge, val)
 
+    def _batched_call(
+        self, plan: _ExecutionPlan
+    ) -> Optional[tuple["Function", int, list[str], dict[str, TierkreisValue]]]:
+        """If the graph of `plan` only applies a function with a batched
+        implementation to its input `value` (and constants), outputting the
+        result as `value`: the function, the index of its node, the ports the
+        input is passed to and the constant inputs."""
+        calls = [
+            n for n, node in enumerate(plan.nodes) if isinstance(node, FunctionNode)
+        ]
+        if len(calls) != 1:
+            return None
+        call = calls[0]
+        function = self.root.get_function(
+            cast(FunctionNode, plan.nodes[call]).function_name
+        )
+        if function is None or function.run_batch is None:
+            return None
+        ports: list[str] = []
+        consts: dict[str, TierkreisValue] = {}
+        for edge in plan.edges:
+            source = plan.nodes[edge.source.node_ref.idx]
+            target = plan.nodes[edge.target.node_ref.idx]
+            if edge.target.node_ref.idx == call:
+                if isinstance(source, ConstNode):
+                    consts[edge.target.port] = source.value
+                elif isinstance(source, InputNode) and edge.source.port == "value":
+                    ports.append(edge.target.port)
+                else:
+                    return None
+            elif not (
+                edge.source.node_ref.idx == call
+                and edge.source.port == "value"
+                and isinstance(target, OutputNode)
+                and edge.target.port == "value"
+            ):
+                return None
+        if not ports:
+            return None
+        return function, call, ports, consts
+
+    def _execution_plan(self, graph: TierkreisGraph) -> _ExecutionPlan:
+        """Get the execution plan of a graph, reusing the cached plan unless the
+        graph has been modified since it was compiled."""
+        plan = self._plans.get(graph)
+        if plan is None or plan.version != graph._version:
+            plan = _ExecutionPlan.from_graph(graph)
+            self._plans[graph] = plan
+        return plan
+
+    async def _optimised_graph(self, graph: TierkreisGraph) -> TierkreisGraph:
+        """Get the graph to run in place of `graph`, optimised unless the graph
+        has been modified since it was last optimised."""
+        if self._passes is None:
+            return graph
+        cached = self._optimised.get(graph)
+        if cached is None or cached[0] != graph._version:
+            cached = (graph._version, await optimise(graph, self._passes))
+            self._optimised[graph] = cached
+        return cached[1]
+
     async def run_graph(
         self,
         run_g: TierkreisGraph,
@@ -99,55 +292,109 @@ class PyRuntime(RuntimeClient):
         """Run a tierkreis graph using the python runtime, and provided inputs.
         Returns the outputs of the graph.
         """
-        total_nodes = run_g._graph.number_of_nodes()
-        runtime_state: dict["_EdgeData", TierkreisValue] = {}
+        graph = await self._optimised_graph(run_g)
+        plan = self._execution_plan(graph)
+        state = _RunState.for_plan(plan)
+        if self.checkpoints is None:
+            return await self._run_plan(plan, py_inputs, state)
+        # identify the run by the graph and inputs, so a rerun finds its records
+        key = hashlib.sha256(bytes(graph._to_proto_cached()))
+        key.update(
+            StructValue(map_vals(py_inputs, TierkreisValue.from_python)).digest()
+        )
+        run = key.hexdigest()
+        outs = await self._run_plan(plan, py_inputs, state, run)
+        self.checkpoints.remove(run)
+        return outs
+
+    async def _run_nested(
+        self, graph: TierkreisGraph, py_inputs: dict[str, Any], path: Optional[str]
+    ) -> dict[str, TierkreisValue]:
+        """Run a graph nested inside another one, recording checkpoints under
+        `path` (if not None)."""
+        plan = self._execution_plan(await self._optimised_graph(graph))
+        return await self._run_plan(plan, py_inputs, _RunState.for_plan(plan), path)
+
+    async def _run_plan(
+        self,
+        plan: _ExecutionPlan,
+        py_inputs: dict[str, Any],
+        state: _RunState,
+        path: Optional[str] = None,
+    ) -> dict[str, TierkreisValue]:
+        """Run the graph of `plan`, using the buffers of `state`, which are
+        left ready for another run if this one completes. `py_inputs` is
+        emptied once the inputs have been read. If `path` is not
+        None, the outputs of function and box nodes are recorded in (and
+        reused from) the checkpoint store under that path."""
+        runtime_state = state.values
+        remaining_inputs = state.remaining
+        remaining_inputs[:] = plan.n_inputs
 
         async def run_node(node: int) -> dict[str, TierkreisValue]:
-            tk_node = run_g[node]
+            tk_node = plan.nodes[node]
 
             if isinstance(tk_node, OutputNode):
                 return {}
             if isinstance(tk_node, InputNode):
-                return map_vals(py_inputs, TierkreisValue.from_python)
+                inputs = map_vals(py_inputs, TierkreisValue.from_python)
+                # the caller's references are released, each input then lives
+                # only until the node it is passed to has read it
+                py_inputs.clear()
+                return inputs
 
             if isinstance(tk_node, ConstNode):
                 return {Labels.VALUE: tk_node.value}
 
-            in_edges = list(run_g.in_edges(node))
-            while not all(e.to_edge_handle() in runtime_state for e in in_edges):
-                # wait for inputs to become available
-                # only useful if there are other workers that can do things
-                # while this one waits
-                assert self.num_workers > 1
-                await asyncio.sleep(0)
-            try:
-                in_values = (
-                    (e, runtime_state.pop(e.to_edge_handle())) for e in in_edges
-                )
-            except KeyError as key_e:
-                raise InputNotFound(run_g._to_tkedge(key_e.args[0])) from key_e
-
-            inps = {e.target.port: val for e, val in in_values}
+            inps: dict[str, TierkreisValue] = {}
+            for port, slot in plan.in_slots[node]:
+                if runtime_state[slot] is None:
+                    raise InputNotFound(plan.edges[slot])
+                # moved without a local, which would keep the value alive for
+                # as long as this node runs
+                inps[port], runtime_state[slot] = runtime_state[slot], None
+
+            if path is None or not isinstance(tk_node, (FunctionNode, BoxNode)):
+                return await run_inner(tk_node, inps, None)
+            store = cast("CheckpointStore", self.checkpoints)
+            if (recorded := store.load(path, node)) is not None:
+                return recorded
+            outs = await run_inner(tk_node, inps, f"{path}/{node}")
+            ports = [port for port, _ in plan.out_slots[node]]
+            if all(port in outs for port in ports):
+                store.save(path, node, {port: outs[port] for port in ports})
+            return outs
+
+        async def run_inner(
+            tk_node: TierkreisNode,
+            inps: dict[str, TierkreisValue],
+            node_path: Optional[str],
+        ) -> dict[str, TierkreisValue]:
             if isinstance(tk_node, FunctionNode):
                 fname = tk_node.function_name
                 if fname.namespaces == [] and fname.name == "eval":
-                    return await self._run_eval(inps)
+                    return await self._run_eval(inps, node_path)
                 elif fname.namespaces == [] and fname.name == "loop":
-                    return await self._run_loop(inps)
+                    return await self._run_loop(inps, node_path)
                 elif fname.namespaces == [] and fname.name == "map":
-                    return await self._run_map(inps)
+                    return await self._run_map(inps, node_path)
                 else:
                     function = self.root.get_function(fname)
                     if function is None:
                         raise FunctionNotFound(fname)
                     # For now the PyRuntime does not provide a stack trace
-                    return (await function.run(self, dict(), StructValue(inps))).values
+                    outs = await run_function(
+                        function,
+                        fname,
+                        self.result_cache,
+                        self,
+                        dict(),
+                        StructValue(inps),
+                    )
+                    return outs.values
 
             elif isinstance(tk_node, BoxNode):
-                return await self.run_graph(
-                    tk_node.graph,
-                    **inps,
-                )
+                return await self._run_nested(tk_node.graph, inps, node_path)
 
             elif isinstance(tk_node, MatchNode):
                 return self._run_match(inps)
@@ -160,32 +407,56 @@ class PyRuntime(RuntimeClient):
             else:
                 raise RuntimeError("Unknown node type.")
 
+        def assign_outputs(
+            node: int, outs: dict[str, TierkreisValue], ready: Callable[[int], None]
+        ) -> None:
+            for port, slot in plan.out_slots[node]:
+                try:
+                    val = outs.pop(port)
+                except KeyError as key_e:
+                    raise OutputNotFound(plan.edges[slot]) from key_e
+                tkval = (
+                    val
+                    if isinstance(val, TierkreisValue)
+                    else TierkreisValue.from_python(val)
+                )
+                self.callback(plan.edges[slot], tkval)
+                runtime_state[slot] = tkval
+                target = plan.slot_targets[slot]
+                remaining_inputs[target] -= 1
+                if remaining_inputs[target] == 0:
+                    # all inputs have arrived, the target can now run
+                    ready(target)
+
+        def outputs() -> dict[str, TierkreisValue]:
+            outs = {}
+            for port, slot in plan.in_slots[plan.output_node]:
+                outs[port] = cast(TierkreisValue, runtime_state[slot])
+                runtime_state[slot] = None
+            return outs
+
+        if self.num_workers == 1:
+            # run the nodes in the order a single worker task would, without
+            # the cost of creating the task and queue
+            ready = deque(plan.initial)
+            while ready:
+                node = ready.popleft()
+                assign_outputs(node, await run_node(node), ready.append)
+            return outputs()
+
         async def worker(queue: asyncio.Queue[int]):
-            # each worker gets the next node in the queue
+            # each worker gets the next ready node in the queue
             while True:
                 node = await queue.get()
-                # If the node is not yet runnable,
-                # wait/block until it is, do not try to run any other node
-                outs = await run_node(node)
-
-                # assign outputs to edges
-                for out_edge in run_g.out_edges(node):
-                    try:
-                        val = outs.pop(out_edge.source.port)
-                    except KeyError as key_e:
-                        raise OutputNotFound(out_edge) from key_e
-                    tkval = TierkreisValue.from_python(val)
-                    self.callback(out_edge, tkval)
-                    runtime_state[out_edge.to_edge_handle()] = tkval
-                # signal this node is now done
+                assign_outputs(node, await run_node(node), queue.put_nowait)
+                # signal this node is now done, after any newly ready nodes
+                # have been queued so the queue cannot appear complete early
                 queue.task_done()
 
-        que: asyncio.Queue[int] = asyncio.Queue(total_nodes)
-        for node in nx.topological_sort(run_g._graph):
-            # add all node names to the queue in topsort order
-            # if there are fewer workers than nodes, and the queue is populated
-            # in a non-topsort order, some worker may just wait forever for it's
-            # node's inputs to become available.
+        que: asyncio.Queue[int] = asyncio.Queue(len(plan.nodes))
+        # seed the queue with the nodes that need no inputs, the rest are
+        # added by the workers as their inputs become available
+        for node in plan.initial:
             que.put_nowait(node)
 
         workers = [asyncio.create_task(worker(que)) for _ in range(self.num_workers)]
@@ -208,47 +479,119 @@ class PyRuntime(RuntimeClient):
         # Wait until all worker tasks are cancelled.
         await asyncio.gather(*workers, return_exceptions=True)
 
-        return {
-            e.target.port: runtime_state.pop(e.to_edge_handle())
-            for e in run_g.in_edges(run_g.output_node_idx)
-        }
+        return outputs()
 
     async def _run_eval(
-        self, ins: dict[str, TierkreisValue]
+        self, ins: dict[str, TierkreisValue], path: Optional[str] = None
     ) -> dict[str, TierkreisValue]:
         thunk = cast(GraphValue, ins.pop(Labels.THUNK)).value
-        return await self.run_graph(thunk, **ins)
+        return await self._run_nested(thunk, ins, path)
 
     async def _run_loop(
-        self, ins: dict[str, TierkreisValue]
+        self, ins: dict[str, TierkreisValue], path: Optional[str] = None
     ) -> dict[str, TierkreisValue]:
         body = cast(GraphValue, ins.pop("body")).value
+        # prepare the body once, and reuse its buffers for every iteration
+        plan = self._execution_plan(await self._optimised_graph(body))
+        state = _RunState.for_plan(plan)
+        i = 0
         while True:
-            outs = await self.run_graph(
-                body,
-                **ins,
-            )
-            out = cast(
-                VariantValue,
-                outs[Labels.VALUE],
+            outs = await self._run_plan(
+                plan, ins, state, None if path is None else f"{path}/{i}"
             )
-            nxt = {"value": out.value}
+            out = cast(VariantValue, outs.pop(Labels.VALUE))
+            ins = {"value": out.value}
             if out.tag == Labels.BREAK:
-                return nxt
-            else:
-                ins = nxt
+                return ins
+            # the value is now only kept alive by the next iteration's inputs
+            del out
+            # iterations may not otherwise suspend, let other tasks run
+            await asyncio.sleep(0)
+            i += 1
 
     async def _run_map(
-        self, ins: dict[str, TierkreisValue]
+        self, ins: dict[str, TierkreisValue], path: Optional[str] = None
     ) -> dict[str, TierkreisValue]:
-        body = cast(GraphValue, ins.pop("thunk")).value
-        inputs = cast(VecValue, ins.pop("value")).values
-
-        async def task(x):
-            return (await self.run_graph(body, value=x))[Labels.VALUE]
-
-        tasks = [asyncio.create_task(task(x)) for x in inputs]
-        out = await asyncio.gather(*tasks)
+        thunk = cast(GraphValue, ins.pop("thunk"))
+        plan = self._execution_plan(await self._optimised_graph(thunk.value))
+        batched = self._batched_call(plan) if self.map_pool is None else None
+
+        size = self.map_chunk_size if batched is None else self.map_batch_size
+        chunks = _chunks(cast(VecValue, ins.pop("value")).values, size)
+
+        if batched is not None:
+            # each chunk in one call of the batched implementation
+            function, call, ports, consts = batched
+            fname = cast(FunctionNode, plan.nodes[call]).function_name
+            store = None if path is None else cast("CheckpointStore", self.checkpoints)
+
+            async def run_chunk(
+                start: int, chunk: list[TierkreisValue]
+            ) -> list[TierkreisValue]:
+                # the elements are checkpointed as the call node of their own
+                # run of the body would be
+                elem_paths = [f"{path}/{j}" for j in range(start, start + len(chunk))]
+                outs: list[Optional[TierkreisValue]] = [None] * len(chunk)
+                if store is not None:
+                    for k, elem_path in enumerate(elem_paths):
+                        if (recorded := store.load(elem_path, call)) is not None:
+                            outs[k] = recorded[Labels.VALUE]
+                todo = [k for k, out in enumerate(outs) if out is None]
+                if not todo:
+                    return cast(list[TierkreisValue], outs)
+                results = await run_batch_function(
+                    function,
+                    fname,
+                    self.result_cache,
+                    self,
+                    {},
+                    [
+                        StructValue({**consts, **dict.fromkeys(ports, chunk[k])})
+                        for k in todo
+                    ],
+                )
+                for k, result in zip(todo, results):
+                    outs[k] = out = result[Labels.VALUE]
+                    if store is not None:
+                        store.save(elem_paths[k], call, {Labels.VALUE: out})
+                return cast(list[TierkreisValue], outs)
+        elif self.map_pool is not None:
+            pool = self.map_pool
+            # serialise the body once for all the chunks
+            body_proto = bytes(thunk.value._to_proto_cached())
+
+            async def run_chunk(
+                start: int, chunk: list[TierkreisValue]
+            ) -> list[TierkreisValue]:
+                return await pool.run_chunk(body_proto, chunk)
+        else:
+
+            async def run_chunk(
+                start: int, chunk: list[TierkreisValue]
+            ) -> list[TierkreisValue]:
+                state = _RunState.for_plan(plan)
+                outs = []
+                for j, x in enumerate(chunk, start):
+                    elem_path = None if path is None else f"{path}/{j}"
+                    run = await self._run_plan(plan, {"value": x}, state, elem_path)
+                    outs.append(run[Labels.VALUE])
+                return outs
+
+        results: list[list[TierkreisValue]] = [[] for _ in chunks]
+        # each task takes the next chunk not yet started
+        pending = iter(range(len(chunks)))
+
+        async def task() -> None:
+            for i in pending:
+                # release the elements of each chunk as it is run
+                chunk, chunks[i] = chunks[i], []
+                results[i] = await run_chunk(i * size, chunk)
+
+        n_tasks = len(chunks)
+        if self.map_concurrency is not None:
+            n_tasks = min(n_tasks, self.map_concurrency)
+        await asyncio.gather(*(task() for _ in range(n_tasks)))
+        out = [x for chunk_out in results for x in chunk_out]
         ret = {"value": cast(TierkreisValue, VecValue(out))}
         return ret
 
@@ -285,17 +628,64 @@ class VizRuntime(PyRuntime):
     """Child class of ``PyRuntime`` that can interact with a tierkreis-viz instance
     for live graph visualization."""
 
-    def __init__(self, url: str, roots: Iterable["Namespace"], num_workers: int = 1):
+    def __init__(
+        self,
+        url: str,
+        roots: Iterable["Namespace"],
+        num_workers: int = 1,
+        max_outputs: Optional[int] = None,
+        sample_every: int = 1,
+        publish_interval: float = 0.1,
+    ):
         """`url` is the address of the running tierkreis-viz instance. See
         `PyRuntime` for remaining parameters
+
+        Only one in every `sample_every` edge values is sent to the
+        visualization. If `max_outputs` is given, only the latest
+        `max_outputs` of those are kept, so that long runs use bounded memory.
+
+        Edge values are published by a background task, off the event loop,
+        at most once every `publish_interval` seconds, so that the values
+        arriving in between are sent together. Each publication sends all the
+        kept values, so `max_outputs` also bounds its size. An error
+        publishing is raised by `flush`, and so by `run_viz_graph`.
         """
+        if sample_every < 1:
+            raise ValueError("sample_every must be positive.")
         self.url = url
-        self.outputs = OutputStream()
+        self.sample_every = sample_every
+        self.publish_interval = publish_interval
+        self._outputs: deque[Output] = deque(maxlen=max_outputs)
+        self._n_values = 0
+        # whether there are outputs not yet published, and the task publishing
+        self._unpublished = False
+        self._published_at = 0.0
+        self._publisher: Optional[asyncio.Task] = None
+        # reuse connections to the visualization server, with a session per
+        # posting thread as sessions are not thread safe
+        self._sessions = threading.local()
         super().__init__(roots, num_workers)
 
+    @property
+    def outputs(self) -> OutputStream:
+        """The edge values kept from the current run, oldest first."""
+        return OutputStream(stream=list(self._outputs))
+
+    @outputs.setter
+    def outputs(self, outputs: OutputStream) -> None:
+        # replaces the kept values, still keeping at most `max_outputs`
+        self._outputs.clear()
+        self._outputs.extend(outputs.stream)
+
+    def _session(self) -> requests.Session:
+        session: Optional[requests.Session] = getattr(self._sessions, "session", None)
+        if session is None:
+            session = self._sessions.session = requests.Session()
+        return session
+
     def _post(self, endpoint: str, data):
         proto_dat = data.to_proto() if hasattr(data, "to_proto") else data
-        requests.post(
+        self._session().post(
             self.url + endpoint,
             data=bytes(proto_dat),
             headers={"content-type": "application/protobuf"},
@@ -314,7 +704,7 @@ class VizRuntime(PyRuntime):
 
     def viz_graph(self, tg: TierkreisGraph):
         """Send graph to be visualized."""
-        self._post("/api/graph", tg)
+        self._post("/api/graph", tg._to_proto_cached())
         self._post("/api/streamList", OutputStream())
         self._post("/api/typeErrors", TierkreisTypeErrors([]))
 
@@ -326,8 +716,32 @@ class VizRuntime(PyRuntime):
     ) -> dict[str, TierkreisValue]:
         """See ``PyRuntime.run_graph``. Additionally updates the
         visualization with the outputs of each node when they are available."""
-        self.outputs = OutputStream()
-        return await self.run_graph(run_g, **py_inputs)
+        self._outputs.clear()
+        self._n_values = 0
+        try:
+            return await self.run_graph(run_g, **py_inputs)
+        finally:
+            await self.flush()
+
+    async def flush(self) -> None:
+        """Wait until all the edge values so far have been published, raising
+        any error from publishing them."""
+        while (publisher := self._publisher) is not None:
+            try:
+                await publisher
+            finally:
+                if self._publisher is publisher:
+                    self._publisher = None
+
+    async def _publish(self) -> None:
+        while self._unpublished:
+            delay = self._published_at + self.publish_interval - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            self._unpublished = False
+            self._published_at = time.monotonic()
+            # serialised and sent in a thread, the run continues meanwhile
+            await asyncio.to_thread(self._post, "/api/streamList", self.outputs)
 
     def callback(
         self,
@@ -335,5 +749,16 @@ class VizRuntime(PyRuntime):
         val: TierkreisValue,
     ):
         super().callback(edge, val)
-        self.outputs.stream.append(Output(edge=edge.to_proto(), value=val.to_proto()))
-        self._post("/api/streamList", self.outputs)
+        self._n_values += 1
+        if (self._n_values - 1) % self.sample_every:
+            return
+        self._outputs.append(Output(edge=edge.to_proto(), value=val.to_proto()))
+        self._unpublished = True
+        publisher = self._publisher
+        # a failed publisher is kept until `flush` raises its error
+        if publisher is None or (
+            publisher.done()
+            and not publisher.cancelled()
+            and publisher.exception() is None
+        ):
+            self._publisher = asyncio.create_task(self._publish())
@@ -1,7 +1,9 @@
 """Callback client."""
 
+import asyncio
 from contextlib import asynccontextmanager
-from typing import Any, AsyncIterator, Dict
+from dataclasses import dataclass
+from typing import Any, AsyncIterator, Dict, Optional
 from urllib.parse import urlparse
 
 from grpclib.client import Channel
@@ -38,11 +40,73 @@ class Callback(RuntimeClient):
         return await self.runtime.type_check_graph(graph, self.loc)
 
 
+def _channel(uri: str) -> Channel:
+    url = urlparse(uri)
+    host, port = url.hostname, url.port
+    assert host is not None
+    return Channel(host, port)
+
+
 @asynccontextmanager
 async def callback_server(callback: pr.Callback) -> AsyncIterator[RuntimeClient]:
     """Context manager for connection to a callback server."""
-    url = urlparse(callback.uri)
-    host, port = url.hostname, url.port
-    assert host is not None
-    async with Channel(host, port) as channel:
+    async with _channel(callback.uri) as channel:
         yield Callback(channel, callback.loc)
+
+
+@dataclass
+class _PooledChannel:
+    channel: Channel
+    # number of requests currently using the channel
+    users: int = 0
+    # scheduled closing of the channel, while it is idle
+    closer: Optional[asyncio.TimerHandle] = None
+
+
+class CallbackPool:
+    """Channels to callback servers, shared by all the requests with the same
+    callback URI. A channel only connects when a function first makes a
+    callback, and the connection is then kept open for later requests.
+    A channel is closed once it has gone unused for `idle_timeout` seconds,
+    on a timer started when its last request finishes."""
+
+    def __init__(self, idle_timeout: float = 60.0):
+        self.idle_timeout = idle_timeout
+        self._channels: dict[str, _PooledChannel] = {}
+
+    @asynccontextmanager
+    async def connect(self, callback: pr.Callback) -> AsyncIterator[RuntimeClient]:
+        """Context manager for a client of the callback server, using the
+        pooled channel to its URI."""
+        uri = callback.uri
+        if (pooled := self._channels.get(uri)) is None:
+            pooled = _PooledChannel(_channel(uri))
+            self._channels[uri] = pooled
+        elif pooled.closer is not None:
+            pooled.closer.cancel()
+            pooled.closer = None
+        pooled.users += 1
+        try:
+            yield Callback(pooled.channel, callback.loc)
+        finally:
+            pooled.users -= 1
+            if pooled.users == 0:
+                pooled.closer = asyncio.get_running_loop().call_later(
+                    self.idle_timeout, self._close_idle, uri, pooled
+                )
+
+    def _close_idle(self, uri: str, pooled: _PooledChannel) -> None:
+        if self._channels.get(uri) is pooled and pooled.users == 0:
+            del self._channels[uri]
+            pooled.channel.close()
+
+    def close(self) -> None:
+        """Close all the channels of the pool."""
+        while self._channels:
+            _, pooled = self._channels.popitem()
+            if pooled.closer is not None:
+                pooled.closer.cancel()
+            pooled.channel.close()
+
+    def __len__(self) -> int:
+        return len(self._channels)
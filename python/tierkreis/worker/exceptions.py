@@ -40,3 +40,11 @@ class NamespaceClash(Exception):
     def __str__(self) -> str:
         return f"""Clash in namespace {'::'.join(self.namespace)} of functions\n
         {self.functions}"""
+
+
+class QueueFull(Exception):
+    """Too many function calls already waiting to run in the worker."""
+
+    def __init__(self, queued: int):
+        super().__init__(f"{queued} calls are already waiting to run.")
+        self.queued = queued
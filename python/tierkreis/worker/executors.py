@@ -0,0 +1,38 @@
+"""Pools in which worker functions can run, off the event loop of the worker."""
+
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Literal
+
+ExecutorKind = Literal["thread", "process"]
+
+_executors: dict[ExecutorKind, Executor] = {}
+
+
+def set_executor(kind: ExecutorKind, executor: Executor) -> None:
+    """Use `executor` to run the functions registered with `executor=kind`,
+    e.g. to configure the number of workers. Any executor previously used for
+    `kind` is shut down once its pending calls are complete."""
+    if (old := _executors.get(kind)) is not None:
+        old.shutdown(wait=False)
+    _executors[kind] = executor
+
+
+def get_executor(kind: ExecutorKind) -> Executor:
+    """The executor for functions registered with `executor=kind`, created
+    with default settings on first use."""
+    if (executor := _executors.get(kind)) is None:
+        if kind == "thread":
+            executor = ThreadPoolExecutor(thread_name_prefix="tierkreis-function")
+        elif kind == "process":
+            executor = ProcessPoolExecutor()
+        else:
+            raise ValueError(f"Unknown executor kind: {kind}")
+        _executors[kind] = executor
+    return executor
+
+
+def shutdown_executors(wait: bool = True) -> None:
+    """Shut down all executors used to run functions."""
+    while _executors:
+        _, executor = _executors.popitem()
+        executor.shutdown(wait=wait)
@@ -0,0 +1,71 @@
+"""Limits on the number of function calls a worker runs at once."""
+
+import asyncio
+from dataclasses import dataclass
+from types import TracebackType
+from typing import Optional
+
+from .exceptions import QueueFull
+
+
+@dataclass(frozen=True)
+class LimitStats:
+    """Counts of the calls subject to a `ConcurrencyLimit`."""
+
+    # calls currently running
+    running: int
+    # calls currently waiting to run
+    queued: int
+    # most calls that have been waiting at once
+    max_queued: int
+    # calls rejected since the queue was full
+    rejected: int
+
+
+class ConcurrencyLimit:
+    """Async context manager admitting at most `max_concurrent` calls at once.
+    Further calls wait, in the order they arrive, or are rejected with
+    `QueueFull` if `max_queued` (default unbounded) are already waiting."""
+
+    def __init__(self, max_concurrent: int, max_queued: Optional[int] = None):
+        if max_concurrent < 1:
+            raise ValueError("max_concurrent must be positive.")
+        self.max_concurrent = max_concurrent
+        self.max_queued = max_queued
+        self._semaphore = asyncio.Semaphore(max_concurrent)
+        self._running = 0
+        self._queued = 0
+        self._max_queued_seen = 0
+        self._rejected = 0
+
+    async def __aenter__(self) -> None:
+        if self._semaphore.locked():
+            if self.max_queued is not None and self._queued >= self.max_queued:
+                self._rejected += 1
+                raise QueueFull(self._queued)
+            self._queued += 1
+            self._max_queued_seen = max(self._max_queued_seen, self._queued)
+            try:
+                await self._semaphore.acquire()
+            finally:
+                self._queued -= 1
+        else:
+            await self._semaphore.acquire()
+        self._running += 1
+
+    async def __aexit__(
+        self,
+        exc_type: Optional[type[BaseException]],
+        exc: Optional[BaseException],
+        traceback: Optional[TracebackType],
+    ) -> None:
+        self._running -= 1
+        self._semaphore.release()
+
+    def stats(self) -> LimitStats:
+        return LimitStats(
+            running=self._running,
+            queued=self._queued,
+            max_queued=self._max_queued_seen,
+            rejected=self._rejected,
+        )
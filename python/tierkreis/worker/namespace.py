@@ -1,12 +1,18 @@
 """Namespace class for holding namespace definitions of python Tierkreis worker."""
 
+import asyncio
+import collections.abc
 import dataclasses
+import inspect
+import sys
 import typing
 from ctypes import ArgumentError
 from dataclasses import dataclass, make_dataclass
-from functools import wraps
+from functools import lru_cache, wraps
 from inspect import getdoc, isclass
 from typing import (
+    Any,
+    AsyncIterator,
     Awaitable,
     Callable,
     Dict,
@@ -36,8 +42,11 @@ from tierkreis.core.types import (
     UnpackRow,
 )
 from tierkreis.core.values import (
+    PackedVecValue,
     StructValue,
     TierkreisValue,
+    VecValue,
+    _is_ndarray,
 )
 from tierkreis.worker.exceptions import (
     DecodeInputError,
@@ -46,6 +55,7 @@ from tierkreis.worker.exceptions import (
     NodeExecutionError,
 )
 
+from .executors import ExecutorKind, get_executor
 from .tracing import get_tracer, span
 
 tracer = get_tracer(__name__)
@@ -62,6 +72,49 @@ class Function:
 
     run: Callable[[RuntimeClient, Metadata, StructValue], Awaitable[StructValue]]
     declaration: FunctionDeclaration
+    # whether the outputs depend only on the inputs, so may be cached
+    pure: bool = False
+    # most calls a worker runs at once, if limited
+    max_concurrent: Optional[int] = None
+    # for functions outputting a list on port "value" as an async generator,
+    # the elements of the list as each is produced (which `run` collects)
+    stream: Optional[
+        Callable[[RuntimeClient, Metadata, StructValue], AsyncIterator[TierkreisValue]]
+    ] = None
+    # for functions with a batched implementation, the outputs of many calls
+    # computed at once, in the order of their inputs
+    run_batch: Optional[
+        Callable[
+            [RuntimeClient, Metadata, list[StructValue]], Awaitable[list[StructValue]]
+        ]
+    ] = None
+
+
+def _element_hint(hint: Type) -> Type:
+    """The type of the elements of a list, or of a NumPy array annotated with a
+    float or integer dtype (e.g. `numpy.typing.NDArray[numpy.float64]`)."""
+    origin = typing.get_origin(hint)
+    if origin is list:
+        return typing.get_args(hint)[0]
+    if _is_ndarray(origin):
+        np = sys.modules["numpy"]
+        # ndarray[shape, dtype[scalar]]
+        dtype_args = typing.get_args(typing.get_args(hint)[-1])
+        scalar = dtype_args[0] if dtype_args else None
+        if isinstance(scalar, type) and issubclass(scalar, np.floating):
+            return float
+        if isinstance(scalar, type) and issubclass(scalar, np.integer):
+            return int
+    if _is_ndarray(origin) or _is_ndarray(hint):
+        raise ValueError(
+            "Batched functions must annotate NumPy arrays with a float or "
+            "integer dtype, e.g. NDArray[np.float64]."
+        )
+    raise ValueError("Batched functions must take and return lists or arrays.")
+
+
+def _is_array_hint(hint: Type) -> bool:
+    return _is_ndarray(typing.get_origin(hint))
 
 
 def _snake_to_pascal(name: str) -> str:
@@ -90,6 +143,153 @@ def _check_tkstruct_hint(hint: Type) -> bool:
     return tk_cls is not None and isclass(tk_cls) and issubclass(tk_cls, UnpackRow)
 
 
+@dataclass(frozen=True)
+class _FunctionHints:
+    """The python types of the inputs and outputs of a worker function, and
+    the conversions between them and Tierkreis values."""
+
+    # types of the inputs, by name
+    type_hints: dict[str, Type]
+    return_hint: Type
+    # whether the function takes a single `UnpackRow` argument named `inputs`
+    struct_input: bool
+    # whether the function returns an `UnpackRow`
+    struct_output: bool
+    hint_inputs: Type
+    hint_outputs: Type
+    # type of the elements yielded by an async generator function, whose
+    # output is the list of them
+    element_hint: Optional[Type] = None
+
+    def decode_inputs(self, inputs: StructValue) -> dict[str, Any]:
+        try:
+            with span(tracer, name="decoding inputs to python type"):
+                return (
+                    {"inputs": inputs.to_python(self.hint_inputs)}
+                    if self.struct_input
+                    else {
+                        name: val.to_python(self.type_hints[name])
+                        for name, val in inputs.values.items()
+                    }
+                )
+        except Exception as error:
+            raise DecodeInputError(str(error)) from error
+
+    def encode_outputs(self, python_outputs: Any) -> StructValue:
+        try:
+            with span(tracer, name="encoding outputs from python type"):
+                return_type = (
+                    self.hint_outputs if self.struct_output else self.return_hint
+                )
+                outputs = TierkreisValue.from_python(python_outputs, return_type)
+
+        except Exception as error:
+            raise EncodeOutputError(str(error)) from error
+        return (
+            cast(StructValue, outputs)
+            if self.struct_output
+            else StructValue({"value": outputs})
+        )
+
+    def encode_element(self, python_element: Any) -> TierkreisValue:
+        try:
+            return TierkreisValue.from_python(python_element, self.element_hint)
+        except Exception as error:
+            raise EncodeOutputError(str(error)) from error
+
+
+@lru_cache
+def _function_hints(
+    func: Callable, func_name: str, callback: bool, metadata: bool
+) -> _FunctionHints:
+    # Get input and output type hints
+    type_hints = typing.get_type_hints(func)
+
+    if "return" not in type_hints:
+        raise ValueError("Tierkreis function needs return type hint.")
+    return_hint = type_hints.pop("return")
+    element_hint = None
+    if typing.get_origin(return_hint) in (
+        collections.abc.AsyncIterator,
+        collections.abc.AsyncGenerator,
+        collections.abc.AsyncIterable,
+    ):
+        if not inspect.isasyncgenfunction(func):
+            raise ValueError("Only async generator functions may stream outputs.")
+        element_hint = typing.get_args(return_hint)[0]
+        return_hint = list[element_hint]  # type: ignore
+
+    struct_input = "inputs" in type_hints and _check_tkstruct_hint(type_hints["inputs"])
+
+    if callback:
+        try:
+            type_hints.pop(CALLBACK_ARG)
+        except KeyError:
+            raise ArgumentError(
+                "Functions with callbacks must have an argument 'client'"
+            )
+
+    if metadata:
+        try:
+            type_hints.pop(METADATA_ARG)
+        except KeyError:
+            raise ArgumentError(
+                f"Functions asking for metadata values must have an argument '{METADATA_ARG}'"
+            )
+
+    hint_inputs: Type = (
+        type_hints["inputs"]
+        if struct_input
+        else make_dataclass(f"{_snake_to_pascal(func_name)}Inputs", type_hints.items())
+    )
+
+    struct_output = _check_tkstruct_hint(return_hint)
+    hint_outputs: Type = (
+        return_hint
+        if struct_output
+        else make_dataclass(
+            f"{_snake_to_pascal(func_name)}Outputs", [("value", return_hint)]
+        )
+    )
+    return _FunctionHints(
+        type_hints=type_hints,
+        return_hint=return_hint,
+        struct_input=struct_input,
+        struct_output=struct_output,
+        hint_inputs=hint_inputs,
+        hint_outputs=hint_outputs,
+        element_hint=element_hint,
+    )
+
+
+async def _await(awaitable: Awaitable[Any]) -> Any:
+    # `asyncio.run` only accepts coroutines
+    return await awaitable
+
+
+def _run_in_executor(
+    func: Callable,
+    func_name: str,
+    inputs: StructValue,
+    metadata: Optional[dict[str, str | bytes]],
+) -> StructValue:
+    # Runs in a thread or process of an executor. The type hints are found
+    # again from the function, as they cannot be pickled.
+    hints = _function_hints(func, func_name, False, metadata is not None)
+    python_inputs = hints.decode_inputs(inputs)
+    if metadata is not None:
+        python_inputs[METADATA_ARG] = metadata
+    try:
+        python_outputs = func(**python_inputs)
+        if inspect.iscoroutine(python_outputs):
+            python_outputs = asyncio.run(python_outputs)
+        elif inspect.isawaitable(python_outputs):
+            python_outputs = asyncio.run(_await(python_outputs))
+    except Exception as error:
+        raise NodeExecutionError(error) from error
+    return hints.encode_outputs(python_outputs)
+
+
 class Namespace(Mapping[str, "Namespace"]):
     """Namespace containing Tierkreis Functions, keyed by function name.
     Used to construct Tierkreis namespaces from python defined functions in workers.
@@ -183,10 +383,18 @@ class Namespace(Mapping[str, "Namespace"]):
         type_vars: Optional[Dict[Union[str, typing.TypeVar], Kind]] = None,
         callback: bool = False,
         metadata_keys: list[str] | None = None,
+        executor: ExecutorKind | None = None,
+        pure: bool = False,
+        max_concurrent: Optional[int] = None,
+        batched: bool = False,
     ) -> Callable[[Callable], Callable]:
         """Decorator to register a python function as a Tierkreis function
         within the namespace.
 
+        An async generator function, annotated as returning `AsyncIterator[T]`,
+        outputs a list of the values it yields. These are converted as each is
+        yielded, and can be streamed to the caller.
+
         Args:
             name: Optionally explicitly set
                 the name of the function, defaults to None (in which
@@ -204,54 +412,145 @@ class Namespace(Mapping[str, "Namespace"]):
                 `tierkreis_metadata` which is a dictionary with
                 specified keys, mapped to the values present in the
                 function request GRPC metadata.
+            executor: Optionally run the function, including the conversion of
+                its inputs and outputs, in a pool of threads ("thread") or
+                processes ("process") rather than on the event loop of the
+                worker, e.g. for CPU-bound functions. The function may then
+                also be synchronous, and with "process" must be picklable (i.e.
+                defined at module level). Not supported with `callback`. See
+                :mod:`tierkreis.worker.executors` to configure the pools.
+            pure: Whether the outputs of the function depend only on its
+                inputs (and not on metadata, callbacks or other state), so
+                that runtimes and workers with a
+                :class:`~tierkreis.worker.result_cache.ResultCache` may reuse
+                the outputs of previous calls with the same inputs.
+            max_concurrent: Optionally limit the number of calls of the
+                function a :class:`~tierkreis.worker.worker.Worker` runs at
+                once, further calls wait in the worker's queue.
+            batched: Whether the python function is a batched implementation
+                of the declared function, taking a list of values for each
+                input and returning the list of outputs (e.g. vectorized with
+                NumPy, in which case arrays may be returned). Inputs and
+                outputs may also be annotated as NumPy arrays with a float or
+                integer dtype, e.g. `NDArray[np.float64]`. The declared
+                signature has the types of the elements. Single calls run as
+                batches of one, while a `map` of the function in a
+                :class:`~tierkreis.pyruntime.PyRuntime` and calls of it in a
+                single batch request to a worker run as one batch.
         """
 
+        if callback and executor is not None:
+            raise ValueError("Functions with callbacks cannot run in an executor.")
+
         def decorator(func: Callable) -> Callable:
             func_name = name or func.__name__
-
-            # Get input and output type hints
-            type_hints = typing.get_type_hints(func)
-
-            if "return" not in type_hints:
-                raise ValueError("Tierkreis function needs return type hint.")
-            return_hint = type_hints.pop("return")
-
-            struct_input = "inputs" in type_hints and _check_tkstruct_hint(
-                type_hints["inputs"]
+            hints = _function_hints(
+                func, func_name, callback, metadata_keys is not None
             )
-
-            if callback:
-                try:
-                    type_hints.pop(CALLBACK_ARG)
-                except KeyError:
-                    raise ArgumentError(
-                        "Functions with callbacks must have an argument 'client'"
-                    )
-
-            if metadata_keys is not None:
-                try:
-                    type_hints.pop(METADATA_ARG)
-                except KeyError:
-                    raise ArgumentError(
-                        f"Functions asking for metadata values must have an argument '{METADATA_ARG}'"
+            hint_inputs = hints.hint_inputs
+            hint_outputs = hints.hint_outputs
+            element_hints: dict[str, Type] = {}
+            if batched:
+                if executor is not None or hints.element_hint is not None:
+                    raise ValueError(
+                        "Batched functions cannot run in an executor or stream."
                     )
+                if hints.struct_input or hints.struct_output:
+                    raise ValueError("Batched functions cannot use UnpackRow.")
+                # declared with the types of the elements
+                element_hints = {
+                    n: _element_hint(t) for n, t in hints.type_hints.items()
+                }
+                hint_inputs = make_dataclass(
+                    f"{_snake_to_pascal(func_name)}Inputs",
+                    list(element_hints.items()),
+                )
+                hint_outputs = make_dataclass(
+                    f"{_snake_to_pascal(func_name)}Outputs",
+                    [("value", _element_hint(hints.return_hint))],
+                )
+            if hints.element_hint is not None and executor is not None:
+                raise ValueError(
+                    "Functions streaming outputs cannot run in an executor."
+                )
 
-            hint_inputs: Type = (
-                type_hints["inputs"]
-                if struct_input
-                else make_dataclass(
-                    f"{_snake_to_pascal(func_name)}Inputs", type_hints.items()
+            def take_metadata(metadata: Metadata) -> Optional[dict[str, str | bytes]]:
+                # unavailable keys are ignored
+                return (
+                    {k: metadata.pop(k) for k in metadata_keys if k in metadata}
+                    if metadata_keys is not None
+                    else None
                 )
-            )
 
-            struct_output = _check_tkstruct_hint(return_hint)
-            hint_outputs: Type = (
-                return_hint
-                if struct_output
-                else make_dataclass(
-                    f"{_snake_to_pascal(func_name)}Outputs", [("value", return_hint)]
+            def python_inputs(
+                runtime: RuntimeClient,
+                fn_metadata: Optional[dict[str, str | bytes]],
+                inputs: StructValue,
+            ) -> dict[str, Any]:
+                kwargs = hints.decode_inputs(inputs)
+                if callback:
+                    kwargs[CALLBACK_ARG] = runtime
+                if fn_metadata is not None:
+                    kwargs[METADATA_ARG] = fn_metadata
+                return kwargs
+
+            async def stream_func(
+                runtime: RuntimeClient,
+                metadata: Metadata,
+                inputs: StructValue,
+            ) -> AsyncIterator[TierkreisValue]:
+                elements = func(
+                    **python_inputs(runtime, take_metadata(metadata), inputs)
                 )
-            )
+                while True:
+                    try:
+                        element = await anext(elements)
+                    except StopAsyncIteration:
+                        return
+                    except Exception as error:
+                        raise NodeExecutionError(error) from error
+                    yield hints.encode_element(element)
+
+            async def batch_func(
+                runtime: RuntimeClient,
+                metadata: Metadata,
+                inputs: list[StructValue],
+            ) -> list[StructValue]:
+                # the inputs on each port, as a list to be converted together
+                columns: dict[str, TierkreisValue] = {}
+                for port, hint in hints.type_hints.items():
+                    try:
+                        column = VecValue([x[port] for x in inputs])
+                    except KeyError as error:
+                        raise DecodeInputError(f"Missing input {error}") from error
+                    if _is_array_hint(hint):
+                        # packed, so that it converts to a NumPy array
+                        elem = element_hints[port]
+                        packed = PackedVecValue.pack(
+                            [x.to_python(elem) for x in column.values], elem
+                        )
+                        if packed is None:
+                            raise DecodeInputError(f"Cannot pack input {port}")
+                        column = packed
+                    columns[port] = column
+                kwargs = python_inputs(
+                    runtime, take_metadata(metadata), StructValue(columns)
+                )
+                try:
+                    python_outputs = await func(**kwargs)
+                except Exception as error:
+                    raise NodeExecutionError(error) from error
+                if hasattr(python_outputs, "tolist") and not _is_array_hint(
+                    hints.return_hint
+                ):
+                    # e.g. a NumPy array, returned for a list
+                    python_outputs = python_outputs.tolist()
+                outputs = cast(VecValue, hints.encode_outputs(python_outputs)["value"])
+                if len(outputs.values) != len(inputs):
+                    raise EncodeOutputError(
+                        f"{len(outputs.values)} outputs for {len(inputs)} inputs."
+                    )
+                return [StructValue({"value": x}) for x in outputs.values]
 
             # Wrap function with input and output conversions
             @wraps(func)
@@ -260,45 +559,33 @@ class Namespace(Mapping[str, "Namespace"]):
                 metadata: Metadata,
                 inputs: StructValue,
             ) -> StructValue:
-                try:
-                    with span(tracer, name="decoding inputs to python type"):
-                        python_inputs = (
-                            {"inputs": inputs.to_python(hint_inputs)}
-                            if struct_input
-                            else {
-                                name: val.to_python(type_hints[name])
-                                for name, val in inputs.values.items()
-                            }
-                        )
-                except Exception as error:
-                    raise DecodeInputError(str(error)) from error
+                if batched:
+                    (outputs,) = await batch_func(runtime, metadata, [inputs])
+                    return outputs
+                if hints.element_hint is not None:
+                    # collected as they are produced, so only one element is
+                    # held as a python value at a time
+                    elements = stream_func(runtime, metadata, inputs)
+                    return StructValue({"value": VecValue([x async for x in elements])})
+
+                fn_metadata = take_metadata(metadata)
+                if executor is not None:
+                    # convert and run in the pool, leaving the event loop free
+                    return await asyncio.get_running_loop().run_in_executor(
+                        get_executor(executor),
+                        _run_in_executor,
+                        func,
+                        func_name,
+                        inputs,
+                        fn_metadata,
+                    )
 
-                if callback:
-                    python_inputs[CALLBACK_ARG] = runtime
-                if metadata_keys is not None:
-                    # unavailable keys are ignored
-                    python_inputs[METADATA_ARG] = {
-                        k: metadata.pop(k) for k in metadata_keys if k in metadata
-                    }
+                kwargs = python_inputs(runtime, fn_metadata, inputs)
                 try:
-                    python_outputs = await func(**python_inputs)
+                    python_outputs = await func(**kwargs)
                 except Exception as error:
                     raise NodeExecutionError(error) from error
-
-                try:
-                    with span(tracer, name="encoding outputs from python type"):
-                        return_type = hint_outputs if struct_output else return_hint
-                        outputs = TierkreisValue.from_python(
-                            python_outputs, return_type
-                        )
-
-                except Exception as error:
-                    raise EncodeOutputError(str(error)) from error
-                return (
-                    cast(StructValue, outputs)
-                    if struct_output
-                    else StructValue({"value": outputs})
-                )
+                return hints.encode_outputs(python_outputs)
 
             type_vars_by_name = (
                 {_type_var_to_name(var): kind for var, kind in type_vars.items()}
@@ -334,6 +621,10 @@ class Namespace(Mapping[str, "Namespace"]):
                     input_order=_get_ordered_names(hint_inputs),
                     output_order=_get_ordered_names(hint_outputs),
                 ),
+                pure=pure,
+                max_concurrent=max_concurrent,
+                stream=stream_func if hints.element_hint is not None else None,
+                run_batch=batch_func if batched else None,
             )
             return func
 
@@ -0,0 +1,161 @@
+"""Caches of the results of pure worker functions, keyed by a digest of the
+function name and the input values."""
+
+import hashlib
+import os
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from contextlib import suppress
+from pathlib import Path
+from typing import TYPE_CHECKING, Optional, cast
+
+import tierkreis.core.protos.tierkreis.v1alpha1.graph as pg
+from tierkreis.client.runtime_client import RuntimeClient
+from tierkreis.core.function import FunctionName
+from tierkreis.core.values import StructValue
+
+if TYPE_CHECKING:
+    from tierkreis.worker.namespace import Function, Metadata
+
+
+def result_key(function: FunctionName, inputs: StructValue) -> str:
+    """Key for the result of running `function` on `inputs`."""
+    h = hashlib.sha256(str(function).encode())
+    h.update(inputs.digest())
+    return h.hexdigest()
+
+
+class ResultCache(ABC):
+    """Stores the outputs of pure functions, by `result_key`."""
+
+    @abstractmethod
+    def get(self, key: str) -> Optional[StructValue]:
+        """The outputs stored for `key`, if any."""
+
+    @abstractmethod
+    def put(self, key: str, outputs: StructValue) -> None:
+        """Store `outputs` for `key`, possibly evicting other entries."""
+
+
+class MemoryResultCache(ResultCache):
+    """In-memory cache, evicting the least recently used entries once there
+    are more than `max_entries`."""
+
+    def __init__(self, max_entries: int = 1024):
+        self.max_entries = max_entries
+        self._entries: OrderedDict[str, StructValue] = OrderedDict()
+
+    def get(self, key: str) -> Optional[StructValue]:
+        if (outputs := self._entries.get(key)) is not None:
+            self._entries.move_to_end(key)
+        return outputs
+
+    def put(self, key: str, outputs: StructValue) -> None:
+        self._entries[key] = outputs
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+class DiskResultCache(ResultCache):
+    """Cache storing each entry as a protobuf file in `directory`, evicting the
+    least recently used entries once their total size exceeds `max_bytes`.
+    Entries persist across processes."""
+
+    def __init__(self, directory: str | os.PathLike, max_bytes: int = 1 << 30):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        # sizes of the entries, least recently used first
+        self._sizes: OrderedDict[str, int] = OrderedDict()
+        existing = []
+        for path in self.directory.glob("*.pb"):
+            stat = path.stat()
+            existing.append((stat.st_mtime, path.stem, stat.st_size))
+        for _, key, size in sorted(existing):
+            self._sizes[key] = size
+        self._total = sum(self._sizes.values())
+
+    def _path(self, key: str) -> Path:
+        return self.directory / f"{key}.pb"
+
+    def get(self, key: str) -> Optional[StructValue]:
+        # the entry may have been written (or evicted) by another process
+        try:
+            data = self._path(key).read_bytes()
+        except FileNotFoundError:
+            self._total -= self._sizes.pop(key, 0)
+            return None
+        self._total += len(data) - self._sizes.get(key, 0)
+        self._sizes[key] = len(data)
+        self._sizes.move_to_end(key)
+        with suppress(FileNotFoundError):
+            os.utime(self._path(key))
+        return StructValue.from_proto_dict(pg.StructValue().parse(data).map)
+
+    def put(self, key: str, outputs: StructValue) -> None:
+        data = bytes(pg.StructValue(map=outputs.to_proto_dict()))
+        path = self._path(key)
+        # write then rename, so other processes never read a partial entry
+        tmp = path.with_suffix(f".{os.getpid()}.tmp")
+        tmp.write_bytes(data)
+        os.replace(tmp, path)
+        self._total += len(data) - self._sizes.get(key, 0)
+        self._sizes[key] = len(data)
+        self._sizes.move_to_end(key)
+        while self._total > self.max_bytes and len(self._sizes) > 1:
+            old, size = self._sizes.popitem(last=False)
+            self._path(old).unlink(missing_ok=True)
+            self._total -= size
+
+    def __len__(self) -> int:
+        return len(self._sizes)
+
+
+async def run_function(
+    function: "Function",
+    name: FunctionName,
+    cache: Optional[ResultCache],
+    runtime: RuntimeClient,
+    metadata: "Metadata",
+    inputs: StructValue,
+) -> StructValue:
+    """Run `function`, reusing the outputs in `cache` if it is pure and has
+    already been run on the same inputs."""
+    if cache is None or not function.pure:
+        return await function.run(runtime, metadata, inputs)
+    key = result_key(name, inputs)
+    if (outputs := cache.get(key)) is not None:
+        return outputs
+    outputs = await function.run(runtime, metadata, inputs)
+    cache.put(key, outputs)
+    return outputs
+
+
+async def run_batch_function(
+    function: "Function",
+    name: FunctionName,
+    cache: Optional[ResultCache],
+    runtime: RuntimeClient,
+    metadata: "Metadata",
+    inputs: list[StructValue],
+) -> list[StructValue]:
+    """Run the batched implementation of `function` on `inputs`, reusing the
+    outputs in `cache` if it is pure, so that only the inputs it has not
+    already been run on are passed to the batch."""
+    run_batch = function.run_batch
+    assert run_batch is not None
+    if cache is None or not function.pure:
+        return await run_batch(runtime, metadata, inputs)
+    keys = [result_key(name, x) for x in inputs]
+    outputs = [cache.get(key) for key in keys]
+    missing = [i for i, out in enumerate(outputs) if out is None]
+    if missing:
+        computed = await run_batch(runtime, metadata, [inputs[i] for i in missing])
+        for i, out in zip(missing, computed):
+            cache.put(keys[i], out)
+            outputs[i] = out
+    return cast(list[StructValue], outputs)
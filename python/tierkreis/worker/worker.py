@@ -1,11 +1,13 @@
 """Worker server implementation."""
 
+import asyncio
 import functools
 import sys
+from contextlib import AsyncExitStack, asynccontextmanager
 from contextvars import ContextVar
 from tempfile import TemporaryDirectory
 from traceback import print_exception
-from typing import Any, Callable, Coroutine, Optional
+from typing import Any, AsyncIterator, Callable, Coroutine, Optional
 
 import grpclib
 import grpclib.events
@@ -25,17 +27,21 @@ from tierkreis.core.protos.tierkreis.v1alpha1.worker import (
 )
 from tierkreis.core.tierkreis_graph import TierkreisGraph
 from tierkreis.core.type_errors import TierkreisTypeErrors
-from tierkreis.core.values import StructValue
+from tierkreis.core.values import StructValue, TierkreisValue
 from tierkreis.pyruntime.python_runtime import PyRuntime
-from tierkreis.worker.callback import callback_server
+from tierkreis.worker.callback import CallbackPool
 
 from .exceptions import (
     DecodeInputError,
     EncodeOutputError,
     FunctionNotFound,
     NodeExecutionError,
+    QueueFull,
 )
+from .executors import shutdown_executors
+from .limits import ConcurrencyLimit, LimitStats
 from .namespace import Metadata, Namespace
+from .result_cache import ResultCache, run_batch_function, run_function
 from .tracing import _TRACING, context_token, get_tracer, span
 
 tracer = get_tracer(__name__)
@@ -100,12 +106,46 @@ class Worker:
     server: Server
     pyruntime: PyRuntime
     metadata: ContextVar[Metadata]
+    callbacks: CallbackPool
 
-    def __init__(self, root_namespace):
+    def __init__(
+        self,
+        root_namespace: Namespace,
+        result_cache: Optional[ResultCache] = None,
+        max_concurrent: Optional[int] = None,
+        max_queued: Optional[int] = None,
+    ):
+        """Serve the functions of `root_namespace`. If a `result_cache` is
+        provided, the outputs of functions declared pure are stored in it and
+        reused for calls with the same inputs.
+
+        At most `max_concurrent` (default unbounded) function calls run at
+        once, along with the limits of individual functions set by their
+        `max_concurrent`. Calls over a limit wait, before their inputs are
+        decoded, and if `max_queued` (default unbounded) calls are already
+        waiting for the same limit they are rejected with RESOURCE_EXHAUSTED.
+        """
         self.root = root_namespace
-        self.pyruntime = PyRuntime([root_namespace])
+        self.result_cache = result_cache
+        self.max_queued = max_queued
+        self._limit = (
+            ConcurrencyLimit(max_concurrent, max_queued)
+            if max_concurrent is not None
+            else None
+        )
+        # limits of the functions declaring them, created on first call
+        self._function_limits: dict[str, ConcurrencyLimit] = {}
+        # connections back to the runtimes calling functions
+        self.callbacks = CallbackPool()
+        self.pyruntime = PyRuntime([root_namespace], result_cache=result_cache)
         self.server = Server(
-            [SignatureServerImpl(self), WorkerServerImpl(self), RuntimeServerImpl(self)]
+            [
+                SignatureServerImpl(self),
+                WorkerServerImpl(self),
+                BatchWorkerServerImpl(self),
+                StreamingWorkerServerImpl(self),
+                RuntimeServerImpl(self),
+            ]
         )
         self.metadata = ContextVar("metadata")
 
@@ -126,8 +166,78 @@ class Worker:
         if func is None:
             raise FunctionNotFound(function)
 
-        async with callback_server(callback) as cb:
-            return await func.run(cb, metadata, inputs)
+        async with self.callbacks.connect(callback) as cb:
+            return await run_function(
+                func, function, self.result_cache, cb, metadata, inputs
+            )
+
+    async def run_batch(
+        self,
+        function: FunctionName,
+        inputs: list[StructValue],
+        callback: pr.Callback,
+        metadata: Metadata,
+    ) -> list[StructValue]:
+        """Run a function with a batched implementation on all of `inputs` at
+        once, returning the outputs of each. Inputs with outputs in the result
+        cache are left out of the batch."""
+        func = self.root.get_function(function)
+        if func is None or func.run_batch is None:
+            raise FunctionNotFound(function)
+
+        async with self.callbacks.connect(callback) as cb:
+            return await run_batch_function(
+                func, function, self.result_cache, cb, metadata, inputs
+            )
+
+    async def stream(
+        self,
+        function: FunctionName,
+        inputs: StructValue,
+        callback: pr.Callback,
+        metadata: Metadata,
+    ) -> AsyncIterator[TierkreisValue]:
+        """Run a function streaming its outputs, yielding the elements of the
+        list it outputs as each is produced."""
+        func = self.root.get_function(function)
+        if func is None:
+            raise FunctionNotFound(function)
+        if func.stream is None:
+            raise GRPCError(
+                status=StatusCode.FAILED_PRECONDITION,
+                message=f"Function does not stream outputs: {function}",
+            )
+
+        async with self.callbacks.connect(callback) as cb:
+            async for element in func.stream(cb, metadata, inputs):
+                yield element
+
+    @asynccontextmanager
+    async def admit(self, function: FunctionName) -> AsyncIterator[None]:
+        """Context manager waiting until a call of `function` is within the
+        limits of the worker and of the function, and holding its place while
+        it runs. Raises `QueueFull` if too many calls are already waiting."""
+        async with AsyncExitStack() as stack:
+            func = self.root.get_function(function)
+            if func is not None and func.max_concurrent is not None:
+                key = str(function)
+                if (limit := self._function_limits.get(key)) is None:
+                    limit = ConcurrencyLimit(func.max_concurrent, self.max_queued)
+                    self._function_limits[key] = limit
+                # wait for the function first, so that waiting calls do not
+                # hold places of the worker that other functions could use
+                await stack.enter_async_context(limit)
+            if self._limit is not None:
+                await stack.enter_async_context(self._limit)
+            yield
+
+    def limit_stats(self) -> dict[str, LimitStats]:
+        """Statistics of the limit of the worker (as "") and of each function
+        that has been called, by name."""
+        stats = {name: limit.stats() for name, limit in self._function_limits.items()}
+        if self._limit is not None:
+            stats[""] = self._limit.stats()
+        return stats
 
     async def _record_metadata(self, request: grpclib.events.RecvRequest) -> None:
         method_func = request.method_func
@@ -149,7 +259,14 @@ class Worker:
 
     async def start(self, port: Optional[int] = None):
         """Start server."""
+        try:
+            await self._serve(port)
+        finally:
+            # stop any pools used to run functions
+            shutdown_executors(wait=False)
+            self.callbacks.close()
 
+    async def _serve(self, port: Optional[int]):
         if port:
             await self.server.start(port=port)
 
@@ -182,47 +299,184 @@ class WorkerServerImpl(WorkerBase):
     async def run_function(
         self, run_function_request: pw.RunFunctionRequest
     ) -> RunFunctionResponse:
+        return await _run_function(
+            self.worker, run_function_request, self.worker.metadata.get()
+        )
+
+
+class BatchWorkerServerImpl(pw.BatchWorkerBase):
+    worker: Worker
+
+    def __init__(self, worker: Worker):
+        self.worker = worker
+
+    async def run_functions(
+        self, run_functions_request: pw.RunFunctionsRequest
+    ) -> AsyncIterator[pw.RunFunctionsResponse]:
+        metadata = self.worker.metadata.get()
+        calls = run_functions_request.calls
+        # calls of functions with batched implementations, grouped by function
+        # and callback (URI and location) to run as one batch, and the other
+        # calls
+        batches: dict[tuple[str, str, bytes], list[int]] = {}
+        singles: list[int] = []
+        for index, call in enumerate(calls):
+            name = FunctionName.from_proto(call.function)
+            func = self.worker.root.get_function(name)
+            if func is not None and func.run_batch is not None:
+                key = (str(name), call.callback.uri, bytes(call.callback.loc))
+                batches.setdefault(key, []).append(index)
+            else:
+                singles.append(index)
+
+        def error(index: int, err: GRPCError) -> pw.RunFunctionsResponse:
+            return pw.RunFunctionsResponse(
+                index=index,
+                error=pw.FunctionError(
+                    code=err.status.value, message=err.message or ""
+                ),
+            )
+
+        async def run(index: int) -> list[pw.RunFunctionsResponse]:
+            try:
+                # functions may remove the metadata keys they use
+                response = await _run_function(
+                    self.worker, calls[index], dict(metadata)
+                )
+            except GRPCError as err:
+                return [error(index, err)]
+            return [pw.RunFunctionsResponse(index=index, outputs=response.outputs)]
+
+        async def run_batch(indices: list[int]) -> list[pw.RunFunctionsResponse]:
+            try:
+                outputs = await _run_batch(
+                    self.worker, [calls[i] for i in indices], dict(metadata)
+                )
+            except GRPCError as err:
+                return [error(index, err) for index in indices]
+            return [
+                pw.RunFunctionsResponse(index=index, outputs=out)
+                for index, out in zip(indices, outputs)
+            ]
+
+        tasks = [asyncio.create_task(run(index)) for index in singles]
+        tasks.extend(asyncio.create_task(run_batch(ix)) for ix in batches.values())
+        try:
+            for completed in asyncio.as_completed(tasks):
+                for response in await completed:
+                    yield response
+        finally:
+            # stop the remaining calls if the stream is cancelled
+            for task in tasks:
+                task.cancel()
+
+
+class StreamingWorkerServerImpl(pw.StreamingWorkerBase):
+    worker: Worker
+
+    def __init__(self, worker: Worker):
+        self.worker = worker
+
+    async def stream_function(
+        self, run_function_request: pw.RunFunctionRequest
+    ) -> AsyncIterator[pw.RunFunctionChunk]:
         function = run_function_request.function
-        inputs = run_function_request.inputs
-        callback = run_function_request.callback
         metadata = self.worker.metadata.get()
         try:
             function_name = FunctionName.from_proto(function)
+            async with self.worker.admit(function_name):
+                inputs = StructValue.from_proto_dict(run_function_request.inputs.map)
+                async for element in self.worker.stream(
+                    function_name, inputs, run_function_request.callback, metadata
+                ):
+                    yield pw.RunFunctionChunk(values=[element.to_proto()])
+        except _FUNCTION_ERRORS as err:
+            raise _grpc_error(function, err) from err
+
+
+async def _run_function(
+    worker: Worker, run_function_request: pw.RunFunctionRequest, metadata: Metadata
+) -> RunFunctionResponse:
+    function = run_function_request.function
+    inputs = run_function_request.inputs
+    callback = run_function_request.callback
+    try:
+        function_name = FunctionName.from_proto(function)
+        async with worker.admit(function_name):
             inputs_struct = StructValue.from_proto_dict(inputs.map)
-            outputs_struct = await self.worker.run(
+            outputs_struct = await worker.run(
                 function_name, inputs_struct, callback, metadata
             )
             with span(tracer, name="encoding python type in RunFunctionResponse proto"):
                 res = RunFunctionResponse(
                     outputs=pg.StructValue(outputs_struct.to_proto_dict())
                 )
-            return res
-        except DecodeInputError as err:
-            raise GRPCError(
-                status=StatusCode.INVALID_ARGUMENT,
-                message=f"Error while decoding inputs: {err}",
-            ) from err
-        except EncodeOutputError as err:
-            raise GRPCError(
-                status=StatusCode.INTERNAL,
-                message=f"Error while encoding outputs: {err}",
-            ) from err
-        except FunctionNotFound as err:
-            raise GRPCError(
-                status=StatusCode.UNIMPLEMENTED,
-                message=f"Unsupported function: {function}",
-            ) from err
-        except NodeExecutionError as err:
-            # The response resulting from the GRPCError below does not include
-            # the original traceback to avoid leaking implementation details.
-            # The traceback is instead printed to local stderr.
-            print(f"Error in running {function}:", file=sys.stderr)
-            print_exception(err.base_exception)
+        return res
+    except _FUNCTION_ERRORS as err:
+        raise _grpc_error(function, err) from err
+
+
+async def _run_batch(
+    worker: Worker, calls: list[pw.RunFunctionRequest], metadata: Metadata
+) -> list[pg.StructValue]:
+    """Run calls of the same function, with a batched implementation and the
+    same callback, at once."""
+    function = calls[0].function
+    try:
+        function_name = FunctionName.from_proto(function)
+        async with worker.admit(function_name):
+            inputs = [StructValue.from_proto_dict(call.inputs.map) for call in calls]
+            outputs = await worker.run_batch(
+                function_name, inputs, calls[0].callback, metadata
+            )
+            return [pg.StructValue(out.to_proto_dict()) for out in outputs]
+    except _FUNCTION_ERRORS as err:
+        raise _grpc_error(function, err) from err
 
-            raise GRPCError(
-                status=StatusCode.UNKNOWN,
-                message=f"Error while running operation: {repr(err.base_exception)}",
-            ) from err
+
+def _grpc_error(function: pg.FunctionName, err: Exception) -> GRPCError:
+    """The GRPC error reporting `err`, raised while running `function`."""
+    if isinstance(err, QueueFull):
+        return GRPCError(
+            status=StatusCode.RESOURCE_EXHAUSTED,
+            message=f"Worker is at capacity: {err}",
+        )
+    if isinstance(err, DecodeInputError):
+        return GRPCError(
+            status=StatusCode.INVALID_ARGUMENT,
+            message=f"Error while decoding inputs: {err}",
+        )
+    if isinstance(err, EncodeOutputError):
+        return GRPCError(
+            status=StatusCode.INTERNAL,
+            message=f"Error while encoding outputs: {err}",
+        )
+    if isinstance(err, FunctionNotFound):
+        return GRPCError(
+            status=StatusCode.UNIMPLEMENTED,
+            message=f"Unsupported function: {function}",
+        )
+    assert isinstance(err, NodeExecutionError)
+    # The response resulting from the GRPCError below does not include
+    # the original traceback to avoid leaking implementation details.
+    # The traceback is instead printed to local stderr.
+    print(f"Error in running {function}:", file=sys.stderr)
+    print_exception(err.base_exception)
+
+    return GRPCError(
+        status=StatusCode.UNKNOWN,
+        message=f"Error while running operation: {repr(err.base_exception)}",
+    )
+
+
+# errors of running functions reported by `_grpc_error`
+_FUNCTION_ERRORS = (
+    QueueFull,
+    DecodeInputError,
+    EncodeOutputError,
+    FunctionNotFound,
+    NodeExecutionError,
+)
 
 
 class SignatureServerImpl(ps.SignatureBase):
@@ -12,6 +12,16 @@ use tierkreis_core::symbol::{Label, TypeVar};
 
 pub use super::protos_gen::v1alpha1::graph::*;
 fn convert_list(proto_list: VecValue) -> Result<core_graph::Value, ConvertError> {
+    if !proto_list.packed_flt.is_empty() {
+        return unpack_list(&proto_list.packed_flt, |b| {
+            core_graph::Value::Float(f64::from_le_bytes(b))
+        });
+    }
+    if !proto_list.packed_int.is_empty() {
+        return unpack_list(&proto_list.packed_int, |b| {
+            core_graph::Value::Int(i64::from_le_bytes(b))
+        });
+    }
     Ok(core_graph::Value::Vec(
         proto_list
             .vec
@@ -21,6 +31,22 @@ fn convert_list(proto_list: VecValue) -> Result<core_graph::Value, ConvertError>
     ))
 }
 
+/// Decode a packed list of little-endian 64-bit elements
+fn unpack_list(
+    packed: &[u8],
+    elem: impl Fn([u8; 8]) -> core_graph::Value,
+) -> Result<core_graph::Value, ConvertError> {
+    if packed.len() % 8 != 0 {
+        return Err(ConvertError::ProtoError);
+    }
+    Ok(core_graph::Value::Vec(
+        packed
+            .chunks_exact(8)
+            .map(|b| elem(b.try_into().unwrap()))
+            .collect(),
+    ))
+}
+
 impl From<core_symbol::Location> for Location {
     fn from(val: core_symbol::Location) -> Self {
         Location {
@@ -123,6 +149,7 @@ impl From<core_graph::Value> for Value {
             core_graph::Value::Vec(core_list) => Value {
                 value: Some(value::Value::Vec(VecValue {
                     vec: core_list.into_iter().map(Into::into).collect(),
+                    ..Default::default()
                 })),
             },
             core_graph::Value::Struct(fields) => Value {